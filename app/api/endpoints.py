@@ -1,24 +1,81 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
-from fastapi.responses import StreamingResponse
-from core.text import TextFT
-import io
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends, Header, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from pydantic import TypeAdapter, ValidationError
+from typing import List, Optional, Union
+from pathlib import Path
+import asyncio
+import itertools
+import json
+import os
+import tempfile
 
 from common.logger import logger
+from app.schemas.output import OutputParameters
+from app.schemas.preview import PreviewMessage
 from app.schemas.text import TextParameters
-import numpy as n
-
-from core.image_loader_from_buffer import ImageLoaderFromBuffer
-from core.interfaces.image_loader import ImageLoaderInterface
-from core.interfaces.foreground import ForegroundInterface
-from core.interfaces.background import BackgroundInterface
-from core.foreground import Foreground
-from core.background import Background
-from core.composer import Composer
-from common.utils import Position, RGBAColor
-import cv2
+from app.services.archive import stream_zip
+from app.services.composition import (AssetRef, CompositionError, check_upload_size, compose_batch, compose_image,
+                                      compose_variants, compose_video, copy_video_upload, make_encoder, store_asset)
+from app.services.executor import ExecutorSaturatedError, get_executor
+from app.services.metrics import render_metrics
+from app.services.sessions import get_session_store
+from app.services.shared_composition import compose_image_shared
+from app.services.warmup import get_warmup_state
+from core.asset_store import AssetNotFoundError, get_asset_store
+from core.encoders import get_available_formats, negotiate_format
+from core.shared_memory import get_shared_memory_pool
+from core.interfaces.encoder import EncoderInterface
 
 router = APIRouter()
 
+_variants_adapter: TypeAdapter = TypeAdapter(List[TextParameters])
+
+def _select_encoder(output: OutputParameters, accept: Optional[str]) -> EncoderInterface:
+    """
+    The explicit `output_format` wins over the `Accept` header, which wins over $OUTPUT_FORMAT.
+
+    Raises:
+        HTTPException: 406 if nothing acceptable can be produced, 400 on invalid settings.
+    """
+    image_format = output.output_format
+    if not image_format:
+        image_format = negotiate_format(accept)
+        if image_format is None:
+            raise HTTPException(status_code=406,
+                                detail=f"No acceptable image format. Available formats: {get_available_formats()}")
+    try:
+        return make_encoder(image_format, output.quality)
+    except CompositionError as exc:
+        raise HTTPException(status_code=exc.status_code, detail=exc.detail)
+
+def _check_upload(upload: UploadFile) -> None:
+    """Rejects an oversized upload from the size known once it is spooled, before reading it."""
+    try:
+        check_upload_size(upload.size)
+    except CompositionError as exc:
+        raise HTTPException(status_code=exc.status_code, detail=f"'{upload.filename}': {exc.detail}")
+
+async def _read_source(image: Optional[UploadFile], asset_id: Optional[str]) -> Union[bytes, AssetRef]:
+    """
+    The uploaded image, or the stored asset when an `asset_id` is sent instead.
+
+    Raises:
+        HTTPException: 400 unless exactly one of them is sent or if the upload isn't an image, 413 if too large.
+    """
+    if (image is None) == (asset_id is None):
+        raise HTTPException(status_code=400, detail="Send either an image or the asset_id of a stored one.")
+    if image is None:
+        return AssetRef(asset_id=asset_id)
+    if not image.content_type.startswith("image/"):
+        raise HTTPException(status_code=400, detail="Invalid file type. Please upload an image.")
+    _check_upload(image)
+    return await image.read()
+
+def _describe(image: Optional[UploadFile], asset_id: Optional[str]) -> str:
+    return f"file '{image.filename}' ({image.size} bytes)" if image is not None else f"asset '{asset_id}'"
+
 @router.get("/")
 async def root():
     """
@@ -27,54 +84,345 @@ async def root():
     """
     return {"Test": "esmitt"}
 
+@router.get("/status")
+async def status():
+    """
+    Reports the load of the compositing executor (running and waiting jobs), the warmup
+    and, with the "shared" executor, the shared memory segments.
+    """
+    executor = get_executor()
+    status = {**executor.stats(), "warmup": get_warmup_state().to_dict()}
+    if executor.kind == "shared":
+        status["shared_memory"] = get_shared_memory_pool().stats()
+    return status
+
+@router.get("/ready")
+async def ready():
+    """
+    Readiness probe: 200 once the fonts, segmentation graphs and codecs are loaded,
+    503 while warming up (or if the warmup failed). `/` is the liveness probe.
+    """
+    state = get_warmup_state()
+    if state.ready:
+        return state.to_dict()
+    return JSONResponse(status_code=503, content=state.to_dict(), headers={"Retry-After": "1"})
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Latency per pipeline stage, image sizes, cache hit rates and load, in the Prometheus text format."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @router.post("/text-foreground", response_model=dict)
 async def composer_text(
+        image: Optional[UploadFile] = File(None),
+        asset_id: Optional[str] = Form(None, description="ID of an image stored with POST /assets, instead of an upload"),
+        text_parameter: TextParameters = Depends(),
+        output: OutputParameters = Depends(),
+        accept: Optional[str] = Header(None)
+):
+    try:
+        # validate and read the image
+        encoder = _select_encoder(output, accept)
+        image_data: Union[bytes, AssetRef] = await _read_source(image, asset_id)
+
+        # the decoding, segmentation, rendering and encoding run off the event loop
+        executor = get_executor()
+        try:
+            # a stored asset is already mapped by every process, it doesn't go through shared memory
+            if executor.kind == "shared" and not isinstance(image_data, AssetRef):
+                encoded = await compose_image_shared(executor, image_data, text_parameter, encoder, output.max_side)
+            else:
+                encoded = await executor.run(compose_image, image_data, text_parameter, encoder, output.max_side)
+        except ExecutorSaturatedError as exc:
+            logger.warning(f"Rejecting request on {_describe(image, asset_id)}: {exc}")
+            raise HTTPException(status_code=503,
+                                detail="Server busy, please retry later",
+                                headers={"Retry-After": str(exc.retry_after)})
+        except CompositionError as exc:
+            raise HTTPException(status_code=exc.status_code, detail=exc.detail)
+        # the encoder buffer is sent as is, with its length, instead of being copied into a stream
+        return Response(content=encoded.data, media_type=encoder.media_type, headers={"Vary": "Accept"})
+    except HTTPException:
+        raise
+    except Exception as exc:
+        logger.error(f"Error processing request on {_describe(image, asset_id)}: {exc}")
+        raise HTTPException(status_code=500, detail=str(exc))
+
+
+@router.post("/text-foreground/variants")
+async def composer_text_variants(
+        image: Optional[UploadFile] = File(None),
+        asset_id: Optional[str] = Form(None, description="ID of an image stored with POST /assets, instead of an upload"),
+        variants: str = Form(..., description="JSON list of text parameters, one per variant"),
+        segmentation_max_side: Optional[int] = Form(None),
+        output: OutputParameters = Depends()
+):
+    """
+    Composes every text variant on the same image, decoding and segmenting it once.
+    Returns a ZIP with one image per successful variant plus a `manifest.json` describing
+    the outcome (and the error, if any) of every variant.
+    """
+    try:
+        # the Accept header is about the ZIP here, only the explicit format applies
+        encoder = _select_encoder(output, None)
+        try:
+            text_parameters: List[TextParameters] = _variants_adapter.validate_json(variants)
+        except ValidationError as exc:
+            raise HTTPException(status_code=422, detail=f"Invalid variants: {exc}")
+        if not text_parameters:
+            raise HTTPException(status_code=400, detail="At least one variant is required")
+
+        image_data: Union[bytes, AssetRef] = await _read_source(image, asset_id)
+        try:
+            results = await get_executor().run(compose_variants, image_data, text_parameters,
+                                               segmentation_max_side, encoder, output.max_side)
+        except ExecutorSaturatedError as exc:
+            logger.warning(f"Rejecting request on {_describe(image, asset_id)}: {exc}")
+            raise HTTPException(status_code=503,
+                                detail="Server busy, please retry later",
+                                headers={"Retry-After": str(exc.retry_after)})
+        except CompositionError as exc:
+            raise HTTPException(status_code=exc.status_code, detail=exc.detail)
+
+        def entries():
+            for result in results:
+                if result.data is not None:
+                    yield result.name, result.data.data
+            manifest = [result.to_manifest() for result in results]
+            yield "manifest.json", json.dumps(manifest, indent=2).encode()
+
+        return StreamingResponse(stream_zip(entries()),
+                                 media_type="application/zip",
+                                 headers={"Content-Disposition": 'attachment; filename="variants.zip"'})
+    except HTTPException:
+        raise
+    except Exception as exc:
+        logger.error(f"Error processing variants on {_describe(image, asset_id)}: {exc}")
+        raise HTTPException(status_code=500, detail=str(exc))
+
+
+@router.post("/assets")
+async def upload_asset(
         image: UploadFile = File(...),
-        text_parameter: TextParameters = Depends()
+        segmentation_max_side: Optional[int] = Form(None)
 ):
+    """
+    Decodes and segments the image once and stores both on the server. The returned
+    `asset_id` replaces the upload in `/text-foreground` and `/text-foreground/variants`;
+    uploading the same image again returns the same ID.
+    """
+    if not image.content_type.startswith("image/"):
+        raise HTTPException(status_code=400, detail="Invalid file type. Please upload an image.")
+    _check_upload(image)
+    image_data: bytes = await image.read()
     try:
-        # validate image
+        info = await get_executor().run(store_asset, image_data, segmentation_max_side)
+    except ExecutorSaturatedError as exc:
+        logger.warning(f"Rejecting asset upload '{image.filename}': {exc}")
+        raise HTTPException(status_code=503,
+                            detail="Server busy, please retry later",
+                            headers={"Retry-After": str(exc.retry_after)})
+    except CompositionError as exc:
+        raise HTTPException(status_code=exc.status_code, detail=exc.detail)
+    except OSError as exc:
+        logger.error(f"Asset '{image.filename}' not stored: {exc}")
+        raise HTTPException(status_code=507, detail="The image couldn't be stored")
+    return {"asset_id": info.asset_id, "width": info.width, "height": info.height}
+
+
+@router.get("/assets/{asset_id}")
+async def asset_info(asset_id: str):
+    """The dimensions and the disk usage of a stored asset, 404 if unknown or evicted."""
+    try:
+        info = get_asset_store().info(asset_id)
+    except AssetNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Unknown asset '{asset_id}'")
+    return {"asset_id": info.asset_id, "width": info.width, "height": info.height, "size_bytes": info.size_bytes}
+
+
+@router.post("/text-foreground/batch")
+async def composer_text_batch(
+        images: Optional[List[UploadFile]] = File(None),
+        asset_ids: Optional[List[str]] = Form(None),
+        text_parameter: TextParameters = Depends(),
+        output: OutputParameters = Depends()
+):
+    """
+    Applies the same text parameters to every uploaded image, then to every stored asset
+    of `asset_ids`. Every image is a job of the executor: the batch is rejected with 503
+    if not even its first image is admitted, and the images are streamed back in a ZIP as
+    they finish, followed by a `manifest.json` with the outcome of every image (an unknown
+    asset fails alone).
+    """
+    images = images or []
+    asset_ids = asset_ids or []
+    if not images and not asset_ids:
+        raise HTTPException(status_code=400, detail="Send images or the asset_ids of stored ones.")
+    for image in images:
         if not image.content_type.startswith("image/"):
-            raise HTTPException(status_code=400, detail="Invalid file type. Please upload an image.")
-
-        # read the image
-        image_data: bytes = await image.read()
-        image_loader: ImageLoaderInterface = ImageLoaderFromBuffer()
-        if not image_loader.set_source(image_data):
-            raise HTTPException(status_code=400, detail="Failed to set image buffer")
-        if not image_loader.load():
-            raise HTTPException(status_code=400, detail="Failed to load image from buffer")
-
-        # initialize components
-        foreground: ForegroundInterface = Foreground()
-        background: BackgroundInterface = Background()
-
-        # initialize text
-        text_ft = TextFT(text=text_parameter.text,
-                         font_size=text_parameter.font_size,
-                         position=Position(text_parameter.position_x or 0,
-                                           text_parameter.position_y or 0),
-                         font_color=RGBAColor(r=text_parameter.font_color_r,
-                                              g=text_parameter.font_color_g,
-                                              b=text_parameter.font_color_b,
-                                              a=text_parameter.font_color_a))
-
-        available_fonts = text_ft.get_available_fonts()
-        if text_parameter.font_name:
-            if text_parameter.font_name not in available_fonts:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Font '{text_parameter.font_name}' not available. Available fonts: {available_fonts}"
-                )
-            text_ft.font_type = text_parameter.font_name
-        else:
-            text_ft.font_type = available_fonts[0] if available_fonts else None
-
-        # initialize composer
-        composer = Composer(image_loader, foreground, background, text_ft)
-        output_image = composer.get_output()
-        _, buffer = cv2.imencode('.png', output_image)
-        return StreamingResponse(io.BytesIO(buffer.tobytes()), media_type="image/png")
+            raise HTTPException(status_code=400, detail=f"Invalid file type for '{image.filename}'. Please upload images.")
+        _check_upload(image)
+    encoder = _select_encoder(output, None)
+    try:
+        # uploads are spooled by the framework, each one is only read when there is room for it
+        sources = itertools.chain((image.file.read() for image in images),
+                                  (AssetRef(asset_id=asset_id) for asset_id in asset_ids))
+        names = [Path(image.filename or "image").stem for image in images] + asset_ids
+        # the font loading and the first admission block, they run off the event loop
+        results = await run_in_threadpool(compose_batch, get_executor(), sources, text_parameter, names,
+                                          encoder, output.max_side)
+    except ExecutorSaturatedError as exc:
+        logger.warning(f"Rejecting batch of {len(images) + len(asset_ids)} image(s): {exc}")
+        raise HTTPException(status_code=503,
+                            detail="Server busy, please retry later",
+                            headers={"Retry-After": str(exc.retry_after)})
+    except CompositionError as exc:
+        raise HTTPException(status_code=exc.status_code, detail=exc.detail)
+
+    def entries():
+        manifest = []
+        for result in results:
+            manifest.append(result.to_manifest())
+            if result.data is not None:
+                yield result.name, result.data.data
+        manifest.sort(key=lambda item: item["index"])
+        yield "manifest.json", json.dumps(manifest, indent=2).encode()
+
+    return StreamingResponse(stream_zip(entries()),
+                             media_type="application/zip",
+                             headers={"Content-Disposition": 'attachment; filename="batch.zip"'})
+
+
+def _remove_files(*paths: str) -> None:
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+@router.post("/text-foreground/video")
+async def composer_text_video(
+        video: UploadFile = File(...),
+        text_parameter: TextParameters = Depends(),
+        mask_every: int = 1,
+        smoothing: float = 0.0
+):
+    """
+    Puts the text behind the subject of every frame of the uploaded video and streams
+    back the MP4 file (without audio). `mask_every` segments one frame out of N and
+    `smoothing` averages the masks over time, see VideoComposer.
+    """
+    if not video.content_type.startswith("video/"):
+        raise HTTPException(status_code=400, detail="Invalid file type. Please upload a video.")
+    if mask_every < 1 or not 0.0 <= smoothing < 1.0:
+        raise HTTPException(status_code=400, detail="mask_every must be >= 1 and smoothing in [0, 1)")
+
+    # OpenCV reads from files, the upload is copied to disk without loading it in memory
+    suffix = os.path.splitext(video.filename or "")[1] or ".mp4"
+    input_fd, input_path = tempfile.mkstemp(suffix=suffix)
+    output_fd, output_path = tempfile.mkstemp(suffix=".mp4")
+    os.close(output_fd)
+    try:
+        try:
+            with os.fdopen(input_fd, "wb") as input_file:
+                await run_in_threadpool(copy_video_upload, video.file, input_file, video.size)
+            await get_executor().run(compose_video, input_path, output_path, text_parameter, mask_every, smoothing)
+        except ExecutorSaturatedError as exc:
+            logger.warning(f"Rejecting request on file '{video.filename}': {exc}")
+            raise HTTPException(status_code=503,
+                                detail="Server busy, please retry later",
+                                headers={"Retry-After": str(exc.retry_after)})
+        except CompositionError as exc:
+            raise HTTPException(status_code=exc.status_code, detail=exc.detail)
+    except HTTPException:
+        _remove_files(input_path, output_path)
+        raise
     except Exception as exc:
-        logger.error(f"Error processing request on file \'{image.filename}\' ({image.size} bytes): {exc}")
-        raise HTTPException(status_code=500, detail=str(exc))
\ No newline at end of file
+        _remove_files(input_path, output_path)
+        logger.error(f"Error processing video \'{video.filename}\': {exc}")
+        raise HTTPException(status_code=500, detail=str(exc))
+
+    return FileResponse(output_path,
+                        media_type="video/mp4",
+                        filename="composed.mp4",
+                        background=BackgroundTask(_remove_files, input_path, output_path))
+
+
+@router.websocket("/ws/preview")
+async def preview_session(
+        websocket: WebSocket,
+        session_id: Optional[str] = None,
+        segmentation_max_side: Optional[int] = None
+):
+    """
+    Live preview keeping the decoded image, its mask and the Composer on the server.
+
+    - Send the image as a binary message, or `{"type": "open", "asset_id": ...}` for an
+      image stored with POST /assets (or connect with `?session_id=` to resume a live
+      session). The server answers `{"type": "ready", "session_id", "width", "height"}`.
+    - Send `{"type": "update", "params": {...}, "format": "png"|"jpeg"|"webp", "quality": 80}`
+      with the changed TextParameters fields. The server answers a JSON patch header with
+      the region (x, y, width, height), followed by the encoded patch as a binary message.
+    - Send `{"type": "preview", "max_side": 640}` for a downscaled JPEG of the whole output.
+    - Errors are answered with `{"type": "error", "status", "detail"}`: 400 for a malformed
+      message, 503 (with `retry_after`) when the executor is saturated.
+
+    The connection is closed after $SESSION_IDLE_TIMEOUT seconds without messages.
+    """
+    await websocket.accept()
+    store = get_session_store()
+    # the sessions live in this process: their jobs run in local threads of the executor,
+    # admitted against the same limit as the other requests
+    executor = get_executor()
+    session = store.get(session_id) if session_id else None
+    if session is not None:
+        await websocket.send_json({"type": "ready", "session_id": session.session_id,
+                                   "width": session.width, "height": session.height})
+    try:
+        while True:
+            try:
+                message = await asyncio.wait_for(websocket.receive(), timeout=store.idle_timeout)
+            except asyncio.TimeoutError:
+                await websocket.close(code=1000, reason="Idle session")
+                return
+            if message["type"] == "websocket.disconnect":
+                return
+            try:
+                source: Optional[Union[bytes, AssetRef]] = message.get("bytes")
+                request: Optional[PreviewMessage] = None
+                if source is None:
+                    try:
+                        request = PreviewMessage.model_validate_json(message.get("text") or "{}")
+                    except ValidationError as exc:
+                        raise CompositionError(status_code=400, detail=f"Invalid message: {exc}")
+                    if request.type == "open":
+                        if request.asset_id is None:
+                            raise CompositionError(status_code=400, detail="An open message needs an asset_id")
+                        source = AssetRef(asset_id=request.asset_id)
+                if source is not None:
+                    session = await executor.run(store.create, source, segmentation_max_side, local=True)
+                    await websocket.send_json({"type": "ready", "session_id": session.session_id,
+                                               "width": session.width, "height": session.height})
+                    continue
+                if session is None:
+                    raise CompositionError(status_code=400, detail="Send the image first")
+                if request.type == "update":
+                    header, data = await executor.run(store.update, session, request.params,
+                                                      request.format, request.quality, local=True)
+                elif request.type == "preview":
+                    header, data = await executor.run(store.preview, session, request.max_side,
+                                                      request.quality, local=True)
+                else:
+                    store.close(session.session_id)
+                    await websocket.close(code=1000)
+                    return
+                await websocket.send_json(header)
+                await websocket.send_bytes(data)
+            except ExecutorSaturatedError as exc:
+                await websocket.send_json({"type": "error", "status": 503,
+                                           "detail": "Server busy, please retry later", "retry_after": exc.retry_after})
+            except CompositionError as exc:
+                await websocket.send_json({"type": "error", "status": exc.status_code, "detail": exc.detail})
+    except WebSocketDisconnect:
+        return
@@ -1,26 +1,56 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from starlette.concurrency import run_in_threadpool
 from dotenv import load_dotenv
 from app.api.endpoints import router as api_router
-from common.logger import logger
+from app.middleware import MetricsMiddleware, RequestIdMiddleware
+from common.logger import configure_logging, logger
+from app.services.executor import shutdown_executor
+from app.services.warmup import get_warmup_state, warm_up, warmup_enabled
+from core.segmenter_pool import shutdown_segmenter_pool
+from core.shared_memory import shutdown_shared_memory_pool
 
 import uvicorn
 import os
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # the server accepts connections right away (booted) and /ready turns 200 once warm;
+    # mediapipe is only imported by the warmup, not by importing the app
+    warmup_task = None
+    if warmup_enabled():
+        warmup_task = asyncio.create_task(run_in_threadpool(warm_up))
+    else:
+        get_warmup_state().finish(0.0)
+    yield
+    if warmup_task is not None and not warmup_task.done():
+        await warmup_task
+    shutdown_executor()
+    # once the workers are gone, nothing maps the segments any more
+    shutdown_shared_memory_pool()
+    # release the warm segmentation graphs kept by the process-wide pool
+    shutdown_segmenter_pool()
+
 app = FastAPI(title="Text Behind Foreground API",
               description="Send your image",
-              version="1.0.0"
+              version="1.0.0",
+              lifespan=lifespan
               )
 
 app.include_router(api_router)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(RequestIdMiddleware)
 
 
 if __name__ == "__main__":
     os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'  # Suppress INFO and WARNING logs
     load_dotenv()
+    configure_logging()
     logger.info("test")
     uvicorn.run("app.main:app",
                 host="0.0.0.0",
                 port=8000,
                 log_config=None,
-                log_level="debug"
-                )
\ No newline at end of file
+                log_level=os.getenv("LOG_LEVEL", "INFO").lower()
+                )
@@ -0,0 +1,72 @@
+import re
+import time
+import uuid
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.services.metrics import HTTP_IN_FLIGHT, HTTP_REQUESTS, HTTP_SECONDS
+from common.logger import request_id_var
+
+# ids received from clients or proxies are only trusted if they look like one
+_VALID_REQUEST_ID = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+
+class RequestIdMiddleware:
+    def __init__(self, app: ASGIApp, header_name: str = "X-Request-ID"):
+        """
+        Tags every log record written while serving a request with a correlation id,
+        taken from the `header_name` request header or generated, and returned in
+        the same response header. Plain ASGI, so streamed responses aren't buffered.
+        """
+        self._app: ASGIApp = app
+        self._header_name: str = header_name
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] not in ("http", "websocket"):
+            await self._app(scope, receive, send)
+            return
+        request_id = Headers(scope=scope).get(self._header_name, "")
+        if not _VALID_REQUEST_ID.match(request_id):
+            request_id = uuid.uuid4().hex[:16]
+
+        async def send_with_request_id(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).append(self._header_name, request_id)
+            await send(message)
+
+        token = request_id_var.set(request_id)
+        try:
+            await self._app(scope, receive, send_with_request_id)
+        finally:
+            request_id_var.reset(token)
+
+
+class MetricsMiddleware:
+    def __init__(self, app: ASGIApp):
+        """Counts the HTTP requests in flight and records their duration and status per route."""
+        self._app: ASGIApp = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self._app(scope, receive, send)
+            return
+        status: int = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self._app(scope, receive, send_with_status)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            # the route template keeps the label count bounded, unknown paths share one label
+            route = scope.get("route")
+            route_path = getattr(route, "path", "unmatched")
+            HTTP_SECONDS.observe(time.perf_counter() - start, scope["method"], route_path)
+            HTTP_REQUESTS.inc(scope["method"], route_path, str(status))
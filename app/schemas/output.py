@@ -0,0 +1,10 @@
+from pydantic import BaseModel, Field
+from typing import Optional
+
+class OutputParameters(BaseModel):
+    # png, jpeg or webp; when missing the Accept header is negotiated, then $OUTPUT_FORMAT
+    output_format: Optional[str] = None
+    # PNG compression level (0-9) or JPEG/WebP quality (1-100)
+    quality: Optional[int] = None
+    # longest side of the output, the upload is decoded at reduced resolution to match it
+    max_side: Optional[int] = Field(default=None, gt=0)
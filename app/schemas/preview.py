@@ -0,0 +1,16 @@
+from pydantic import BaseModel, Field
+from typing import Any, Dict, Literal, Optional
+
+class PreviewMessage(BaseModel):
+    # a JSON message of the live preview websocket, see preview_session
+    type: Literal["open", "update", "preview", "close"] = "update"
+    # the stored asset an "open" message starts the session on, instead of a binary upload
+    asset_id: Optional[str] = None
+    # the changed TextParameters fields, validated against the session parameters
+    params: Dict[str, Any] = Field(default_factory=dict)
+    # png, jpeg or webp, for the update patches
+    format: str = "png"
+    # JPEG/WebP quality
+    quality: int = Field(default=80, ge=1, le=100)
+    # longest side of the preview frames
+    max_side: int = Field(default=640, gt=0)
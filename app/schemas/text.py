@@ -10,4 +10,5 @@ class TextParameters(BaseModel):
     font_color_g: Optional[int] = 128
     font_color_b: Optional[int] = 128
     font_color_a: Optional[int] = 255
-    font_name: Optional[str] = None
\ No newline at end of file
+    font_name: Optional[str] = None
+    segmentation_max_side: Optional[int] = None
@@ -0,0 +1,265 @@
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+# The parent process must not start any thread before forking: a thread holding a lock
+# (loguru's queue, a native pool) at fork time leaves that lock held forever in the
+# children. The log sinks are created synchronous here and enqueued again in each worker.
+load_dotenv()
+_LOG_ENQUEUE: str = os.getenv("LOG_ENQUEUE", "1")
+os.environ["LOG_ENQUEUE"] = "0"
+
+import uvicorn
+
+from common.logger import configure_logging, logger
+
+
+@dataclass
+class MemoryUsage:
+    pid: int
+    rss_mib: float
+    pss_mib: float
+    shared_mib: float
+    private_mib: float
+
+
+def read_memory(pid: int) -> Optional[MemoryUsage]:
+    """RSS, PSS (shared pages divided among the processes mapping them), shared and private memory."""
+    values: Dict[str, int] = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as rollup:
+            for line in rollup:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    values[parts[0].rstrip(":")] = int(parts[1])
+    except OSError:
+        return None
+    return MemoryUsage(pid=pid,
+                       rss_mib=values.get("Rss", 0) / 1024,
+                       pss_mib=values.get("Pss", 0) / 1024,
+                       shared_mib=(values.get("Shared_Clean", 0) + values.get("Shared_Dirty", 0)) / 1024,
+                       private_mib=(values.get("Private_Clean", 0) + values.get("Private_Dirty", 0)) / 1024)
+
+
+def log_memory_report(pids: List[int]) -> None:
+    usages = [usage for usage in (read_memory(pid) for pid in [os.getpid(), *pids]) if usage is not None]
+    for usage in usages:
+        role = "parent" if usage.pid == os.getpid() else "worker"
+        logger.info(f"{role} {usage.pid}: RSS {usage.rss_mib:.1f} MiB, PSS {usage.pss_mib:.1f} MiB, "
+                    f"shared {usage.shared_mib:.1f} MiB, private {usage.private_mib:.1f} MiB")
+    # the PSS total counts the shared pages once, the RSS total once per process
+    logger.info(f"Total of {len(usages)} process(es): RSS {sum(usage.rss_mib for usage in usages):.1f} MiB, "
+                f"PSS {sum(usage.pss_mib for usage in usages):.1f} MiB")
+
+
+def preload() -> None:
+    """
+    Loads in the parent what the workers only read: the project modules, the mediapipe
+    Python modules and native libraries, the bytes of the $SEGMENTATION_MODEL files, the
+    font scan and the handles of every font at the default size. mediapipe graphs and the
+    executor own native threads, they are created after the fork, by the warmup of each worker.
+    """
+    start = time.perf_counter()
+    import app.main  # noqa: F401, imports FastAPI, OpenCV, PIL and the core modules
+    import mediapipe  # noqa: F401, the import alone doesn't start any thread
+    from core.font_registry import get_font_registry
+    from core.segmentation_backends import SegmentationModel, preload_model
+    model_bytes = preload_model(SegmentationModel.from_env())
+    registry = get_font_registry()
+    fonts = registry.get_fonts()
+    size = int(os.getenv("DEFAULT_FONT_SIZE", "100"))
+    for name in fonts.get_fonts():
+        registry.get_font_handle(fonts.get_font(name), size)
+    logger.info(f"Preloaded {len(fonts.get_fonts())} font(s), {model_bytes / 2 ** 20:.1f} MiB of model and the app "
+                f"in {time.perf_counter() - start:.2f} s")
+
+
+def run_worker(listener: socket.socket, log_level: str) -> None:
+    # runs in the forked child: its own threads, log queue, executor and graphs from here on
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    gc.enable()
+    os.environ["LOG_ENQUEUE"] = _LOG_ENQUEUE
+    configure_logging()
+    from app.main import app
+    config = uvicorn.Config(app, log_config=None, log_level=log_level.lower())
+    uvicorn.Server(config).run(sockets=[listener])
+
+
+# delays before restarting a worker that keeps crashing: 0.5 s, doubled on every crash
+_RESTART_DELAY: float = 0.5
+_MAX_RESTART_DELAY: float = 30.0
+
+
+class PreforkServer:
+    def __init__(self, host: str, port: int, workers: int, report_interval: float = 60.0,
+                 min_uptime: float = 10.0, max_crashes: int = 5):
+        """
+        Preloads the shared assets once, then forks `workers` uvicorn processes accepting
+        on the same socket. Pages the workers don't write stay shared copy-on-write; a
+        worker that exits is replaced. The memory of every process is logged periodically.
+
+        Args:
+            host: The address to bind.
+            port: The port to bind, 0 for an ephemeral one (see `port` once serving).
+            workers: Number of worker processes.
+            report_interval: Seconds between memory reports, 0 only reports once after startup.
+            min_uptime: A worker exiting sooner crashed at startup: it is restarted after a
+                        delay doubling on each consecutive crash, up to 30 s.
+            max_crashes: Consecutive startup crashes of a worker after which the server
+                         stops, 0 never gives up.
+        """
+        if workers < 1:
+            raise ValueError(f"At least one worker is required, got {workers}")
+        self._host: str = host
+        self._port: int = port
+        self._workers: int = workers
+        self._report_interval: float = report_interval
+        self._min_uptime: float = min_uptime
+        self._max_crashes: int = max_crashes
+        self._log_level: str = os.getenv("LOG_LEVEL", "INFO")
+        self._children: Dict[int, int] = {}
+        # per slot: when its worker started, its consecutive startup crashes, when to restart it
+        self._started: Dict[int, float] = {}
+        self._crashes: Dict[int, int] = {}
+        self._restarts: Dict[int, float] = {}
+        self._failed: bool = False
+        self._stopping: bool = False
+        self._listener: Optional[socket.socket] = None
+
+    @property
+    def port(self) -> int:
+        return self._port
+
+    def _fork(self, slot: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(self._listener, self._log_level)
+            except BaseException as exc:
+                logger.exception(f"Worker {slot} failed: {exc}")
+                code = 1
+            finally:
+                logger.complete()
+                os._exit(code)
+        self._children[pid] = slot
+        self._started[slot] = time.monotonic()
+        logger.info(f"Worker {slot} started with pid {pid}")
+
+    def _stop(self, signum: int, _frame) -> None:
+        self._stopping = True
+        for pid in list(self._children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def _reap(self) -> List[int]:
+        slots: List[int] = []
+        while self._children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            slot = self._children.pop(pid, None)
+            if slot is not None:
+                code = os.waitstatus_to_exitcode(status)
+                if self._stopping:
+                    logger.info(f"Worker {slot} (pid {pid}) stopped with status {code}")
+                else:
+                    logger.warning(f"Worker {slot} (pid {pid}) exited with status {code}")
+                slots.append(slot)
+        return slots
+
+    def _schedule_restart(self, slot: int) -> None:
+        now = time.monotonic()
+        if now - self._started.get(slot, now) >= self._min_uptime:
+            self._crashes[slot] = 0
+            self._restarts[slot] = now
+            return
+        crashes = self._crashes.get(slot, 0) + 1
+        self._crashes[slot] = crashes
+        if self._max_crashes and crashes >= self._max_crashes:
+            logger.error(f"Worker {slot} crashed {crashes} times in a row at startup, stopping the server")
+            self._failed = True
+            self._stop(signal.SIGTERM, None)
+            return
+        delay = min(_RESTART_DELAY * 2 ** (crashes - 1), _MAX_RESTART_DELAY)
+        logger.warning(f"Worker {slot} crashed at startup ({crashes} in a row), restarting it in {delay:.1f} s")
+        self._restarts[slot] = now + delay
+
+    def serve(self) -> int:
+        """
+        Serves until SIGINT or SIGTERM.
+
+        Returns:
+            0 once stopped, 1 if a worker kept crashing at startup.
+        """
+        config = uvicorn.Config("app.main:app", host=self._host, port=self._port)
+        self._listener = config.bind_socket()
+        self._port = self._listener.getsockname()[1]
+        # no collection while preloading, then the preloaded objects are moved out of the
+        # collector's reach so the workers' collections don't write to the shared pages
+        gc.disable()
+        preload()
+        gc.freeze()
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGTERM, self._stop)
+        for slot in range(self._workers):
+            self._fork(slot)
+        gc.enable()
+        logger.info(f"Serving on http://{self._host}:{self._port} with {self._workers} worker(s)")
+
+        next_report = time.monotonic() + min(self._report_interval or 10.0, 10.0)
+        reported_once = False
+        while self._children or (self._restarts and not self._stopping):
+            time.sleep(0.5)
+            for slot in self._reap():
+                if not self._stopping:
+                    self._schedule_restart(slot)
+            now = time.monotonic()
+            for slot, restart_at in list(self._restarts.items()):
+                if self._stopping or now >= restart_at:
+                    del self._restarts[slot]
+                    if not self._stopping:
+                        self._fork(slot)
+            if not self._stopping and now >= next_report and (self._report_interval or not reported_once):
+                log_memory_report(list(self._children))
+                reported_once = True
+                next_report = now + (self._report_interval or float("inf"))
+        self._listener.close()
+        logger.info("All workers stopped")
+        return 1 if self._failed else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Serves the API with preloaded, forked workers")
+    parser.add_argument("--host", default=os.getenv("SERVER_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("SERVER_PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("SERVER_WORKERS", str(os.cpu_count() or 1))))
+    parser.add_argument("--report-interval", type=float,
+                        default=float(os.getenv("SERVER_MEMORY_REPORT_INTERVAL", "60")),
+                        help="seconds between memory reports, 0 reports once")
+    parser.add_argument("--min-uptime", type=float, default=float(os.getenv("SERVER_MIN_UPTIME", "10")),
+                        help="a worker exiting sooner crashed at startup, its restarts back off")
+    parser.add_argument("--max-crashes", type=int, default=int(os.getenv("SERVER_MAX_CRASHES", "5")),
+                        help="consecutive startup crashes of a worker before giving up, 0 never gives up")
+    args = parser.parse_args()
+    configure_logging()
+    return PreforkServer(args.host, args.port, args.workers, args.report_interval,
+                         args.min_uptime, args.max_crashes).serve()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
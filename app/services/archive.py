@@ -0,0 +1,36 @@
+import io
+import zipfile
+from typing import Iterable, Iterator, List, Tuple, Union
+
+
+class _ChunkWriter(io.RawIOBase):
+    """Write-only, non-seekable stream keeping what was written until it's drained."""
+    def __init__(self):
+        super().__init__()
+        self._chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(entries: Iterable[Tuple[str, Union[bytes, memoryview]]]) -> Iterator[bytes]:
+    """
+    Builds a ZIP archive on the fly, yielding its bytes entry by entry, so a response
+    can start before all the entries exist. The entries are stored without compression
+    since the images are already compressed.
+    """
+    writer = _ChunkWriter()
+    with zipfile.ZipFile(writer, mode="w", compression=zipfile.ZIP_STORED) as archive:
+        for name, data in entries:
+            archive.writestr(name, data)
+            yield writer.drain()
+    yield writer.drain()
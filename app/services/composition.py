@@ -0,0 +1,389 @@
+import os
+from dataclasses import dataclass, field
+from typing import BinaryIO, Iterable, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+from app.schemas.text import TextParameters
+from app.services.executor import BoundedExecutor, ExecutorSaturatedError
+from common.logger import logger
+from common.utils import Position, RGBAColor
+from core.asset_store import AssetInfo, AssetStore, get_asset_store
+from core.background import Background
+from core.batch import BatchComposer, BatchResult
+from core.composer import Composer
+from core.encoders import get_encoder
+from core.foreground import Foreground, MaskForeground
+from core.image_loader_from_asset import ImageLoaderFromAsset
+from core.image_loader_from_buffer import ImageLoaderFromBuffer, ImageTooLargeError
+from core.interfaces.background import BackgroundInterface
+from core.interfaces.encoder import EncoderInterface
+from core.interfaces.foreground import ForegroundInterface
+from core.interfaces.image_loader import ImageLoaderInterface
+from core.segmenter_pool import get_segmenter_pool
+from core.text import TextFT
+from core.video import VideoComposer, VideoTooLongError
+
+# the threshold the Composer segments with, part of the mask cache and asset keys
+MASK_THRESHOLD: float = 0.95
+
+
+class CompositionError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        """An error to be reported to the client with the given HTTP status code."""
+        super().__init__(status_code, detail)
+        self.status_code: int = status_code
+        self.detail: str = detail
+
+
+def build_text(text_parameter: TextParameters) -> TextFT:
+    """
+    Creates the text object described by the request parameters.
+
+    Raises:
+        CompositionError: If the requested font isn't available or can't be loaded at the requested size.
+    """
+    try:
+        text_ft = TextFT(text=text_parameter.text,
+                         font_size=text_parameter.font_size,
+                         position=Position(text_parameter.position_x or 0,
+                                           text_parameter.position_y or 0),
+                         font_color=RGBAColor(r=text_parameter.font_color_r,
+                                              g=text_parameter.font_color_g,
+                                              b=text_parameter.font_color_b,
+                                              a=text_parameter.font_color_a))
+    except ValueError as exc:
+        raise CompositionError(status_code=422, detail=f"Invalid text parameters: {exc}")
+
+    available_fonts = text_ft.get_available_fonts()
+    if text_parameter.font_name:
+        if text_parameter.font_name not in available_fonts:
+            raise CompositionError(
+                status_code=400,
+                detail=f"Font '{text_parameter.font_name}' not available. Available fonts: {available_fonts}"
+            )
+        text_ft.font_type = text_parameter.font_name
+    else:
+        text_ft.font_type = available_fonts[0] if available_fonts else None
+    return text_ft
+
+
+@dataclass(frozen=True)
+class AssetRef:
+    """An image of the asset store to compose, instead of an uploaded one."""
+    asset_id: str
+
+
+@dataclass
+class ComposedResult:
+    index: int
+    name: str
+    data: Optional[np.ndarray] = None
+    error: Optional[str] = None
+    parameters: dict = field(default_factory=dict)
+
+    def to_manifest(self) -> dict:
+        return {"index": self.index,
+                "file": self.name if self.data is not None else None,
+                "status": "ok" if self.data is not None else "error",
+                "error": self.error,
+                "parameters": self.parameters}
+
+
+def check_upload_size(size: Optional[int]) -> None:
+    """
+    Rejects uploads larger than $MAX_UPLOAD_BYTES (50 MiB by default, 0 disables it).
+
+    Raises:
+        CompositionError: With status 413 if the upload is too large.
+    """
+    max_bytes: int = int(os.getenv("MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+    if max_bytes and size is not None and size > max_bytes:
+        raise CompositionError(status_code=413, detail=f"Upload of {size} bytes exceeds the limit of {max_bytes} bytes")
+
+
+def copy_video_upload(source: BinaryIO, destination: BinaryIO, size: Optional[int] = None,
+                      chunk_size: int = 1024 * 1024) -> int:
+    """
+    Copies the uploaded video to disk, up to $MAX_VIDEO_BYTES (500 MiB by default, 0 disables it).
+    The announced size is checked first, the bytes copied are counted as well since a client
+    can announce less than it sends.
+
+    Returns:
+        The number of bytes copied.
+
+    Raises:
+        CompositionError: With status 413 if the video is too large.
+    """
+    max_bytes: int = int(os.getenv("MAX_VIDEO_BYTES", str(500 * 1024 * 1024)))
+    if max_bytes and size is not None and size > max_bytes:
+        raise CompositionError(status_code=413, detail=f"Video of {size} bytes exceeds the limit of {max_bytes} bytes")
+    copied = 0
+    while chunk := source.read(chunk_size):
+        copied += len(chunk)
+        if max_bytes and copied > max_bytes:
+            raise CompositionError(status_code=413, detail=f"Video exceeds the limit of {max_bytes} bytes")
+        destination.write(chunk)
+    return copied
+
+
+def load_image(image_data: bytes, max_side: Optional[int] = None) -> ImageLoaderInterface:
+    """
+    Decodes the uploaded image, checking its size and pixel count first.
+
+    Args:
+        image_data: The encoded image.
+        max_side: If set, the image is decoded at reduced resolution to fit this longest side.
+
+    Raises:
+        CompositionError: If the buffer isn't a valid image or exceeds the limits.
+    """
+    check_upload_size(len(image_data))
+    image_loader: ImageLoaderInterface = ImageLoaderFromBuffer(max_side=max_side)
+    if not image_loader.set_source(image_data):
+        raise CompositionError(status_code=400, detail="Failed to set image buffer")
+    try:
+        loaded: bool = image_loader.load()
+    except ImageTooLargeError as exc:
+        raise CompositionError(status_code=413, detail=str(exc))
+    if not loaded:
+        raise CompositionError(status_code=400, detail="Failed to load image from buffer")
+    return image_loader
+
+
+def _asset_mask_name(foreground: Foreground) -> str:
+    return AssetStore.mask_name(get_segmenter_pool().model_id, MASK_THRESHOLD, foreground.max_side)
+
+
+def store_asset(image_data: bytes, segmentation_max_side: Optional[int] = None) -> AssetInfo:
+    """
+    Decodes and segments the upload once and keeps both in the asset store. Uploading
+    the same bytes again returns the stored asset without decoding anything.
+
+    Raises:
+        CompositionError: If the buffer isn't a valid image, exceeds the limits or can't be segmented.
+    """
+    check_upload_size(len(image_data))
+    store = get_asset_store()
+    asset_id = store.make_id(image_data)
+    if store.contains(asset_id):
+        return store.info(asset_id)
+    source: np.ndarray = load_image(image_data).get_source()
+    foreground = Foreground(max_side=segmentation_max_side)
+    if not foreground.extract(source, MASK_THRESHOLD):
+        raise CompositionError(status_code=500, detail="Failed to segment the image")
+    return store.put(asset_id, source, _asset_mask_name(foreground), foreground.get_mask())
+
+
+def open_image(image: Union[bytes, AssetRef],
+               max_side: Optional[int] = None,
+               segmentation_max_side: Optional[int] = None) -> Tuple[ImageLoaderInterface, ForegroundInterface]:
+    """
+    The image loader and the foreground of an upload or of a stored asset. The mask of an
+    asset is read from the store; one computed with other segmentation settings is stored
+    for the next requests.
+
+    Raises:
+        CompositionError: If the image can't be loaded (404 for an unknown asset) or segmented.
+    """
+    foreground = Foreground(max_side=segmentation_max_side)
+    if not isinstance(image, AssetRef):
+        return load_image(image, max_side), foreground
+    image_loader = ImageLoaderFromAsset(max_side=max_side)
+    if not image_loader.set_source(image.asset_id) or not image_loader.load():
+        raise CompositionError(status_code=404, detail=f"Unknown asset '{image.asset_id}'")
+    mask_name = _asset_mask_name(foreground)
+    mask = image_loader.get_mask(mask_name)
+    if mask is None:
+        if not foreground.extract(image_loader.get_source(), MASK_THRESHOLD):
+            raise CompositionError(status_code=500, detail="Failed to segment the image")
+        mask = foreground.get_mask()
+        if not image_loader.resized:
+            try:
+                get_asset_store().put_mask(image.asset_id, mask_name, mask)
+            except OSError as exc:
+                logger.warning(f"Mask of asset {image.asset_id} not stored: {exc}")
+    return image_loader, MaskForeground(mask)
+
+
+def make_encoder(image_format: Optional[str] = None, level: Optional[int] = None) -> EncoderInterface:
+    """
+    Creates the output encoder, see core.encoders.get_encoder.
+
+    Raises:
+        CompositionError: If the format is unknown or the level out of range.
+    """
+    try:
+        return get_encoder(image_format, level)
+    except ValueError as exc:
+        raise CompositionError(status_code=400, detail=str(exc))
+
+
+def encode_output(output_image: np.ndarray, encoder: EncoderInterface) -> np.ndarray:
+    """
+    Raises:
+        CompositionError: With status 500 if the encoder fails.
+    """
+    try:
+        return encoder.encode(output_image)
+    except ValueError as exc:
+        raise CompositionError(status_code=500, detail=str(exc))
+
+
+def compose_image(image_data: Union[bytes, AssetRef],
+                  text_parameter: TextParameters,
+                  encoder: Optional[EncoderInterface] = None,
+                  max_side: Optional[int] = None) -> np.ndarray:
+    """
+    Runs the whole CPU-bound pipeline (decode, segmentation, text, compositing and
+    encoding). Meant to run in a worker of the executor, not on the event loop.
+    With `max_side` the output is that small and the image is decoded at reduced resolution.
+    An AssetRef composes a stored asset, with its stored mask.
+
+    Returns:
+        The encoded image as a uint8 buffer, PNG unless another `encoder` is given.
+
+    Raises:
+        CompositionError: If the request can't be composed.
+    """
+    image_loader, foreground = open_image(image_data, max_side, text_parameter.segmentation_max_side)
+
+    # initialize components
+    background: BackgroundInterface = Background()
+    text_ft = build_text(text_parameter)
+
+    # initialize composer
+    composer = Composer(image_loader, foreground, background, text_ft)
+    output_image, _ = composer.get_output()
+    if output_image is None:
+        raise CompositionError(status_code=500, detail="Failed to compose the image")
+    return encode_output(output_image, encoder or make_encoder())
+
+
+def compose_variants(image_data: Union[bytes, AssetRef],
+                     variants: List[TextParameters],
+                     segmentation_max_side: Optional[int] = None,
+                     encoder: Optional[EncoderInterface] = None,
+                     max_side: Optional[int] = None) -> List[ComposedResult]:
+    """
+    Composes several text variants on the same image. The image is decoded and segmented
+    once; every variant only renders its text and composites it over the shared mask.
+    A failing variant is reported in its result instead of failing the others.
+
+    Raises:
+        CompositionError: If the image itself can't be loaded or segmented.
+    """
+    image_loader, foreground = open_image(image_data, max_side, segmentation_max_side)
+    background: BackgroundInterface = Background()
+    composer = Composer(image_loader, foreground, background)
+    if composer.get_output()[0] is None:
+        raise CompositionError(status_code=500, detail="Failed to process the image")
+
+    encoder = encoder or make_encoder()
+    results: List[ComposedResult] = []
+    for index, text_parameter in enumerate(variants):
+        result = ComposedResult(index=index, name=f"variant_{index:03d}.{encoder.extension}")
+        try:
+            success, _ = composer.set_text(build_text(text_parameter))
+            output_image, result.parameters = composer.get_output()
+            if not success or output_image is None:
+                raise CompositionError(status_code=500, detail="Failed to compose the text")
+            result.data = encode_output(output_image, encoder)
+        except CompositionError as exc:
+            result.error = exc.detail
+        except Exception as exc:
+            logger.error(f"Variant {index} failed: {exc}")
+            result.error = str(exc)
+        results.append(result)
+    logger.info(f"{sum(result.error is None for result in results)}/{len(results)} variant(s) composed")
+    return results
+
+
+def compose_batch_image(index: int,
+                        image_data: Union[bytes, AssetRef],
+                        text_parameter: TextParameters,
+                        encoder: EncoderInterface,
+                        max_side: Optional[int] = None) -> BatchResult:
+    """
+    Composes one image of a batch in a worker of the executor. A failure is reported in
+    the result, so it doesn't fail the other images.
+    """
+    result = BatchResult(index=index)
+    try:
+        image_loader, foreground = open_image(image_data, max_side, text_parameter.segmentation_max_side)
+        composer = Composer(image_loader, foreground, Background(), build_text(text_parameter))
+        output_image, result.parameters = composer.get_output()
+        if output_image is None:
+            raise CompositionError(status_code=500, detail="Failed to compose the image")
+        result.output = encode_output(output_image, encoder)
+    except CompositionError as exc:
+        result.error = exc.detail
+    except Exception as exc:
+        logger.error(f"Batch image {index} failed: {exc}")
+        result.error = str(exc)
+    return result
+
+
+def compose_batch(executor: BoundedExecutor,
+                  sources: Iterable[Union[bytes, AssetRef]],
+                  text_parameter: TextParameters,
+                  names: Optional[List[str]] = None,
+                  encoder: Optional[EncoderInterface] = None,
+                  max_side: Optional[int] = None) -> Iterator[ComposedResult]:
+    """
+    Applies the same text parameters to many images, yielding the encoded results as they
+    complete. Every image is a job of the executor, admitted like any other request; the
+    sources are consumed lazily, at most $BATCH_MAX_PENDING (twice the workers by default)
+    at a time, so the batch is never fully in memory. Blocks: meant to run off the event loop.
+
+    Raises:
+        CompositionError: If the text parameters are invalid, before any image is read.
+        ExecutorSaturatedError: If the executor has no room for the first image.
+    """
+    # fail fast on the parameters shared by every image (e.g. an unknown font)
+    build_text(text_parameter)
+    encoder = encoder or make_encoder()
+    batch = BatchComposer(submit=lambda index, image_data: executor.submit(compose_batch_image, index, image_data,
+                                                                           text_parameter, encoder, max_side),
+                          max_pending=int(os.getenv("BATCH_MAX_PENDING", str(2 * executor.workers))),
+                          busy=(ExecutorSaturatedError,),
+                          max_wait=float(os.getenv("BATCH_MAX_WAIT", "30")))
+    batch_results = batch.compose(sources)
+
+    def results() -> Iterator[ComposedResult]:
+        for batch_result in batch_results:
+            stem = names[batch_result.index] if names else f"image_{batch_result.index:04d}"
+            yield ComposedResult(index=batch_result.index,
+                                 name=f"{batch_result.index:04d}_{stem}.{encoder.extension}",
+                                 data=batch_result.output,
+                                 error=batch_result.error,
+                                 parameters=batch_result.parameters)
+
+    return results()
+
+
+def compose_video(input_path: str,
+                  output_path: str,
+                  text_parameter: TextParameters,
+                  mask_every: int = 1,
+                  smoothing: float = 0.0) -> None:
+    """
+    Composes the video file at `input_path` into an MP4 file at `output_path`.
+
+    Raises:
+        CompositionError: If the parameters or the video are invalid, or a frame fails.
+    """
+    text_ft = build_text(text_parameter)
+    foreground = None
+    if text_parameter.segmentation_max_side is not None:
+        foreground = Foreground(max_side=text_parameter.segmentation_max_side)
+    try:
+        composer = VideoComposer(text_ft, foreground=foreground, mask_every=mask_every, smoothing=smoothing,
+                                 max_frames=int(os.getenv("MAX_VIDEO_FRAMES", "9000")))
+        composer.process(input_path, output_path)
+    except VideoTooLongError as exc:
+        raise CompositionError(status_code=413, detail=str(exc))
+    except ValueError as exc:
+        raise CompositionError(status_code=400, detail=str(exc))
+    except RuntimeError as exc:
+        raise CompositionError(status_code=500, detail=str(exc))
@@ -0,0 +1,185 @@
+import asyncio
+import contextvars
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+from common.logger import logger, request_id_var
+
+T = TypeVar("T")
+
+
+def _run_with_request_id(request_id: str, func: Callable[..., T], *args: Any) -> T:
+    # context variables don't cross process boundaries, the correlation id is passed along
+    request_id_var.set(request_id)
+    return func(*args)
+
+
+class ExecutorSaturatedError(RuntimeError):
+    def __init__(self, retry_after: int):
+        """Raised when every worker is busy and the waiting queue is full."""
+        super().__init__(f"The executor is saturated, retry after {retry_after} second(s)")
+        self.retry_after: int = retry_after
+
+
+class BoundedExecutor:
+    def __init__(self, kind: str = "thread", workers: int = 4, queue_size: int = 8, retry_after: int = 1):
+        """
+        Runs the CPU-bound work off the event loop, admitting at most `workers` running
+        jobs plus `queue_size` waiting ones. Anything beyond is rejected right away, so an
+        overloaded server answers quickly instead of piling up requests.
+
+        Args:
+            kind: "thread", "process", or "shared": a process pool to which the single image
+                  requests hand the decoded frames through shared memory.
+            workers: Number of worker threads or processes.
+            queue_size: Number of jobs allowed to wait for a worker.
+            retry_after: Seconds suggested to rejected clients before retrying.
+        """
+        if workers < 1 or queue_size < 0:
+            raise ValueError(f"Invalid executor bounds: workers={workers}, queue_size={queue_size}")
+        if kind not in ("thread", "process", "shared"):
+            raise ValueError(f"Unknown executor kind '{kind}', expected 'thread', 'process' or 'shared'")
+        self._kind: str = kind
+        self._workers: int = workers
+        self._queue_size: int = queue_size
+        self._retry_after: int = retry_after
+        self._executor: Executor = self._create_executor()
+        # threads of the server process for the jobs on in-memory state, see submit(local=True)
+        self._local_executor: Optional[ThreadPoolExecutor] = None
+        self._admitted: int = 0
+        self._lock: threading.Lock = threading.Lock()
+
+    def _create_executor(self) -> Executor:
+        if self._kind == "thread":
+            return ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="composer")
+        # spawned workers don't inherit the native threads of the server process
+        return ProcessPoolExecutor(max_workers=self._workers, mp_context=multiprocessing.get_context("spawn"))
+
+    @property
+    def kind(self) -> str:
+        return self._kind
+
+    @property
+    def workers(self) -> int:
+        return self._workers
+
+    @property
+    def retry_after(self) -> int:
+        return self._retry_after
+
+    def submit(self, func: Callable[..., T], *args: Any, local: bool = False) -> "Future[T]":
+        """
+        Schedules the job if there is room for it.
+
+        Args:
+            func: The job, a module-level function for the process executors.
+            local: Runs the job in a thread of the server process whatever the kind, for jobs
+                   working on in-memory state (the preview sessions). It takes a slot like
+                   any other job, so it counts against the same admission limit.
+
+        Raises:
+            ExecutorSaturatedError: If all the workers are busy and the queue is full.
+        """
+        with self._lock:
+            if self._admitted >= self._workers + self._queue_size:
+                raise ExecutorSaturatedError(self._retry_after)
+            self._admitted += 1
+        try:
+            if local:
+                future = self._submit_local(func, *args)
+            else:
+                try:
+                    future = self._submit(func, *args)
+                except BrokenProcessPool:
+                    # a worker died (killed, out of memory, crashed in native code): the jobs it
+                    # broke have failed, a new pool takes the next ones
+                    self._restart()
+                    future = self._submit(func, *args)
+        except Exception:
+            self._release()
+            raise
+        # the slot is released when the job really ends, even if the client went away
+        future.add_done_callback(lambda _: self._release())
+        return future
+
+    def _submit(self, func: Callable[..., T], *args: Any) -> "Future[T]":
+        # the logs of the job keep the correlation id of the request that submitted it
+        if self._kind == "thread":
+            return self._executor.submit(contextvars.copy_context().run, func, *args)
+        return self._executor.submit(_run_with_request_id, request_id_var.get(), func, *args)
+
+    def _submit_local(self, func: Callable[..., T], *args: Any) -> "Future[T]":
+        if self._kind == "thread":
+            return self._executor.submit(contextvars.copy_context().run, func, *args)
+        with self._lock:
+            if self._local_executor is None:
+                self._local_executor = ThreadPoolExecutor(max_workers=self._workers,
+                                                          thread_name_prefix="composer-local")
+            executor = self._local_executor
+        return executor.submit(contextvars.copy_context().run, func, *args)
+
+    def _restart(self) -> None:
+        with self._lock:
+            broken = self._executor
+            if getattr(broken, "_broken", False):
+                logger.error("A worker process of the executor died, restarting the pool")
+                self._executor = self._create_executor()
+            else:
+                broken = None
+        if broken is not None:
+            broken.shutdown(wait=False, cancel_futures=True)
+
+    async def run(self, func: Callable[..., T], *args: Any, local: bool = False) -> T:
+        """Runs the job in a worker and waits for its result without blocking the event loop."""
+        return await asyncio.wrap_future(self.submit(func, *args, local=local))
+
+    def _release(self) -> None:
+        with self._lock:
+            self._admitted -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            admitted = self._admitted
+        return {"kind": self._kind,
+                "workers": self._workers,
+                "queue_size": self._queue_size,
+                "in_flight": min(admitted, self._workers),
+                "queue_depth": max(0, admitted - self._workers)}
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        if self._local_executor is not None:
+            self._local_executor.shutdown(wait=True, cancel_futures=True)
+
+
+_executor: Optional[BoundedExecutor] = None
+_executor_lock: threading.Lock = threading.Lock()
+
+
+def get_executor() -> BoundedExecutor:
+    """
+    Returns the process-wide executor configured by $EXECUTOR_KIND, $EXECUTOR_WORKERS,
+    $EXECUTOR_QUEUE_SIZE and $EXECUTOR_RETRY_AFTER.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            kind: str = os.getenv("EXECUTOR_KIND", "thread")
+            workers: int = int(os.getenv("EXECUTOR_WORKERS", str(os.cpu_count() or 1)))
+            queue_size: int = int(os.getenv("EXECUTOR_QUEUE_SIZE", str(2 * workers)))
+            retry_after: int = int(os.getenv("EXECUTOR_RETRY_AFTER", "1"))
+            _executor = BoundedExecutor(kind=kind, workers=workers, queue_size=queue_size, retry_after=retry_after)
+            logger.info(f"Executor created: {kind}, {workers} worker(s), queue of {queue_size}")
+        return _executor
+
+
+def shutdown_executor() -> None:
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown()
+            _executor = None
@@ -0,0 +1,48 @@
+from common.metrics import REGISTRY, Counter, Gauge, Histogram
+from core.font_registry import get_font_registry
+from core.mask_cache import get_mask_cache
+from core.text_surface_cache import get_text_surface_cache
+from app.services.executor import get_executor
+
+HTTP_REQUESTS: Counter = REGISTRY.register(Counter(
+    "fore_text_http_requests_total", "Requests served, by route and status", ["method", "route", "status"]))
+HTTP_SECONDS: Histogram = REGISTRY.register(Histogram(
+    "fore_text_http_request_seconds", "Duration of the requests, by route", ["method", "route"]))
+HTTP_IN_FLIGHT: Gauge = REGISTRY.register(Gauge(
+    "fore_text_http_requests_in_flight", "Requests being served"))
+
+CACHE_HITS: Counter = REGISTRY.register(Counter(
+    "fore_text_cache_hits_total", "Lookups answered by the cache", ["cache"]))
+CACHE_MISSES: Counter = REGISTRY.register(Counter(
+    "fore_text_cache_misses_total", "Lookups not answered by the cache", ["cache"]))
+CACHE_HIT_RATIO: Gauge = REGISTRY.register(Gauge(
+    "fore_text_cache_hit_ratio", "Hits over lookups since the start", ["cache"]))
+CACHE_BYTES: Gauge = REGISTRY.register(Gauge(
+    "fore_text_cache_bytes", "Memory held by the cache", ["cache"]))
+EXECUTOR_IN_FLIGHT: Gauge = REGISTRY.register(Gauge(
+    "fore_text_executor_in_flight", "Jobs running in the compositing executor"))
+EXECUTOR_QUEUE_DEPTH: Gauge = REGISTRY.register(Gauge(
+    "fore_text_executor_queue_depth", "Jobs waiting for a worker of the compositing executor"))
+
+
+def _set_cache(name: str, hits: int, misses: int, size_bytes: int) -> None:
+    CACHE_HITS.set_total(hits, name)
+    CACHE_MISSES.set_total(misses, name)
+    CACHE_HIT_RATIO.set(hits / (hits + misses) if hits + misses else 0.0, name)
+    CACHE_BYTES.set(size_bytes, name)
+
+
+def render_metrics() -> str:
+    """
+    Samples the caches and the executor, then renders every metric in the Prometheus
+    text format. Nothing is aggregated between scrapes. With EXECUTOR_KIND=process the
+    pipeline stages and caches of the worker processes aren't visible here.
+    """
+    for name, stats in (("mask", get_mask_cache().stats()), ("text_surface", get_text_surface_cache().stats())):
+        _set_cache(name, stats.hits, stats.misses, stats.size_bytes)
+    font_stats = get_font_registry().stats()
+    _set_cache("font_handle", font_stats["hits"], font_stats["misses"], 0)
+    executor_stats = get_executor().stats()
+    EXECUTOR_IN_FLIGHT.set(executor_stats["in_flight"])
+    EXECUTOR_QUEUE_DEPTH.set(executor_stats["queue_depth"])
+    return REGISTRY.render()
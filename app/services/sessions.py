@@ -0,0 +1,166 @@
+import os
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, Tuple, Union
+
+import cv2
+import numpy as np
+
+from app.schemas.text import TextParameters
+from app.services.composition import AssetRef, CompositionError, open_image, build_text, make_encoder
+from common.logger import logger
+from core.background import Background
+from core.composer import Composer
+from core.encoders import normalize_format
+
+
+@dataclass
+class PreviewSession:
+    session_id: str
+    composer: Composer
+    width: int
+    height: int
+    parameters: Dict[str, Any] = field(default_factory=dict)
+    last_used: float = field(default_factory=time.monotonic)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+def _encode(image: np.ndarray, image_format: str, quality: int) -> bytes:
+    try:
+        image_format = normalize_format(image_format)
+    except ValueError as exc:
+        raise CompositionError(status_code=400, detail=str(exc))
+    # a preview favors latency over size: lowest PNG compression, the given quality otherwise
+    encoder = make_encoder(image_format, 1 if image_format == "png" else quality)
+    try:
+        # the patches are small, a bytes copy is what the websocket sends anyway
+        return encoder.encode(image).tobytes()
+    except ValueError as exc:
+        raise CompositionError(status_code=500, detail=str(exc))
+
+
+class SessionStore:
+    def __init__(self, idle_timeout: float = 300.0, max_sessions: int = 16):
+        """
+        Keeps the decoded image, its mask and the Composer of the live-preview sessions,
+        so parameter changes only re-composite the regions of the text.
+
+        Args:
+            idle_timeout: Seconds after which an unused session is dropped.
+            max_sessions: Sessions kept at most; the least recently used one is dropped first.
+        """
+        self._idle_timeout: float = idle_timeout
+        self._max_sessions: int = max(1, max_sessions)
+        self._sessions: Dict[str, PreviewSession] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    @property
+    def idle_timeout(self) -> float:
+        return self._idle_timeout
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, session in self._sessions.items() if now - session.last_used > self._idle_timeout]
+            for key in expired:
+                del self._sessions[key]
+            while len(self._sessions) >= self._max_sessions:
+                oldest = min(self._sessions.values(), key=lambda session: session.last_used)
+                del self._sessions[oldest.session_id]
+                expired.append(oldest.session_id)
+        if expired:
+            logger.info(f"{len(expired)} preview session(s) dropped")
+
+    def create(self, image_data: Union[bytes, AssetRef], segmentation_max_side: Optional[int] = None) -> PreviewSession:
+        """
+        Decodes and segments the image, or maps a stored asset and its mask. CPU-bound,
+        to be run off the event loop.
+
+        Raises:
+            CompositionError: If the image can't be loaded (404 for an unknown asset) or segmented.
+        """
+        image_loader, foreground = open_image(image_data, segmentation_max_side=segmentation_max_side)
+        composer = Composer(image_loader, foreground, Background())
+        output, _ = composer.get_output()
+        if output is None:
+            raise CompositionError(status_code=500, detail="Failed to process the image")
+        self._expire()
+        session = PreviewSession(session_id=uuid.uuid4().hex,
+                                 composer=composer,
+                                 width=output.shape[1],
+                                 height=output.shape[0])
+        with self._lock:
+            self._sessions[session.session_id] = session
+        logger.info(f"Preview session {session.session_id} created ({session.width}x{session.height})")
+        return session
+
+    def get(self, session_id: str) -> Optional[PreviewSession]:
+        self._expire()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.last_used = time.monotonic()
+            return session
+
+    def close(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def update(self, session: PreviewSession, delta: Dict[str, Any],
+               image_format: str = "png", quality: int = 80) -> Tuple[Dict[str, Any], bytes]:
+        """
+        Applies the changed text parameters and re-composites the old and new text regions.
+        CPU-bound, to be run off the event loop.
+
+        Returns:
+            The patch header (region, parameters) and the encoded patch.
+
+        Raises:
+            CompositionError: If the parameters are invalid or the text can't be composed.
+        """
+        with session.lock:
+            parameters = {**session.parameters, **delta}
+            try:
+                text_parameter = TextParameters.model_validate(parameters)
+            except ValueError as exc:
+                raise CompositionError(status_code=422, detail=f"Invalid parameters: {exc}")
+            region = session.composer.update_text(build_text(text_parameter))
+            if region is None:
+                raise CompositionError(status_code=400, detail="The text can't be composed on the image")
+            session.parameters = parameters
+            session.last_used = time.monotonic()
+            output, composed_parameters = session.composer.get_output()
+            x, y, width, height = region
+            patch = _encode(output[y:y + height, x:x + width], image_format, quality)
+        header = {"type": "patch", "x": x, "y": y, "width": width, "height": height,
+                  "format": image_format, "parameters": composed_parameters}
+        return header, patch
+
+    def preview(self, session: PreviewSession, max_side: int = 640, quality: int = 80) -> Tuple[Dict[str, Any], bytes]:
+        """Encodes the whole current output as a downscaled JPEG frame."""
+        with session.lock:
+            output, _ = session.composer.get_output()
+            scale = min(1.0, max_side / max(session.width, session.height))
+            if scale < 1.0:
+                size = (max(1, round(session.width * scale)), max(1, round(session.height * scale)))
+                output = cv2.resize(output, dsize=size, interpolation=cv2.INTER_AREA)
+            frame = _encode(output, "jpeg", quality)
+        header = {"type": "preview", "width": output.shape[1], "height": output.shape[0], "format": "jpeg"}
+        return header, frame
+
+
+_store: Optional[SessionStore] = None
+_store_lock: threading.Lock = threading.Lock()
+
+
+def get_session_store() -> SessionStore:
+    """Returns the process-wide store configured by $SESSION_IDLE_TIMEOUT and $SESSION_MAX."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            idle_timeout: float = float(os.getenv("SESSION_IDLE_TIMEOUT", "300"))
+            max_sessions: int = int(os.getenv("SESSION_MAX", "16"))
+            _store = SessionStore(idle_timeout=idle_timeout, max_sessions=max_sessions)
+        return _store
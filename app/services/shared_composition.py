@@ -0,0 +1,150 @@
+import asyncio
+import os
+from concurrent.futures import Future
+from contextlib import ExitStack
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import numpy as np
+
+from app.schemas.text import TextParameters
+from app.services.composition import MASK_THRESHOLD, CompositionError, build_text, encode_output, load_image
+from app.services.executor import BoundedExecutor
+from core.background import Background
+from core.composer import Composer
+from core.foreground import Foreground, MaskForeground
+from core.image_loader_from_array import ImageLoaderFromArray
+from core.interfaces.encoder import EncoderInterface
+from core.interfaces.foreground import ForegroundInterface
+from core.mask_cache import MaskCache, get_mask_cache
+from core.segmenter_pool import get_segmenter_pool
+from core.shared_memory import SharedArray, SharedLease, attach, get_shared_memory_pool
+
+
+@dataclass(frozen=True)
+class SharedCompositionJob:
+    """What a worker process receives: descriptors of the segments and the text parameters."""
+    image: SharedArray
+    mask: SharedArray
+    output: SharedArray
+    text_parameter: TextParameters
+    segmentation_max_side: int
+    mask_ready: bool
+
+
+def compose_shared(job: SharedCompositionJob) -> dict:
+    """
+    Runs in a worker process: segments the image (unless the mask is already in its
+    segment), renders the text and composites straight into the output segment.
+
+    Returns:
+        The parameters of the composed text.
+
+    Raises:
+        CompositionError: If the request can't be composed.
+    """
+    with attach((job.image, job.mask, job.output)) as (image, mask, output):
+        return _compose_views(job, image, mask, output)
+
+
+def _compose_views(job: SharedCompositionJob, image: np.ndarray, mask: np.ndarray, output: np.ndarray) -> dict:
+    image_loader = ImageLoaderFromArray()
+    image_loader.set_source(image)
+    # the masks are cached by the server process, which sees the requests of every worker
+    foreground: ForegroundInterface = MaskForeground(mask) if job.mask_ready else \
+        Foreground(cache=MaskCache(max_bytes=0), max_side=job.segmentation_max_side)
+    composer = Composer(image_loader, foreground, Background(), build_text(job.text_parameter), output=output)
+    output_image, parameters = composer.get_output()
+    if output_image is None:
+        raise CompositionError(status_code=500, detail="Failed to compose the image")
+    if output_image is not output:
+        np.copyto(output, output_image)
+    if not job.mask_ready:
+        np.copyto(mask, foreground.get_mask())
+    return parameters
+
+
+def _prepare(image_data: bytes, text_parameter: TextParameters, max_side: Optional[int]
+             ) -> Tuple[SharedCompositionJob, SharedLease, SharedLease, Optional[str], ExitStack]:
+    # the leases are returned to the caller, which gives them back even if it was cancelled meanwhile
+    image_loader = load_image(image_data, max_side)
+    source: np.ndarray = image_loader.get_source()
+    segmentation_max_side: int = text_parameter.segmentation_max_side \
+        if text_parameter.segmentation_max_side is not None else int(os.getenv("SEGMENTATION_MAX_SIDE", "0"))
+    cache = get_mask_cache()
+    cache_key: Optional[str] = None
+    cached: Optional[np.ndarray] = None
+    if cache.enabled:
+        cache_key = cache.make_key(source, MASK_THRESHOLD, get_segmenter_pool().model_id,
+                                   segmentation_max_side)
+        cached = cache.get(cache_key)
+
+    pool = get_shared_memory_pool()
+    with ExitStack() as leases:
+        image = leases.enter_context(pool.lease(source.shape, source.dtype))
+        mask = leases.enter_context(pool.lease(source.shape[:2], np.uint8))
+        output = leases.enter_context(pool.lease(source.shape, source.dtype))
+        np.copyto(image.array, source)
+        if cached is not None:
+            np.copyto(mask.array, cached)
+        job = SharedCompositionJob(image=image.descriptor, mask=mask.descriptor, output=output.descriptor,
+                                   text_parameter=text_parameter, segmentation_max_side=segmentation_max_side,
+                                   mask_ready=cached is not None)
+        return job, mask, output, cache_key if cached is None else None, leases.pop_all()
+
+
+def _close_prepared(prepared: Future) -> None:
+    if not prepared.cancelled() and prepared.exception() is None:
+        prepared.result()[-1].close()
+
+
+def _finish(mask: SharedLease, output: SharedLease, cache_key: Optional[str], encoder: EncoderInterface) -> np.ndarray:
+    if cache_key is not None:
+        # the mask the worker computed, for the next request on the same image
+        get_mask_cache().put(cache_key, mask.array)
+    return encode_output(output.array, encoder)
+
+
+async def compose_image_shared(executor: BoundedExecutor,
+                               image_data: bytes,
+                               text_parameter: TextParameters,
+                               encoder: EncoderInterface,
+                               max_side: Optional[int] = None) -> np.ndarray:
+    """
+    compose_image for the "shared" executor: the server process decodes the upload into a
+    shared memory segment and encodes the output from another one, OpenCV releasing the
+    GIL for both (the frames never go through a pipe); the worker process gets only the segment descriptors and runs the
+    segmentation, the text rendering and the compositing. The segments go back to the
+    pool once the worker is done with them, even if the client went away meanwhile or
+    the worker died.
+
+    The decoding and the encoding are local jobs of the executor, admitted like the
+    worker job: a saturated server rejects the request before decoding it.
+
+    Returns:
+        The encoded image as a uint8 buffer.
+
+    Raises:
+        CompositionError: If the request can't be composed.
+        ExecutorSaturatedError: If the executor has no room for the job.
+    """
+    prepared = executor.submit(_prepare, image_data, text_parameter, max_side, local=True)
+    try:
+        job, mask, output, cache_key, leases = await asyncio.wrap_future(prepared)
+    except asyncio.CancelledError:
+        # the thread may still be leasing the segments, they go back once it's done
+        prepared.add_done_callback(_close_prepared)
+        raise
+    # the job last given the segments, the worker then the encoding thread
+    pending: Optional[Future] = None
+    try:
+        pending = executor.submit(compose_shared, job)
+        await asyncio.wrap_future(pending)
+        pending = executor.submit(_finish, mask, output, cache_key, encoder, local=True)
+        return await asyncio.wrap_future(pending)
+    finally:
+        if pending is None or pending.done():
+            leases.close()
+        else:
+            # cancelled while a job still uses the segments
+            pending.add_done_callback(lambda _: leases.close())
@@ -0,0 +1,144 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import wait
+from contextlib import ExitStack
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from common.logger import logger
+from core.encoders import get_available_formats, get_encoder
+from core.font_registry import get_font_registry
+from core.segmenter_pool import get_segmenter_pool
+from app.services.executor import BoundedExecutor, get_executor
+
+# seconds a worker process waits for the others, and the warmup for its workers
+WORKER_WARMUP_TIMEOUT: float = 120.0
+
+
+class WarmupState:
+    def __init__(self):
+        """
+        Tracks the warmup of the process: "booted" once the app serves requests,
+        "warm" once the heavy resources are loaded, "failed" if the warmup raised.
+        """
+        self._lock: threading.Lock = threading.Lock()
+        self._booted_at: float = time.monotonic()
+        self._status: str = "booted"
+        self._duration: Optional[float] = None
+        self._error: Optional[str] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._status == "warm"
+
+    def finish(self, duration: float, error: Optional[str] = None) -> None:
+        with self._lock:
+            self._status = "failed" if error else "warm"
+            self._duration = duration
+            self._error = error
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"status": self._status,
+                    "uptime_s": round(time.monotonic() - self._booted_at, 3),
+                    "warmup_s": round(self._duration, 3) if self._duration is not None else None,
+                    "error": self._error}
+
+
+_state: WarmupState = WarmupState()
+
+
+def get_warmup_state() -> WarmupState:
+    return _state
+
+
+def warm_resources() -> None:
+    """
+    Loads what the first request of this process would otherwise pay for: the font scan
+    and default font, the mediapipe import and its graphs (one inference per graph) and
+    the codecs of the encoders.
+    """
+    registry = get_font_registry()
+    fonts = registry.get_fonts()
+    font_names = fonts.get_fonts()
+    if font_names:
+        # the handle of the default font at the default size, the one TextFT opens first
+        registry.get_font_handle(fonts.get_font(font_names[0]), int(os.getenv("DEFAULT_FONT_SIZE", "100")))
+    logger.info(f"Warmup: {len(font_names)} font(s) available")
+
+    pool = get_segmenter_pool()
+    pool.warm()
+    sample = np.zeros((64, 64, 3), dtype=np.uint8)
+    # every graph is checked out at once so each one runs its first inference
+    with ExitStack() as stack:
+        segmenters = [stack.enter_context(pool.acquire(timeout=30.0)) for _ in range(pool.size)]
+        for segmenter in segmenters:
+            segmenter.process(sample)
+
+    for image_format in get_available_formats():
+        get_encoder(image_format).encode(sample)
+
+
+def _warm_worker(barrier: Any, job: Callable[[], Any], timeout: float) -> int:
+    try:
+        job()
+    finally:
+        # the process holds its job until every worker has one, so no worker takes two
+        # and leaves another one cold; reached even if the job failed, not to block the others
+        barrier.wait(timeout=timeout)
+    return os.getpid()
+
+
+def warm_workers(executor: BoundedExecutor, job: Callable[[], Any] = warm_resources,
+                 timeout: float = WORKER_WARMUP_TIMEOUT) -> List[int]:
+    """
+    Runs `job` once in every worker process of a process or shared executor and waits
+    for all of them. Thread executors share the resources of this process, nothing is run.
+
+    Returns:
+        The pids of the warmed worker processes.
+
+    Raises:
+        TimeoutError: If the workers didn't all finish within `timeout` seconds.
+        Exception: The first error of a job.
+    """
+    if executor.kind == "thread":
+        return []
+    with multiprocessing.get_context("spawn").Manager() as manager:
+        barrier = manager.Barrier(executor.workers)
+        futures = [executor.submit(_warm_worker, barrier, job, timeout) for _ in range(executor.workers)]
+        _, not_done = wait(futures, timeout=timeout)
+        if not_done:
+            raise TimeoutError(f"{len(not_done)} worker(s) not warmed up after {timeout} s")
+        return [future.result() for future in futures]
+
+
+def warm_up() -> WarmupState:
+    """
+    Warms this process (see warm_resources), then every worker process of the executor
+    with EXECUTOR_KIND=process or shared, so the process isn't reported ready while its
+    workers are still cold. Blocking, run it off the event loop.
+    """
+    start = time.perf_counter()
+    error: Optional[str] = None
+    try:
+        warm_resources()
+        pids = warm_workers(get_executor())
+        if pids:
+            logger.info(f"Warmup: {len(pids)} worker process(es) warmed up")
+    except Exception as exc:
+        logger.error(f"Warmup failed: {exc}")
+        error = str(exc)
+    duration = time.perf_counter() - start
+    _state.finish(duration, error)
+    if error is None:
+        logger.info(f"Warmup done in {duration:.2f} s")
+    return _state
+
+
+def warmup_enabled() -> bool:
+    """$WARMUP (on by default); without it the process is reported ready right away."""
+    return os.getenv("WARMUP", "1").lower() in ("1", "true", "yes")
@@ -0,0 +1,65 @@
+import argparse
+import json
+import sys
+from dataclasses import dataclass
+from typing import Any, Dict, List
+
+
+@dataclass
+class Regression:
+    case: str
+    metric: str
+    baseline_ms: float
+    current_ms: float
+
+    @property
+    def ratio(self) -> float:
+        return self.current_ms / self.baseline_ms if self.baseline_ms else float("inf")
+
+    def __str__(self) -> str:
+        return (f"{self.case} {self.metric}: {self.baseline_ms:.2f} ms -> {self.current_ms:.2f} ms "
+                f"(+{(self.ratio - 1.0) * 100:.1f}%)")
+
+
+def _medians(results: Dict[str, Any]) -> Dict[tuple, float]:
+    medians: Dict[tuple, float] = {}
+    for case in results["cases"]:
+        for metric, timing in case["stages"].items():
+            medians[(case["case"], metric)] = timing["median_ms"]
+    return medians
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any],
+            threshold: float = 0.15, min_delta_ms: float = 0.5) -> List[Regression]:
+    """
+    Lists the stages whose median got slower than the baseline by more than `threshold`
+    (0.15 = 15%). Differences under `min_delta_ms` are ignored, they are timer noise for
+    the fastest stages. Cases missing on either side are skipped.
+    """
+    baseline_medians = _medians(baseline)
+    regressions: List[Regression] = []
+    for key, current_ms in _medians(current).items():
+        baseline_ms = baseline_medians.get(key)
+        if baseline_ms is None:
+            continue
+        if current_ms - baseline_ms >= min_delta_ms and current_ms > baseline_ms * (1.0 + threshold):
+            regressions.append(Regression(case=key[0], metric=key[1], baseline_ms=baseline_ms, current_ms=current_ms))
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Compares two benchmark result files")
+    parser.add_argument("current", help="JSON results of benchmarks.run")
+    parser.add_argument("baseline", help="JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.15, help="allowed slowdown of the medians (0.15 = 15%%)")
+    args = parser.parse_args()
+    with open(args.current) as current_file, open(args.baseline) as baseline_file:
+        regressions = compare(json.load(current_file), json.load(baseline_file), args.threshold)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    print(f"{len(regressions)} regression(s) above {args.threshold * 100:.0f}%")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
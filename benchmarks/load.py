@@ -0,0 +1,282 @@
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import httpx
+
+from benchmarks.synthetic import RESOLUTIONS, TEXTS, make_encoded
+
+_ROOT = Path(__file__).resolve().parent.parent
+
+
+@dataclass(frozen=True)
+class Payload:
+    name: str
+    image: bytes
+    params: Dict[str, str]
+
+
+@dataclass
+class StepResult:
+    concurrency: int
+    duration_s: float
+    latencies_ms: List[float] = field(default_factory=list)
+    statuses: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def requests(self) -> int:
+        return sum(self.statuses.values())
+
+    @property
+    def errors(self) -> int:
+        return sum(count for status, count in self.statuses.items() if status != "200")
+
+    def summary(self) -> Dict[str, Any]:
+        latencies = sorted(self.latencies_ms)
+        return {"concurrency": self.concurrency,
+                "duration_s": self.duration_s,
+                "requests": self.requests,
+                "throughput_rps": len(latencies) / self.duration_s if self.duration_s else 0.0,
+                "error_rate": self.errors / self.requests if self.requests else 0.0,
+                "statuses": dict(sorted(self.statuses.items())),
+                "latency_ms": {"p50": percentile(latencies, 50),
+                               "p95": percentile(latencies, 95),
+                               "p99": percentile(latencies, 99),
+                               "max": latencies[-1] if latencies else None}}
+
+
+def percentile(ordered: List[float], rank: float) -> Optional[float]:
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return None
+    index = max(0, min(len(ordered) - 1, math.ceil(rank / 100.0 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def build_mix(mix: str, image_format: Optional[str]) -> List[Payload]:
+    """
+    Parses "vga:short,4k:long" into the payloads replayed in turn. The entries alternate
+    between auto-fit, a fixed font size and an explicit position, to vary the work.
+    """
+    payloads: List[Payload] = []
+    images: Dict[str, bytes] = {}
+    for index, item in enumerate(part.strip() for part in mix.split(",") if part.strip()):
+        resolution, _, text_name = item.partition(":")
+        text_name = text_name or "short"
+        if resolution not in RESOLUTIONS or text_name not in TEXTS:
+            raise ValueError(f"Unknown mix entry '{item}', expected <{'|'.join(RESOLUTIONS)}>:<{'|'.join(TEXTS)}>")
+        if resolution not in images:
+            images[resolution] = make_encoded(resolution, seed=len(images)).encoded
+        params = {"text": TEXTS[text_name], "font_color_r": str(40 * index % 256)}
+        if index % 3 == 1:
+            params["font_size"] = "120"
+        elif index % 3 == 2:
+            params.update(font_size="80", position_x="40", position_y="40")
+        if image_format:
+            params["output_format"] = image_format
+        payloads.append(Payload(name=item, image=images[resolution], params=params))
+    if not payloads:
+        raise ValueError("The mix is empty")
+    return payloads
+
+
+def read_rss_mib(pid: int) -> Optional[float]:
+    """Resident memory of the process and its children (the process executor workers), from /proc."""
+    total_kib = 0
+    pids = [pid]
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as children:
+            pids += [int(child) for child in children.read().split()]
+    except OSError:
+        pass
+    for current in pids:
+        try:
+            with open(f"/proc/{current}/status") as status:
+                for line in status:
+                    if line.startswith("VmRSS:"):
+                        total_kib += int(line.split()[1])
+                        break
+        except OSError:
+            if current == pid:
+                return None
+    return total_kib / 1024
+
+
+async def _worker(client: httpx.AsyncClient, url: str, payloads: Iterator[Payload], deadline: float,
+                  result: StepResult) -> None:
+    while time.perf_counter() < deadline:
+        payload = next(payloads)
+        start = time.perf_counter()
+        try:
+            response = await client.post(url, params=payload.params,
+                                         files={"image": (f"{payload.name}.jpg", payload.image, "image/jpeg")})
+            status = str(response.status_code)
+        except httpx.HTTPError as exc:
+            status = type(exc).__name__
+        elapsed_ms = (time.perf_counter() - start) * 1000.0
+        result.statuses[status] = result.statuses.get(status, 0) + 1
+        if status == "200":
+            result.latencies_ms.append(elapsed_ms)
+
+
+async def _sample_rss(pid: Optional[int], interval: float, started: float, samples: List[Tuple[float, float]],
+                      stop: asyncio.Event) -> None:
+    while pid is not None and not stop.is_set():
+        rss = read_rss_mib(pid)
+        if rss is not None:
+            samples.append((round(time.perf_counter() - started, 1), round(rss, 1)))
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_step(base_url: str, payloads: List[Payload], concurrency: int, duration: float,
+                   timeout: float) -> StepResult:
+    """Keeps `concurrency` requests in flight for `duration` seconds."""
+    result = StepResult(concurrency=concurrency, duration_s=duration)
+    cycle = itertools.cycle(payloads)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        deadline = time.perf_counter() + duration
+        start = time.perf_counter()
+        await asyncio.gather(*(_worker(client, "/text-foreground", cycle, deadline, result)
+                               for _ in range(concurrency)))
+        # the last requests end after the deadline
+        result.duration_s = time.perf_counter() - start
+    return result
+
+
+def _free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def start_server(port: int, workers_env: Dict[str, str]) -> subprocess.Popen:
+    """Starts the app with uvicorn in a child process, with the .env of the repository."""
+    command = [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+               "--log-level", "warning"]
+    if (_ROOT / ".env").exists():
+        command += ["--env-file", str(_ROOT / ".env")]
+    env = {**os.environ, "LOG_LEVEL": "WARNING", **workers_env}
+    return subprocess.Popen(command, cwd=_ROOT, env=env)
+
+
+async def wait_ready(base_url: str, process: Optional[subprocess.Popen], timeout: float = 60.0) -> None:
+    deadline = time.perf_counter() + timeout
+    async with httpx.AsyncClient(base_url=base_url, timeout=2.0) as client:
+        while time.perf_counter() < deadline:
+            if process is not None and process.poll() is not None:
+                raise RuntimeError(f"The server exited with code {process.returncode}")
+            try:
+                if (await client.get("/")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.25)
+    raise RuntimeError(f"The server at {base_url} isn't ready after {timeout} seconds")
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    payloads = build_mix(args.mix, args.format)
+    process: Optional[subprocess.Popen] = None
+    base_url: str = args.url
+    pid: Optional[int] = args.pid
+    if not base_url:
+        port = _free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        extra_env = {"FONT_FOLDER": str(_ROOT / "tests" / "test_data"), "FONT_EXTENSION": "otf"} \
+            if not (_ROOT / os.getenv("FONT_FOLDER", "fonts")).is_dir() else {}
+        process = start_server(port, extra_env)
+        pid = process.pid
+    try:
+        await wait_ready(base_url, process)
+        rss_samples: List[Tuple[float, float]] = []
+        stop = asyncio.Event()
+        started = time.perf_counter()
+        sampler = asyncio.create_task(_sample_rss(pid, args.rss_interval, started, rss_samples, stop))
+
+        steps: List[Dict[str, Any]] = []
+        for concurrency in [int(value) for value in args.concurrency.split(",")]:
+            step = (await run_step(base_url, payloads, concurrency, args.duration, args.timeout)).summary()
+            steps.append(step)
+            latency = step["latency_ms"]
+            print(f"concurrency {concurrency:>3}: {step['throughput_rps']:6.2f} rps, "
+                  f"p50 {latency['p50'] or 0:7.1f} ms, p95 {latency['p95'] or 0:7.1f} ms, "
+                  f"p99 {latency['p99'] or 0:7.1f} ms, errors {step['error_rate'] * 100:.1f}% {step['statuses']}")
+
+        soak: Optional[Dict[str, Any]] = None
+        if args.soak:
+            soak_start = len(rss_samples)
+            soak = (await run_step(base_url, payloads, args.soak_concurrency, args.soak, args.timeout)).summary()
+            soak_rss = [rss for _, rss in rss_samples[soak_start:]]
+            if soak_rss:
+                # growth between the first and the last tenth of the soak, robust to the warmup
+                tenth = max(1, len(soak_rss) // 10)
+                soak["rss_growth_mib"] = round(sum(soak_rss[-tenth:]) / tenth - sum(soak_rss[:tenth]) / tenth, 1)
+            print(f"soak {args.soak:.0f}s at concurrency {args.soak_concurrency}: "
+                  f"{soak['throughput_rps']:.2f} rps, errors {soak['error_rate'] * 100:.1f}%, "
+                  f"RSS growth {soak.get('rss_growth_mib')} MiB")
+        stop.set()
+        await sampler
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    sustainable = [step for step in steps
+                   if step["error_rate"] <= args.max_error_rate
+                   and step["latency_ms"]["p99"] is not None and step["latency_ms"]["p99"] <= args.max_p99]
+    best = max(sustainable, key=lambda step: step["throughput_rps"], default=None)
+    if best is not None:
+        print(f"max sustainable: {best['throughput_rps']:.2f} rps at concurrency {best['concurrency']} "
+              f"(p99 <= {args.max_p99:.0f} ms, errors <= {args.max_error_rate * 100:.1f}%)")
+    return {"url": base_url,
+            "mix": [payload.name for payload in payloads],
+            "steps": steps,
+            "max_sustainable": best,
+            "soak": soak,
+            "rss_mib": rss_samples}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Load and soak test of /text-foreground")
+    parser.add_argument("--url", default=None, help="server to test; by default one is started locally")
+    parser.add_argument("--pid", type=int, default=None, help="pid of the server at --url, to sample its RSS")
+    parser.add_argument("--mix", default="vga:short,hd:medium,fhd:long",
+                        help="comma separated <resolution>:<text> replayed in turn")
+    parser.add_argument("--format", default=None, help="output_format of the requests")
+    parser.add_argument("--concurrency", default="1,2,4,8", help="comma separated concurrency steps")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds per concurrency step")
+    parser.add_argument("--soak", type=float, default=0.0, help="seconds of soak test after the steps (0 = none)")
+    parser.add_argument("--soak-concurrency", type=int, default=4)
+    parser.add_argument("--rss-interval", type=float, default=1.0, help="seconds between RSS samples")
+    parser.add_argument("--timeout", type=float, default=120.0, help="request timeout in seconds")
+    parser.add_argument("--max-p99", type=float, default=2000.0, help="p99 in ms to call a step sustainable")
+    parser.add_argument("--max-error-rate", type=float, default=0.01, help="error rate to call a step sustainable")
+    parser.add_argument("--output", default="load_results.json", help="JSON results file")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    with open(args.output, "w") as output_file:
+        json.dump(results, output_file, indent=2)
+    print(f"Results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,209 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+
+from dotenv import load_dotenv
+
+# configured before the project modules are imported, the logger reads it at import time
+load_dotenv()
+os.environ["LOG_LEVEL"] = os.getenv("BENCHMARK_LOG_LEVEL", "ERROR")
+os.environ["LOG_FILE_LEVEL"] = os.getenv("BENCHMARK_LOG_LEVEL", "ERROR")
+
+import cv2
+import numpy as np
+
+from benchmarks.compare import compare
+from benchmarks.synthetic import RESOLUTIONS, TEXTS, SyntheticImage, make_encoded
+from core.background import Background
+from core.composer import Composer
+from core.encoders import get_encoder
+from core.foreground import Foreground
+from core.image_loader_from_buffer import ImageLoaderFromBuffer
+from core.mask_cache import MaskCache
+from core.segmenter_pool import get_segmenter_pool
+from core.text import TextFT
+from core.text_surface_cache import get_text_surface_cache
+
+T = TypeVar("T")
+
+STAGES: List[str] = ["decode", "segmentation", "autofit", "render", "compose", "encode", "end_to_end"]
+_ROOT = Path(__file__).resolve().parent.parent
+
+
+def _use_test_fonts_if_missing() -> None:
+    # the benchmark runs offline, the font of the tests is used when none is configured
+    if not Path(os.getenv("FONT_FOLDER", "fonts/")).is_dir():
+        os.environ["FONT_FOLDER"] = str(_ROOT / "tests" / "test_data")
+        os.environ["FONT_EXTENSION"] = "otf"
+
+
+def _timed(samples: Dict[str, List[float]], stage: str, func: Callable[[], T]) -> T:
+    start = time.perf_counter()
+    result = func()
+    samples[stage].append((time.perf_counter() - start) * 1000.0)
+    return result
+
+
+def _summary(values: List[float]) -> Dict[str, float]:
+    ordered = sorted(values)
+    return {"median_ms": statistics.median(ordered),
+            "mean_ms": statistics.fmean(ordered),
+            "min_ms": ordered[0],
+            "p95_ms": ordered[min(len(ordered) - 1, round(0.95 * (len(ordered) - 1)))],
+            "runs": len(ordered)}
+
+
+def _new_foreground(segmentation_max_side: Optional[int]) -> Foreground:
+    # the cache is disabled, every run pays the segmentation
+    return Foreground(cache=MaskCache(max_bytes=0), max_side=segmentation_max_side)
+
+
+def _new_loader(image: SyntheticImage) -> ImageLoaderFromBuffer:
+    loader = ImageLoaderFromBuffer(max_pixels=0)
+    loader.set_source(image.encoded)
+    return loader
+
+
+def _end_to_end(image: SyntheticImage, text: str, image_format: str,
+                segmentation_max_side: Optional[int]) -> np.ndarray:
+    loader = _new_loader(image)
+    composer = Composer(loader, _new_foreground(segmentation_max_side), Background(), TextFT(text))
+    output, _ = composer.get_output()
+    if output is None:
+        raise RuntimeError(f"Composition failed on {image.name}")
+    return get_encoder(image_format).encode(output)
+
+
+def run_case(image: SyntheticImage, text_name: str, repeat: int, warmup: int, image_format: str,
+             segmentation_max_side: Optional[int]) -> Dict[str, Any]:
+    """Times every stage separately, then the whole path, on one resolution and text."""
+    text = TEXTS[text_name]
+    samples: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+    encoder = get_encoder(image_format)
+    surface_cache = get_text_surface_cache()
+    for iteration in range(warmup + repeat):
+        loader = _new_loader(image)
+        _timed(samples, "decode", loader.load)
+        source = loader.get_source()
+        foreground = _new_foreground(segmentation_max_side)
+        _timed(samples, "segmentation", lambda: foreground.extract(source, 0.95))
+
+        text_ft = TextFT(text)
+        _timed(samples, "autofit", lambda: text_ft.compute_auto_position(source))
+        # a cold render rasterizes the text, the surface cache is emptied first
+        surface_cache.clear()
+        canvas = source.copy()
+        _timed(samples, "render", lambda: text_ft.render_into(canvas))
+
+        surface_cache.clear()
+        composer = Composer(_new_loader(image), _new_foreground(segmentation_max_side), Background())
+        composer.get_output()
+        _timed(samples, "compose", lambda: composer.set_text(TextFT(text)))
+        output, _ = composer.get_output()
+        _timed(samples, "encode", lambda: encoder.encode(output))
+
+        surface_cache.clear()
+        _timed(samples, "end_to_end", lambda: _end_to_end(image, text, image_format, segmentation_max_side))
+        if iteration < warmup:
+            for values in samples.values():
+                values.clear()
+
+    # traced separately, tracemalloc slows the allocations down
+    surface_cache.clear()
+    tracemalloc.start()
+    _end_to_end(image, text, image_format, segmentation_max_side)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    end_to_end_ms = statistics.median(samples["end_to_end"])
+    return {"case": f"{image.name}-{text_name}",
+            "resolution": image.name,
+            "width": image.width,
+            "height": image.height,
+            "text": text,
+            "stages": {stage: _summary(values) for stage, values in samples.items()},
+            "throughput_images_per_s": 1000.0 / end_to_end_ms,
+            "throughput_megapixels_per_s": image.width * image.height / 1e6 * 1000.0 / end_to_end_ms,
+            "peak_traced_mib": peak / (1024 * 1024)}
+
+
+def _metadata(args: argparse.Namespace) -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=_ROOT, capture_output=True,
+                                text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": commit,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "repeat": args.repeat,
+            "warmup": args.warmup,
+            "format": args.format,
+            "segmentation_max_side": args.segmentation_max_side}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks the composition pipeline on synthetic images")
+    parser.add_argument("--resolutions", default="vga,hd,fhd,4k",
+                        help=f"comma separated, among {','.join(RESOLUTIONS)}")
+    parser.add_argument("--texts", default="short,long", help=f"comma separated, among {','.join(TEXTS)}")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per case")
+    parser.add_argument("--warmup", type=int, default=1, help="untimed runs per case")
+    parser.add_argument("--format", default="png", help="output encoding")
+    parser.add_argument("--segmentation-max-side", type=int, default=None)
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON results file")
+    parser.add_argument("--baseline", default=None, help="JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.15, help="allowed slowdown of the medians (0.15 = 15%%)")
+    args = parser.parse_args()
+
+    _use_test_fonts_if_missing()
+    resolutions = [name.strip() for name in args.resolutions.split(",") if name.strip()]
+    texts = [name.strip() for name in args.texts.split(",") if name.strip()]
+    unknown = [name for name in resolutions if name not in RESOLUTIONS] + [name for name in texts if name not in TEXTS]
+    if unknown:
+        parser.error(f"Unknown resolution(s) or text(s): {unknown}")
+
+    # the graph setup is a one-time cost, not part of any stage
+    get_segmenter_pool().warm()
+    cases: List[Dict[str, Any]] = []
+    for resolution in resolutions:
+        image = make_encoded(resolution)
+        for text_name in texts:
+            case = run_case(image, text_name, args.repeat, args.warmup, args.format, args.segmentation_max_side)
+            cases.append(case)
+            stages = "  ".join(f"{stage} {timing['median_ms']:.1f}" for stage, timing in case["stages"].items())
+            print(f"{case['case']:>14}  {stages}  (ms, median)  "
+                  f"{case['throughput_megapixels_per_s']:.1f} MP/s  peak {case['peak_traced_mib']:.0f} MiB")
+
+    results = {"metadata": _metadata(args),
+               "max_rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+               "cases": cases}
+    with open(args.output, "w") as output_file:
+        json.dump(results, output_file, indent=2)
+    print(f"Results written to {args.output} (max RSS {results['max_rss_mib']:.0f} MiB)")
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        print(f"{len(regressions)} regression(s) above {args.threshold * 100:.0f}%")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
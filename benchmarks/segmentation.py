@@ -0,0 +1,145 @@
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+# configured before the project modules are imported, the logger reads it at import time
+load_dotenv()
+os.environ["LOG_LEVEL"] = os.getenv("BENCHMARK_LOG_LEVEL", "ERROR")
+os.environ["LOG_FILE_LEVEL"] = os.getenv("BENCHMARK_LOG_LEVEL", "ERROR")
+
+import cv2
+import numpy as np
+
+from benchmarks.synthetic import RESOLUTIONS, make_image
+from core.foreground import Foreground
+from core.mask_cache import MaskCache
+from core.segmentation_backends import SegmentationModel, create_segmenter, parse_input_size
+from core.segmenter_pool import SegmenterPool
+
+_IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+
+
+def load_images(folder: Optional[str], resolutions: List[str]) -> List[Tuple[str, np.ndarray]]:
+    """The photos of `folder`, or the synthetic images of the resolutions without one."""
+    if not folder:
+        return [(name, make_image(*RESOLUTIONS[name], seed=index)) for index, name in enumerate(resolutions)]
+    images: List[Tuple[str, np.ndarray]] = []
+    for path in sorted(Path(folder).iterdir()):
+        if path.suffix.lower() in _IMAGE_EXTENSIONS:
+            image = cv2.imread(str(path), cv2.IMREAD_COLOR)
+            if image is not None:
+                images.append((path.name, image))
+    if not images:
+        raise ValueError(f"No image found in {folder}")
+    return images
+
+
+def iou(mask: np.ndarray, reference: np.ndarray) -> float:
+    """Intersection over union of the foregrounds of two masks, 1 if both are empty."""
+    foreground, expected = mask > 0, reference > 0
+    union = np.count_nonzero(foreground | expected)
+    if union == 0:
+        return 1.0
+    return np.count_nonzero(foreground & expected) / union
+
+
+def run_model(model: SegmentationModel, images: List[Tuple[str, np.ndarray]], repeat: int, threshold: float,
+              max_side: int) -> Tuple[Dict[str, Any], List[np.ndarray]]:
+    """Times the masks of a model as the app computes them, without the mask cache."""
+    pool = SegmenterPool(size=1, model_selection=model.model_selection,
+                         factory=lambda _: create_segmenter(model), model_id=model.model_id)
+    try:
+        start = time.perf_counter()
+        pool.warm()
+        load_ms = (time.perf_counter() - start) * 1000.0
+        foreground = Foreground(pool=pool, cache=MaskCache(max_bytes=0), max_side=max_side)
+        latencies: List[float] = []
+        masks: List[np.ndarray] = []
+        for _, image in images:
+            # the first run of an image is not timed, some runtimes specialize on the shape
+            if not foreground.extract(image, threshold):
+                raise RuntimeError(f"{model.model_id} failed to segment an image")
+            for _ in range(repeat):
+                start = time.perf_counter()
+                foreground.extract(image, threshold)
+                latencies.append((time.perf_counter() - start) * 1000.0)
+            masks.append(foreground.get_mask().copy())
+    finally:
+        pool.close()
+    ordered = sorted(latencies)
+    return {"model": model.model_id,
+            "load_ms": load_ms,
+            "median_ms": statistics.median(ordered),
+            "p95_ms": ordered[min(len(ordered) - 1, round(0.95 * (len(ordered) - 1)))]}, masks
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Compares the latency and the mask IoU of segmentation models")
+    parser.add_argument("--models", required=True,
+                        help="comma separated SEGMENTATION_MODEL specs, e.g. mediapipe:0,model.onnx,opencv:model.int8.onnx")
+    parser.add_argument("--reference", default="mediapipe:1", help="model the IoU is measured against")
+    parser.add_argument("--images", default=None, help="folder of photos; synthetic images without it")
+    parser.add_argument("--resolutions", default="vga,hd,fhd", help="synthetic image resolutions")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per image")
+    parser.add_argument("--threshold", type=float, default=0.95, help="probability threshold of the masks")
+    parser.add_argument("--max-side", type=int, default=int(os.getenv("SEGMENTATION_MAX_SIDE", "0")),
+                        help="segment a resized copy of larger images, like SEGMENTATION_MAX_SIDE")
+    parser.add_argument("--threads", type=int, default=int(os.getenv("SEGMENTATION_THREADS", "1")),
+                        help="intra-op threads of the file-based models")
+    parser.add_argument("--input-size", default=os.getenv("SEGMENTATION_INPUT_SIZE", ""), help="e.g. 256x256")
+    parser.add_argument("--normalization", default=os.getenv("SEGMENTATION_NORMALIZATION", "unit"))
+    parser.add_argument("--foreground-class", type=int, default=int(os.getenv("SEGMENTATION_FOREGROUND_CLASS", "1")))
+    parser.add_argument("--sigmoid", action="store_true",
+                        default=os.getenv("SEGMENTATION_SIGMOID", "0").lower() in ("1", "true", "yes"),
+                        help="apply a sigmoid to single channel outputs (logits)")
+    parser.add_argument("--min-iou", type=float, default=0.9, help="mean IoU a model needs to be acceptable")
+    parser.add_argument("--output", default="segmentation_results.json", help="JSON results file")
+    args = parser.parse_args()
+
+    try:
+        settings = dict(input_size=parse_input_size(args.input_size), normalization=args.normalization,
+                        foreground_class=args.foreground_class, sigmoid=args.sigmoid, threads=args.threads)
+        reference = SegmentationModel.parse(args.reference, **settings)
+        models = [SegmentationModel.parse(spec, **settings) for spec in args.models.split(",") if spec.strip()]
+        images = load_images(args.images, [name.strip() for name in args.resolutions.split(",") if name.strip()])
+    except (ValueError, KeyError) as exc:
+        parser.error(str(exc))
+
+    reference_result, reference_masks = run_model(reference, images, args.repeat, args.threshold, args.max_side)
+    results: List[Dict[str, Any]] = []
+    for model in models:
+        result, masks = run_model(model, images, args.repeat, args.threshold, args.max_side)
+        scores = [iou(mask, expected) for mask, expected in zip(masks, reference_masks)]
+        result.update(mean_iou=statistics.fmean(scores), min_iou=min(scores),
+                      acceptable=statistics.fmean(scores) >= args.min_iou)
+        results.append(result)
+        print(f"{result['model']:>40}  median {result['median_ms']:7.1f} ms  p95 {result['p95_ms']:7.1f} ms  "
+              f"IoU mean {result['mean_iou']:.3f} min {result['min_iou']:.3f}"
+              f"{'' if result['acceptable'] else '  (below the bar)'}")
+    print(f"{reference_result['model']:>40}  median {reference_result['median_ms']:7.1f} ms  (reference)")
+
+    best = min((result for result in results if result["acceptable"]), key=lambda result: result["median_ms"],
+               default=None)
+    if best is not None:
+        print(f"fastest with a mean IoU >= {args.min_iou}: {best['model']} ({best['median_ms']:.1f} ms)")
+    with open(args.output, "w") as output_file:
+        json.dump({"reference": reference_result,
+                   "images": [name for name, _ in images],
+                   "threshold": args.threshold,
+                   "max_side": args.max_side,
+                   "min_iou": args.min_iou,
+                   "models": results,
+                   "fastest_acceptable": best}, output_file, indent=2)
+    print(f"Results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,57 @@
+from dataclasses import dataclass
+from typing import Dict, Tuple
+
+import cv2
+import numpy as np
+
+# name -> (width, height), from VGA to 48 megapixels
+RESOLUTIONS: Dict[str, Tuple[int, int]] = {
+    "vga": (640, 480),
+    "hd": (1280, 720),
+    "fhd": (1920, 1080),
+    "4k": (3840, 2160),
+    "12mp": (4000, 3000),
+    "48mp": (8000, 6000),
+}
+
+TEXTS: Dict[str, str] = {
+    "short": "HI",
+    "medium": "Behind you",
+    "long": "The quick brown fox jumps over the lazy dog",
+}
+
+
+@dataclass(frozen=True)
+class SyntheticImage:
+    name: str
+    width: int
+    height: int
+    encoded: bytes
+
+
+def make_image(width: int, height: int, seed: int = 0) -> np.ndarray:
+    """
+    A deterministic photo-like BGR image: a vertical gradient with some noise as the
+    background and a head and shoulders silhouette in the middle as the subject.
+    """
+    rng = np.random.default_rng(seed)
+    gradient = np.linspace(60, 200, height, dtype=np.float32)[:, np.newaxis]
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    image[...] = np.stack([gradient * 0.9, gradient * 0.8, gradient * 0.6], axis=-1).astype(np.uint8)
+    noise = rng.integers(0, 12, size=(height // 8 + 1, width // 8 + 1, 3), dtype=np.uint8)
+    image += cv2.resize(noise, (width, height), interpolation=cv2.INTER_LINEAR)
+
+    center_x, unit = width // 2, min(width, height)
+    skin, shirt = (120, 150, 200), (90, 40, 30)
+    cv2.ellipse(image, (center_x, int(height * 0.35)), (unit // 8, unit // 6), 0, 0, 360, skin, -1, cv2.LINE_AA)
+    cv2.ellipse(image, (center_x, height), (unit // 3, int(height * 0.4)), 0, 180, 360, shirt, -1, cv2.LINE_AA)
+    return image
+
+
+def make_encoded(name: str, quality: int = 90, seed: int = 0) -> SyntheticImage:
+    """Encodes the synthetic image of a resolution of RESOLUTIONS as a JPEG upload."""
+    width, height = RESOLUTIONS[name]
+    success, buffer = cv2.imencode(".jpg", make_image(width, height, seed), [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not success:
+        raise RuntimeError(f"Failed to encode the synthetic image {name}")
+    return SyntheticImage(name=name, width=width, height=height, encoded=buffer.tobytes())
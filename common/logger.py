@@ -1,36 +1,24 @@
+from contextvars import ContextVar
 from loguru import logger
+import os
 import sys
 import logging
 
-# Configure Loguru
-logger.remove()
+# Correlation id of the request being served, "-" outside of a request
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+
 log_format = (
     "<green>{time:YYYY-MM-DD HH:mm:ss}</green> | "
     "<level>{level}</level> | "
+    "<magenta>{extra[request_id]}</magenta> | "
     "<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> | "
     "<level>{message}</level>"
 )
-logger.add(
-    sys.stdout,
-    format=log_format,
-    level="DEBUG",
-)
-logger.add(
-    "logs/app.log",
-    rotation="10MB",
-    compression="zip",
-    level="INFO",
-    serialize=False,
-    format=log_format,
-)
-logger.add(
-    "logs/debug.log",
-    rotation="10MB",
-    compression="zip",
-    level="DEBUG",
-    serialize=False,
-    format=log_format,
-)
+
+
+def _add_request_id(record) -> None:
+    record["extra"].setdefault("request_id", request_id_var.get())
+
 
 # Custom handler to intercept standard logging and redirect to Loguru
 class InterceptHandler(logging.Handler):
@@ -45,12 +33,67 @@ class InterceptHandler(logging.Handler):
         # Log with Loguru, preserving the original module and function
         logger.opt(depth=6).log(level, record.getMessage())
 
-# Configure logging to use InterceptHandler
-logging.basicConfig(handlers=[InterceptHandler()], level=logging.DEBUG)
-for logger_name in ("uvicorn", "uvicorn.access", "uvicorn.error"):
-    uvicorn_logger = logging.getLogger(logger_name)
-    uvicorn_logger.handlers = [InterceptHandler()]
-    uvicorn_logger.propagate = False
-    uvicorn_logger.setLevel(logging.DEBUG)
 
-__all__ = ["logger"]
\ No newline at end of file
+def configure_logging() -> None:
+    """
+    (Re)configures the sinks from the environment, call it again once the .env is loaded.
+
+    - LOG_LEVEL: level of the console (INFO).
+    - LOG_FILE_LEVEL: level of logs/app.log (INFO).
+    - LOG_DEBUG_FILE: also write every DEBUG record to logs/debug.log (off).
+    - LOG_DIR: folder of the log files (logs).
+    - LOG_ENQUEUE: format and write the records on a background thread (on), so the
+      request threads never wait for the console or the disk.
+
+    Records below every level are discarded before their message is formatted.
+    """
+    level: str = os.getenv("LOG_LEVEL", "INFO").upper()
+    file_level: str = os.getenv("LOG_FILE_LEVEL", "INFO").upper()
+    debug_file: bool = os.getenv("LOG_DEBUG_FILE", "0").lower() in ("1", "true", "yes")
+    folder: str = os.getenv("LOG_DIR", "logs")
+    enqueue: bool = os.getenv("LOG_ENQUEUE", "1").lower() in ("1", "true", "yes")
+
+    # drains the queues of the previous sinks before replacing them
+    logger.remove()
+    logger.configure(patcher=_add_request_id)
+    logger.add(
+        sys.stdout,
+        format=log_format,
+        level=level,
+        enqueue=enqueue,
+    )
+    logger.add(
+        os.path.join(folder, "app.log"),
+        rotation="10MB",
+        compression="zip",
+        level=file_level,
+        serialize=False,
+        format=log_format,
+        enqueue=enqueue,
+    )
+    levels = [logger.level(level).no, logger.level(file_level).no]
+    if debug_file:
+        logger.add(
+            os.path.join(folder, "debug.log"),
+            rotation="10MB",
+            compression="zip",
+            level="DEBUG",
+            serialize=False,
+            format=log_format,
+            enqueue=enqueue,
+        )
+        levels.append(logger.level("DEBUG").no)
+
+    # Configure logging to use InterceptHandler, without forwarding what loguru would drop
+    minimum_level: int = min(levels)
+    logging.basicConfig(handlers=[InterceptHandler()], level=minimum_level, force=True)
+    for logger_name in ("uvicorn", "uvicorn.access", "uvicorn.error"):
+        uvicorn_logger = logging.getLogger(logger_name)
+        uvicorn_logger.handlers = [InterceptHandler()]
+        uvicorn_logger.propagate = False
+        uvicorn_logger.setLevel(minimum_level)
+
+
+configure_logging()
+
+__all__ = ["logger", "request_id_var", "configure_logging"]
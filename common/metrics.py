@@ -0,0 +1,210 @@
+import bisect
+import functools
+import math
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+# Latency buckets in seconds, from 1 ms to 10 s
+DEFAULT_BUCKETS: Tuple[float, ...] = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Image size buckets in pixels, from VGA to 50 megapixels
+PIXEL_BUCKETS: Tuple[float, ...] = (0.3e6, 1e6, 2e6, 4e6, 8e6, 12e6, 16e6, 24e6, 36e6, 50e6)
+
+
+def metrics_enabled() -> bool:
+    """
+    $METRICS_ENABLED, read on every recording rather than at import: the .env file is
+    loaded after the modules are imported, and the spawned workers inherit the environment.
+    """
+    return os.getenv("METRICS_ENABLED", "1").lower() in ("1", "true", "yes")
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values)
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(names, escaped))
+    return "{" + pairs + "}"
+
+
+class _Metric(ABC):
+    kind: str = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name: str = name
+        self.documentation: str = documentation
+        self.labelnames: Tuple[str, ...] = tuple(labelnames)
+        self._lock: threading.Lock = threading.Lock()
+
+    def _check_labels(self, labelvalues: Sequence[str]) -> Tuple[str, ...]:
+        if len(labelvalues) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects the labels {self.labelnames}, got {labelvalues}")
+        return tuple(str(value) for value in labelvalues)
+
+    @abstractmethod
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}", *self.samples()]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labelvalues: str, amount: float = 1.0) -> None:
+        key = self._check_labels(labelvalues)
+        if not metrics_enabled():
+            return
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def set_total(self, value: float, *labelvalues: str) -> None:
+        """Mirrors a total counted elsewhere, such as the hits in the stats of a cache."""
+        key = self._check_labels(labelvalues)
+        if not metrics_enabled():
+            return
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, *labelvalues: str) -> None:
+        key = self._check_labels(labelvalues)
+        if not metrics_enabled():
+            return
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, *labelvalues: str, amount: float = 1.0) -> None:
+        self.inc(*labelvalues, amount=-amount)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        """
+        Cumulative histogram. Observing only bisects the bucket bounds and bumps two
+        numbers under a lock; the cumulative counts are built when the metrics are scraped.
+        """
+        super().__init__(name, documentation, labelnames)
+        self._bounds: Tuple[float, ...] = tuple(sorted(buckets))
+        # per label set: the count of each bucket (plus +Inf), the sum of the observations
+        self._series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        key = self._check_labels(labelvalues)
+        if not metrics_enabled():
+            return
+        index = bisect.bisect_left(self._bounds, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = ([0] * (len(self._bounds) + 1), [0.0])
+                self._series[key] = series
+            series[0][index] += 1
+            series[1][0] += value
+
+    @contextmanager
+    def time(self, *labelvalues: str) -> Iterator[None]:
+        """Observes the duration of the `with` block, in seconds, even if it raises."""
+        if not metrics_enabled():
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labelvalues)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            series = sorted((key, (list(counts), total[0])) for key, (counts, total) in self._series.items())
+        lines: List[str] = []
+        names = (*self.labelnames, "le")
+        for key, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip((*self._bounds, math.inf), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(names, (*key, _format_value(bound)))} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+M = TypeVar("M", bound=_Metric)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    def register(self, metric: M) -> M:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        """The metrics in the Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY: MetricsRegistry = MetricsRegistry()
+
+# Pipeline metrics, recorded by the core classes of the process running the pipeline
+STAGE_SECONDS: Histogram = REGISTRY.register(Histogram(
+    "fore_text_stage_seconds",
+    "Duration of the pipeline stages (compose includes autofit and render)",
+    ["stage"]))
+IMAGE_PIXELS: Histogram = REGISTRY.register(Histogram(
+    "fore_text_image_pixels", "Pixel count of the decoded images", buckets=PIXEL_BUCKETS))
+
+
+def stage(name: str):
+    """Times a pipeline stage: decode, segmentation, autofit, render, compose or encode."""
+    return STAGE_SECONDS.time(name)
+
+
+def timed(name: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """Decorator timing every call of the function as the pipeline stage `name`."""
+    def decorator(func: Callable[..., Any]) -> Callable[..., Any]:
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with STAGE_SECONDS.time(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
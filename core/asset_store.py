@@ -0,0 +1,211 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from common.logger import logger
+
+_ASSET_ID = re.compile(r"^[0-9a-f]{32}$")
+_IMAGE_FILE = "image.npy"
+_META_FILE = "meta.json"
+# staging and trash folders older than this were left by a process killed mid-write
+_STALE_SECONDS = 3600.0
+
+
+class AssetNotFoundError(KeyError):
+    """The asset id is malformed, unknown or was evicted."""
+
+
+@dataclass(frozen=True)
+class AssetInfo:
+    asset_id: str
+    width: int
+    height: int
+    size_bytes: int
+
+
+class AssetStore:
+    def __init__(self, root: str, max_bytes: int = 2 * 1024 ** 3):
+        """
+        Decoded images and their segmentation masks kept on the local disk as .npy files,
+        addressed by the hash of the uploaded bytes. The arrays are memory-mapped
+        read-only, so every process of the node (uvicorn workers, executor processes)
+        shares the same pages of the page cache instead of decoding and segmenting again.
+
+        Every write goes to a temporary name renamed into place, so concurrent processes
+        never see a partial asset. The least recently used assets are removed beyond
+        `max_bytes`; a process still mapping a removed asset keeps reading it.
+
+        Args:
+            root: Folder of the store, created if needed.
+            max_bytes: Disk budget of the store. Zero disables the limit.
+        """
+        self._root: Path = Path(root)
+        self._root.mkdir(parents=True, exist_ok=True)
+        self._max_bytes: int = max_bytes
+        self._lock: threading.Lock = threading.Lock()
+
+    @staticmethod
+    def make_id(encoded: bytes) -> str:
+        return hashlib.blake2b(encoded, digest_size=16).hexdigest()
+
+    @staticmethod
+    def mask_name(*settings: Any) -> str:
+        """File name of the mask computed with the given segmentation settings (model, threshold, ...)."""
+        return f"mask_{hashlib.blake2b(repr(settings).encode(), digest_size=8).hexdigest()}.npy"
+
+    def _path(self, asset_id: str) -> Path:
+        if not _ASSET_ID.match(asset_id):
+            raise AssetNotFoundError(asset_id)
+        return self._root / asset_id
+
+    def contains(self, asset_id: str) -> bool:
+        try:
+            return (self._path(asset_id) / _META_FILE).is_file()
+        except AssetNotFoundError:
+            return False
+
+    def put(self, asset_id: str, image: np.ndarray, mask_name: str, mask: np.ndarray) -> AssetInfo:
+        """Stores the decoded image and its mask, unless the asset already exists."""
+        path = self._path(asset_id)
+        if not self.contains(asset_id):
+            staging = Path(tempfile.mkdtemp(prefix=".staging-", dir=self._root))
+            try:
+                np.save(staging / _IMAGE_FILE, np.ascontiguousarray(image))
+                np.save(staging / mask_name, np.ascontiguousarray(mask))
+                height, width = image.shape[:2]
+                (staging / _META_FILE).write_text(json.dumps({"width": width, "height": height,
+                                                              "created": time.time()}))
+                os.rename(staging, path)
+                logger.info(f"Asset {asset_id} stored ({width}x{height})")
+            except OSError:
+                # another process stored the same upload first
+                shutil.rmtree(staging, ignore_errors=True)
+                if not self.contains(asset_id):
+                    raise
+            self._evict(keep=asset_id)
+        return self.info(asset_id)
+
+    def put_mask(self, asset_id: str, mask_name: str, mask: np.ndarray) -> None:
+        """Adds the mask of other segmentation settings to an existing asset."""
+        path = self._path(asset_id)
+        descriptor, temporary = tempfile.mkstemp(prefix=".staging-", suffix=".npy", dir=path)
+        try:
+            with os.fdopen(descriptor, "wb") as mask_file:
+                np.save(mask_file, np.ascontiguousarray(mask))
+            os.replace(temporary, path / mask_name)
+        except OSError:
+            Path(temporary).unlink(missing_ok=True)
+            raise
+        self._evict(keep=asset_id)
+
+    def info(self, asset_id: str) -> AssetInfo:
+        path = self._path(asset_id)
+        try:
+            meta = json.loads((path / _META_FILE).read_text())
+            size = sum(entry.stat().st_size for entry in path.iterdir())
+        except (OSError, ValueError):
+            raise AssetNotFoundError(asset_id) from None
+        return AssetInfo(asset_id=asset_id, width=meta["width"], height=meta["height"], size_bytes=size)
+
+    def open_image(self, asset_id: str) -> np.ndarray:
+        """
+        Maps the decoded image of the asset read-only.
+
+        Raises:
+            AssetNotFoundError: If the asset doesn't exist.
+        """
+        path = self._path(asset_id)
+        try:
+            image = np.load(path / _IMAGE_FILE, mmap_mode="r")
+            # the folder time is the recency of the LRU
+            os.utime(path)
+        except (OSError, ValueError):
+            raise AssetNotFoundError(asset_id) from None
+        return image
+
+    def open_mask(self, asset_id: str, mask_name: str) -> Optional[np.ndarray]:
+        """Maps the mask of the asset read-only, None if it wasn't computed with these settings."""
+        try:
+            return np.load(self._path(asset_id) / mask_name, mmap_mode="r")
+        except (OSError, ValueError, AssetNotFoundError):
+            return None
+
+    def _entries(self) -> List[Tuple[float, int, Path]]:
+        entries: List[Tuple[float, int, Path]] = []
+        for path in self._root.iterdir():
+            if not _ASSET_ID.match(path.name):
+                continue
+            try:
+                size = sum(entry.stat().st_size for entry in path.iterdir())
+                entries.append((path.stat().st_mtime, size, path))
+            except OSError:
+                continue
+        return entries
+
+    def _remove_stale(self) -> None:
+        deadline = time.time() - _STALE_SECONDS
+        for path in self._root.iterdir():
+            if not path.name.startswith((".staging-", ".trash-")):
+                continue
+            try:
+                if path.stat().st_mtime > deadline:
+                    # most likely being written or removed by a live process
+                    continue
+            except OSError:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            logger.info(f"Stale asset folder {path.name} removed")
+
+    def _evict(self, keep: str) -> None:
+        self._remove_stale()
+        if not self._max_bytes:
+            return
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= self._max_bytes:
+                    break
+                if path.name == keep:
+                    continue
+                # renamed first, the removal can't be seen half done
+                trash = self._root / f".trash-{path.name}-{os.getpid()}-{threading.get_ident()}"
+                try:
+                    os.rename(path, trash)
+                except OSError:
+                    continue
+                shutil.rmtree(trash, ignore_errors=True)
+                total -= size
+                logger.info(f"Asset {path.name} evicted ({size} bytes)")
+
+    def stats(self) -> Dict[str, int]:
+        entries = self._entries()
+        return {"assets": len(entries),
+                "size_bytes": sum(size for _, size, _ in entries),
+                "max_bytes": self._max_bytes}
+
+
+_store: Optional[AssetStore] = None
+_store_lock: threading.Lock = threading.Lock()
+
+
+def get_asset_store() -> AssetStore:
+    """Returns the process-wide store in $ASSET_DIR, bounded by $ASSET_MAX_BYTES (2 GiB by default)."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            root: str = os.getenv("ASSET_DIR", "assets")
+            max_bytes: int = int(os.getenv("ASSET_MAX_BYTES", str(2 * 1024 ** 3)))
+            _store = AssetStore(root, max_bytes=max_bytes)
+            logger.info(f"Asset store opened in {root}, up to {max_bytes} bytes")
+        return _store
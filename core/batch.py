@@ -0,0 +1,107 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterable, Iterator, Optional, Set, Tuple, Type
+
+from common.logger import logger
+
+
+@dataclass
+class BatchResult:
+    index: int
+    output: Any = None
+    parameters: dict = field(default_factory=dict)
+    error: Optional[str] = None
+
+
+class BatchComposer:
+    def __init__(self,
+                 submit: Callable[[int, bytes], "Future[BatchResult]"],
+                 max_pending: int,
+                 busy: Tuple[Type[Exception], ...] = (),
+                 max_wait: float = 30.0,
+                 retry_delay: float = 0.1):
+        """
+        Runs the images of a batch through `submit`, typically a job of the server executor,
+        so a batch shares the workers (and their admission limit) with every other request.
+
+        Args:
+            submit: Schedules the composition of one (index, encoded image); its future gives
+                    the BatchResult, with the error of that image if it failed.
+            max_pending: Images read ahead and in progress at most, which bounds the memory
+                         whatever the batch size.
+            busy: Exceptions of `submit` meaning there is no room right now. They propagate
+                  for the first image, so the whole batch can be rejected before any output;
+                  later images wait for room, up to `max_wait` seconds, then fail alone.
+            max_wait: Seconds an image waits for room once the batch has started.
+            retry_delay: Seconds between two admission attempts when none of the batch runs.
+        """
+        if max_pending < 1:
+            raise ValueError(f"max_pending must be at least 1, got {max_pending}")
+        self._submit: Callable[[int, bytes], Future] = submit
+        self._max_pending: int = max_pending
+        self._busy: Tuple[Type[Exception], ...] = busy
+        self._max_wait: float = max_wait
+        self._retry_delay: float = retry_delay
+
+    def compose(self, sources: Iterable[bytes]) -> Iterator[BatchResult]:
+        """
+        Submits the first image right away, raising the `busy` exceptions if it isn't
+        admitted, then returns the results as they complete: the order follows completion,
+        not `sources`, and `BatchResult.index` gives the position. Sources are only pulled
+        when there is room for them in the pending window.
+        """
+        source_iterator = enumerate(sources)
+        pending: Set[Future] = set()
+        first = next(source_iterator, None)
+        if first is not None:
+            pending.add(self._submit(*first))
+        return self._results(source_iterator, pending)
+
+    def _results(self, source_iterator: Iterator[Tuple[int, bytes]], pending: Set[Future]) -> Iterator[BatchResult]:
+        completed: int = 0
+        waiting: Optional[Tuple[int, bytes]] = None
+        try:
+            while True:
+                while len(pending) < self._max_pending:
+                    if waiting is None:
+                        waiting = next(source_iterator, None)
+                        if waiting is None:
+                            break
+                    result = self._admit(waiting, pending)
+                    if result is False:
+                        # no room: wait for one of the running images of the batch
+                        break
+                    waiting = None
+                    if isinstance(result, BatchResult):
+                        completed += 1
+                        yield result
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    completed += 1
+                    yield future.result()
+        finally:
+            # also reached when the consumer stops early: the images not started are dropped
+            for future in pending:
+                future.cancel()
+        logger.info(f"Batch of {completed} image(s) composed")
+
+    def _admit(self, source: Tuple[int, bytes], pending: Set[Future]) -> Any:
+        """
+        Returns True once submitted, False if there is no room while images of the batch
+        run, or the error result of the image if no room came within `max_wait` seconds.
+        """
+        deadline = time.monotonic() + self._max_wait
+        while True:
+            try:
+                pending.add(self._submit(*source))
+                return True
+            except self._busy as exc:
+                if pending:
+                    return False
+                if time.monotonic() >= deadline:
+                    logger.warning(f"Batch image {source[0]} dropped: {exc}")
+                    return BatchResult(index=source[0], error="Server busy, please retry later")
+                time.sleep(self._retry_delay)
@@ -3,7 +3,8 @@ from core.interfaces.image_loader import ImageLoaderInterface
 from core.interfaces.foreground import ForegroundInterface
 from core.text import TextFT
 from common.logger import logger
-from common.utils import Position
+from common.metrics import timed
+from common.utils import Position, Size
 from typing import Optional
 import cv2
 import numpy as np
@@ -13,11 +14,19 @@ class Composer:
                  image_loader: ImageLoaderInterface,
                  foreground: ForegroundInterface,
                  background: BackgroundInterface,
-                 text: Optional[TextFT] = None):
+                 text: Optional[TextFT] = None,
+                 output: Optional[np.ndarray] = None):
+        """
+        Args:
+            output: If given, the buffer the output is composed into (e.g. a shared memory
+                    segment) instead of a new array. Used when its shape matches the image.
+        """
+        self._output_buffer: Optional[np.ndarray] = output
         self._image_loader: ImageLoaderInterface = image_loader
         self._foreground: ForegroundInterface = foreground
         self._background: BackgroundInterface = background
         self._text: TextFT = text
+        self._text_region: Optional[tuple[int, int, int, int]] = None
         self._processed = self._processing()
         self._output = None
         if self._processed:
@@ -58,7 +67,9 @@ class Composer:
         self._text = text
         # Only reset position if it's zero or invalid
         if text.is_position_zero() or not self.check_text_bounds():
-            logger.debug(f"Resetting position: is_zero={text.is_position_zero()}, bounds_valid={self.check_text_bounds()}")
+            # lazy: the checks are only evaluated again when DEBUG is enabled
+            logger.opt(lazy=True).debug("Resetting position: is_zero={}, bounds_valid={}",
+                                        text.is_position_zero, self.check_text_bounds)
             self._text.set_position(Position(0, 0))
         self._composing()
         if self._output is None:
@@ -67,8 +78,78 @@ class Composer:
             return False, Position(0, 0)
         return True, self._text.get_position()
 
-    def check_text_bounds(self):
-        """Check if the text fits within the image boundaries."""
+    def update_text(self, text: TextFT) -> Optional[tuple[int, int, int, int]]:
+        """
+        Re-composes the output for a new text, touching only the regions of the previous
+        text and of the new one. Falls back to a full composition if there is no output yet.
+
+        Returns:
+            The updated region of the output as (x, y, width, height), or None on failure.
+        """
+        background_img = self._background.get_background()
+        if self._output is None or background_img is None:
+            success, _ = self.set_text(text)
+            if not success:
+                return None
+            height, width = self._output.shape[:2]
+            return 0, 0, width, height
+
+        self._text = text
+        if text.is_position_zero() or not self.check_text_bounds():
+            self._text.set_position(Position(0, 0))
+        if not self._place_text(background_img):
+            return None
+
+        # erase the previous text, then draw the new one
+        previous = self._text_region
+        if previous is not None:
+            x, y, width, height = previous
+            self._output[y:y + height, x:x + width] = background_img[y:y + height, x:x + width]
+        self._text_region = self._text.render_into(self._output)
+        if self._text_region is None:
+            logger.error("Composer: Text rendering failed.")
+        dirty = previous
+        if self._text_region is not None:
+            dirty = self._text_region if dirty is None else self._union(dirty, self._text_region)
+        if dirty is None:
+            return None
+
+        # the foreground goes back on top, within the updated region only
+        x, y, width, height = dirty
+        mask = self._foreground.get_mask()
+        np.copyto(self._output[y:y + height, x:x + width],
+                  self._image_loader.get_source()[y:y + height, x:x + width],
+                  where=mask[y:y + height, x:x + width, np.newaxis] > 0)
+        return dirty if self._text_region is not None else None
+
+    @staticmethod
+    def _union(first: tuple[int, int, int, int], second: tuple[int, int, int, int]) -> tuple[int, int, int, int]:
+        left = min(first[0], second[0])
+        top = min(first[1], second[1])
+        right = max(first[0] + first[2], second[0] + second[2])
+        bottom = max(first[1] + first[3], second[1] + second[3])
+        return left, top, right - left, bottom - top
+
+    def _place_text(self, background_img: np.ndarray) -> bool:
+        """Auto-fits the text if it has no position, then checks it is inside the image."""
+        text_size: Optional[Size] = None
+        if self._text.is_position_zero():
+            fitted = self._text.compute_auto_position(background_img)
+            if fitted is not None:
+                text_size = fitted[0]
+        if not self.check_text_bounds(text_size):
+            logger.error("Text position after auto-positioning is out of bounds")
+            return False
+        return True
+
+    def check_text_bounds(self, text_size: Optional[Size] = None):
+        """
+        Check if the text fits within the image boundaries.
+
+        Args:
+            text_size: The already measured text size, e.g. the one returned by the auto-fit.
+                       Measured from the text if None.
+        """
         if self._text is None:
             logger.warning("No text provided for boundary check.")
             return True
@@ -77,7 +158,8 @@ class Composer:
             logger.error("Cannot check bounds: background is None.")
             return False
         height, width = background_img.shape[:2]
-        text_size = self._text.get_text_size()
+        if text_size is None:
+            text_size = self._text.get_text_size()
         position = self._text.get_position()
         if (position.x < 0 or position.y < 0 or
             position.x + text_size.x > width or
@@ -97,7 +179,7 @@ class Composer:
                 return False
             # self.show_image(self._foreground.get_foreground())
 
-            if not self._background.extract(image=self._image_loader.get_source().copy()):
+            if not self._background.extract(image=self._image_loader.get_source()):
                 logger.error("Cannot be run due the background extractor")
                 return False
             # self.show_image(self._background.get_background())
@@ -105,6 +187,14 @@ class Composer:
             return False
         return True
 
+    def _new_output(self, background_img: np.ndarray) -> np.ndarray:
+        buffer = self._output_buffer
+        if buffer is not None and buffer.shape == background_img.shape and buffer.dtype == background_img.dtype:
+            np.copyto(buffer, background_img)
+            return buffer
+        return background_img.copy()
+
+    @timed("compose")
     def _composing(self):
         try:
             background_img = self._background.get_background()
@@ -123,62 +213,47 @@ class Composer:
                 self._output = None
                 return
 
-            shape = background_img.shape
-            self._output = np.zeros(shape, dtype=background_img.dtype) # match dtype
-            background_output = background_img.copy()
-
+            self._text_region = None
             if self._text is not None:
-                if self._text.is_position_zero():
-                    self._text.compute_auto_position(background_img)
-                if not self.check_text_bounds():
-                    logger.error("Text position after auto-positioning is out of bounds")
+                if not self._place_text(background_img):
                     self._output = None
                     return
-                image_with_text = self._text.render(background_output)
-                if image_with_text is None:
+                # the background copy is the output buffer, text and foreground are written into it in place
+                output = self._new_output(background_img)
+                text_region = self._text.render_into(output)
+                if text_region is None:
                     logger.error("Composer: Text rendering failed.")
                     self._output = None
                     return
-                if not isinstance(image_with_text, np.ndarray):
-                    logger.error(f"Composer: Text rendering returned non-array type: {type(image_with_text)}")
-                    self._output = None
-                    return
             else:
                 logger.warning("Composer: No text object provided, composing without text.")
-                image_with_text = background_output # Use original background if no text
+                output = self._new_output(background_img) # Use original background if no text
+                text_region = None
 
-            foreground_img = self._foreground.get_foreground()
-            mask_3d = self._foreground.get_mask3d()
+            source_img = self._image_loader.get_source()
+            mask = self._foreground.get_mask()
 
-            if foreground_img is None or not isinstance(foreground_img, np.ndarray):
-                logger.error(f"Composer: Invalid foreground image (None or type {type(foreground_img)}).")
-                self._output = None
-                return
-            if mask_3d is None or not isinstance(mask_3d, np.ndarray):
-                logger.error(f"Composer: Invalid foreground mask (None or type {type(mask_3d)}).")
+            if mask is None or not isinstance(mask, np.ndarray):
+                logger.error(f"Composer: Invalid foreground mask (None or type {type(mask)}).")
                 self._output = None
                 return
 
             # Ensure shapes match
-            if foreground_img.shape != background_img.shape:
-                logger.error(f"Shape mismatch: Foreground {foreground_img.shape} vs Background {background_img.shape}")
+            if source_img is None or source_img.shape != background_img.shape:
+                logger.error(f"Shape mismatch: Source {None if source_img is None else source_img.shape} vs Background {background_img.shape}")
                 self._output = None
                 return
-            if mask_3d.shape != background_img.shape:
-                logger.error(f"Shape mismatch: Mask {mask_3d.shape} vs Background {background_img.shape}")
+            if mask.shape != background_img.shape[:2] or mask.dtype != np.uint8:
+                logger.error(f"Mask mismatch: Mask {mask.shape} ({mask.dtype}) vs Background {background_img.shape}")
                 self._output = None
                 return
 
-            # Normalize mask to binary (0 or 255) for each channel
-            mask_3d = (mask_3d > 128).astype(np.uint8) * 255
-
-            # Ensure mask and images have the same dtype
-            foreground_img = foreground_img.astype(background_img.dtype)
-            image_with_text = image_with_text.astype(background_img.dtype)
-
-            # Apply the mask to combine foreground and background with text
-            self._output = np.where(mask_3d == 255, foreground_img, image_with_text)
-            logger.debug(f"Composer: Composition successful. Output shape: {self._output.shape}, dtype: {self._output.dtype}")
+            # Copy the foreground (the source pixels under the single channel mask) over the text layer
+            cv2.copyTo(source_img, mask, output)
+            self._output = output
+            self._text_region = text_region
+            logger.debug("Composer: Composition successful. Output shape: {}, dtype: {}",
+                         self._output.shape, self._output.dtype)
 
         except Exception as exc:
             logger.error(f"Composer: Unexpected error during composing: {exc}", exc_info=True)
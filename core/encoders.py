@@ -0,0 +1,177 @@
+import os
+from typing import Callable, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from typing_extensions import override
+
+from common.logger import logger
+from common.metrics import timed
+from core.interfaces.encoder import EncoderInterface
+
+
+class _OpenCVEncoder(EncoderInterface):
+    def __init__(self, media_type: str, extension: str, params: List[int]):
+        self._media_type: str = media_type
+        self._extension: str = extension
+        self._params: List[int] = params
+
+    @property
+    @override
+    def media_type(self) -> str:
+        return self._media_type
+
+    @property
+    @override
+    def extension(self) -> str:
+        return self._extension
+
+    @override
+    @timed("encode")
+    def encode(self, image: np.ndarray) -> np.ndarray:
+        """
+        Encodes the BGR image into the 1-D uint8 buffer filled by OpenCV. Its `data`
+        memoryview can be sent or written without copying it into a `bytes` object.
+
+        Raises:
+            ValueError: If OpenCV fails to encode the image.
+        """
+        success, buffer = cv2.imencode(f".{self._extension}", image, self._params)
+        if not success:
+            raise ValueError(f"Failed to encode the image as {self._extension.upper()}")
+        logger.debug("Image {} encoded as {} in {} bytes", image.shape, self._extension.upper(), buffer.size)
+        return buffer.reshape(-1)
+
+
+class PNGEncoder(_OpenCVEncoder):
+    def __init__(self, compression: int = 1):
+        """
+        Lossless PNG.
+
+        Args:
+            compression: zlib level from 0 (fastest, largest) to 9 (slowest, smallest).
+        """
+        if not 0 <= compression <= 9:
+            raise ValueError(f"PNG compression must be in [0, 9], got {compression}")
+        super().__init__("image/png", "png", [cv2.IMWRITE_PNG_COMPRESSION, compression])
+
+
+class JPEGEncoder(_OpenCVEncoder):
+    def __init__(self, quality: int = 90):
+        """
+        Lossy JPEG, by far the fastest to encode for photos.
+
+        Args:
+            quality: From 1 (smallest) to 100 (best).
+        """
+        if not 1 <= quality <= 100:
+            raise ValueError(f"JPEG quality must be in [1, 100], got {quality}")
+        super().__init__("image/jpeg", "jpg", [cv2.IMWRITE_JPEG_QUALITY, quality])
+
+
+class WebPEncoder(_OpenCVEncoder):
+    def __init__(self, quality: int = 90):
+        """
+        WebP, smaller than JPEG at the same quality but slower to encode.
+
+        Args:
+            quality: From 1 (smallest) to 100 (best); above 100 the image is encoded lossless.
+        """
+        if not 1 <= quality <= 101:
+            raise ValueError(f"WebP quality must be in [1, 101], got {quality}")
+        super().__init__("image/webp", "webp", [cv2.IMWRITE_WEBP_QUALITY, quality])
+
+
+def _png(level: Optional[int]) -> EncoderInterface:
+    return PNGEncoder(compression=level if level is not None else int(os.getenv("PNG_COMPRESSION", "1")))
+
+
+def _jpeg(level: Optional[int]) -> EncoderInterface:
+    return JPEGEncoder(quality=level if level is not None else int(os.getenv("JPEG_QUALITY", "90")))
+
+
+def _webp(level: Optional[int]) -> EncoderInterface:
+    return WebPEncoder(quality=level if level is not None else int(os.getenv("WEBP_QUALITY", "90")))
+
+
+# format name -> (media type, factory taking the compression level or quality)
+_ENCODERS: Dict[str, Tuple[str, Callable[[Optional[int]], EncoderInterface]]] = {
+    "png": ("image/png", _png),
+    "jpeg": ("image/jpeg", _jpeg),
+    "webp": ("image/webp", _webp),
+}
+_ALIASES: Dict[str, str] = {"jpg": "jpeg"}
+
+
+def get_available_formats() -> List[str]:
+    return list(_ENCODERS)
+
+
+def get_default_format() -> str:
+    """Returns the format configured by $OUTPUT_FORMAT (png by default)."""
+    return normalize_format(os.getenv("OUTPUT_FORMAT", "png"))
+
+
+def normalize_format(image_format: str) -> str:
+    """
+    Raises:
+        ValueError: If the format has no encoder.
+    """
+    name = image_format.strip().lower()
+    name = _ALIASES.get(name, name)
+    if name not in _ENCODERS:
+        raise ValueError(f"Unknown format '{image_format}'. Available formats: {get_available_formats()}")
+    return name
+
+
+def get_encoder(image_format: Optional[str] = None, level: Optional[int] = None) -> EncoderInterface:
+    """
+    Creates the encoder of a format.
+
+    Args:
+        image_format: png, jpeg (or jpg) or webp. None uses $OUTPUT_FORMAT.
+        level: The PNG compression level or the JPEG/WebP quality. None uses
+               $PNG_COMPRESSION (1), $JPEG_QUALITY (90) or $WEBP_QUALITY (90).
+
+    Raises:
+        ValueError: If the format is unknown or the level out of range.
+    """
+    name = normalize_format(image_format) if image_format else get_default_format()
+    return _ENCODERS[name][1](level)
+
+
+def negotiate_format(accept: Optional[str], default: Optional[str] = None) -> Optional[str]:
+    """
+    Picks the format matching best an HTTP `Accept` header, following the q-values.
+    Wildcards (`*/*`, `image/*`) select the default format.
+
+    Returns:
+        The format name, or None if the header only accepts types without encoder.
+    """
+    default = normalize_format(default) if default else get_default_format()
+    if not accept:
+        return default
+    candidates: List[Tuple[float, int, str]] = []
+    for order, item in enumerate(accept.split(",")):
+        media_range, *params = [part.strip() for part in item.split(";")]
+        quality: float = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality <= 0.0:
+            continue
+        media_range = media_range.lower()
+        if media_range in ("*/*", "image/*"):
+            candidates.append((quality, order, default))
+            continue
+        for name, (media_type, _) in _ENCODERS.items():
+            if media_type == media_range:
+                candidates.append((quality, order, name))
+    if not candidates:
+        return None
+    # highest q-value first, then the order of the header
+    return min(candidates, key=lambda candidate: (-candidate[0], candidate[1]))[2]
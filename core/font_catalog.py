@@ -0,0 +1,264 @@
+import base64
+import json
+import os
+import tempfile
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from common.logger import logger
+from core.fonts import Fonts
+
+# bumped when the file format changes, older catalogs are rebuilt
+_CATALOG_VERSION = 1
+# codepoints per block of the coverage bitmap
+_BLOCK_BITS = 8
+_BLOCK_SIZE = 1 << _BLOCK_BITS
+
+
+class Coverage:
+    def __init__(self, blocks: Dict[int, bytes]):
+        """
+        The codepoints of a font as a two-level bitmap: one bit per codepoint, grouped in
+        blocks of 256 codepoints of which only the non-empty ones are kept. A Latin font
+        takes a few hundred bytes, a CJK one a few kilobytes, and a lookup is two indexings.
+
+        Args:
+            blocks: Block index (codepoint >> 8) to its 32 bytes bitmap.
+        """
+        self._blocks: Dict[int, bytes] = blocks
+
+    @staticmethod
+    def from_codepoints(codepoints: Iterable[int]) -> "Coverage":
+        blocks: Dict[int, bytearray] = {}
+        for codepoint in codepoints:
+            block = blocks.setdefault(codepoint >> _BLOCK_BITS, bytearray(_BLOCK_SIZE // 8))
+            offset = codepoint & (_BLOCK_SIZE - 1)
+            block[offset >> 3] |= 1 << (offset & 7)
+        return Coverage({index: bytes(block) for index, block in blocks.items()})
+
+    def __contains__(self, codepoint: int) -> bool:
+        block = self._blocks.get(codepoint >> _BLOCK_BITS)
+        if block is None:
+            return False
+        offset = codepoint & (_BLOCK_SIZE - 1)
+        return bool(block[offset >> 3] >> (offset & 7) & 1)
+
+    def __len__(self) -> int:
+        return sum(int.from_bytes(block, "little").bit_count() for block in self._blocks.values())
+
+    def to_dict(self) -> dict:
+        indices = sorted(self._blocks)
+        return {"blocks": indices,
+                "bits": base64.b64encode(b"".join(self._blocks[index] for index in indices)).decode("ascii")}
+
+    @staticmethod
+    def from_dict(data: dict) -> "Coverage":
+        bits = base64.b64decode(data["bits"])
+        size = _BLOCK_SIZE // 8
+        return Coverage({index: bits[position * size:(position + 1) * size]
+                         for position, index in enumerate(data["blocks"])})
+
+
+@dataclass(frozen=True)
+class FontEntry:
+    """
+    What the catalog knows about a font file. `coverage` is None when it couldn't be read,
+    such a font is assumed to cover every character and is never a fallback.
+    """
+    name: str
+    path: str
+    family: str
+    style: str
+    mtime_ns: int
+    size: int
+    coverage: Optional[Coverage] = None
+
+    def covers(self, codepoint: int) -> bool:
+        return self.coverage is None or codepoint in self.coverage
+
+    def to_dict(self) -> dict:
+        return {"name": self.name, "path": self.path, "family": self.family, "style": self.style,
+                "mtime_ns": self.mtime_ns, "size": self.size,
+                "coverage": self.coverage.to_dict() if self.coverage is not None else None}
+
+    @staticmethod
+    def from_dict(data: dict) -> "FontEntry":
+        coverage = data.get("coverage")
+        return FontEntry(name=data["name"], path=data["path"], family=data["family"], style=data["style"],
+                         mtime_ns=data["mtime_ns"], size=data["size"],
+                         coverage=Coverage.from_dict(coverage) if coverage is not None else None)
+
+
+def _has_fonttools() -> bool:
+    try:
+        import fontTools  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def read_font(name: str, path: str) -> FontEntry:
+    """
+    Reads the family, the style and the character map of a font file with fontTools.
+    Without fontTools, or if the file can't be parsed, the entry has no coverage.
+    """
+    stat = os.stat(path)
+    family, style, coverage = name, "Regular", None
+    if _has_fonttools():
+        from fontTools.ttLib import TTFont
+        try:
+            with TTFont(path, lazy=True, fontNumber=0) as font:
+                names = font["name"]
+                family = names.getBestFamilyName() or family
+                style = names.getBestSubFamilyName() or style
+                cmap = font.getBestCmap()
+                if cmap is not None:
+                    coverage = Coverage.from_codepoints(cmap)
+        except Exception as exc:
+            logger.warning(f"Font '{path}' can't be indexed: {exc}")
+    return FontEntry(name=name, path=path, family=family, style=style,
+                     mtime_ns=stat.st_mtime_ns, size=stat.st_size, coverage=coverage)
+
+
+class FontCatalog:
+    def __init__(self, fonts: Fonts, catalog_path: Optional[str] = None, fallback: Sequence[str] = ()):
+        """
+        Family, style and codepoint coverage of every font of the folder, kept on disk so
+        that a font file is only read again when its modification time or size changes.
+        At request time the fallback fonts of a text are chosen from the bitmaps alone,
+        without opening any font file.
+
+        Args:
+            fonts: The scanned font folder.
+            catalog_path: The catalog file, `.font_catalog.json` in the font folder if None.
+                          The catalog is kept in memory only if it can't be written.
+            fallback: Font names tried first for the characters the requested font lacks,
+                      the other fonts follow from the largest coverage to the smallest.
+        """
+        self._path: Path = Path(catalog_path) if catalog_path else fonts.get_folder() / ".font_catalog.json"
+        self._entries: Dict[str, FontEntry] = {}
+        self._by_path: Dict[str, FontEntry] = {}
+        # (codepoint, style) -> the fallback font of that character, memoized across requests
+        self._fallbacks: Dict[Tuple[int, str], Optional[FontEntry]] = {}
+        self._lock: threading.Lock = threading.Lock()
+        if not _has_fonttools():
+            logger.warning("fontTools isn't installed: the fonts have no coverage, characters won't fall back")
+        reused = self._load(fonts)
+        self._order: List[FontEntry] = self._fallback_order(fallback)
+        logger.info(f"Font catalog of {len(self._entries)} font(s), {len(self._entries) - reused} indexed again")
+
+    def _load(self, fonts: Fonts) -> int:
+        stored: Dict[str, FontEntry] = {}
+        try:
+            data = json.loads(self._path.read_text())
+            if data.get("version") == _CATALOG_VERSION:
+                stored = {entry["path"]: FontEntry.from_dict(entry) for entry in data["fonts"]}
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError) as exc:
+            logger.warning(f"Font catalog '{self._path}' unreadable, rebuilding it: {exc}")
+
+        reused = 0
+        for name in fonts.get_fonts():
+            path = fonts.get_font(name)
+            try:
+                stat = os.stat(path)
+                entry = stored.get(path)
+                if entry is not None and entry.name == name and \
+                        (entry.mtime_ns, entry.size) == (stat.st_mtime_ns, stat.st_size):
+                    reused += 1
+                else:
+                    entry = read_font(name, path)
+            except OSError as exc:
+                logger.warning(f"Font '{path}' skipped by the catalog: {exc}")
+                continue
+            self._entries[name] = entry
+            self._by_path[path] = entry
+
+        if reused != len(self._entries) or len(stored) != len(self._entries):
+            self._save()
+        return reused
+
+    def _save(self) -> None:
+        data = {"version": _CATALOG_VERSION, "fonts": [entry.to_dict() for entry in self._entries.values()]}
+        try:
+            descriptor, temporary = tempfile.mkstemp(prefix=".font_catalog-", suffix=".json", dir=self._path.parent)
+        except OSError as exc:
+            logger.warning(f"Font catalog not written to '{self._path}': {exc}")
+            return
+        try:
+            with os.fdopen(descriptor, "w") as catalog_file:
+                json.dump(data, catalog_file)
+            # renamed into place, concurrent workers never read a partial catalog
+            os.replace(temporary, self._path)
+        except OSError as exc:
+            Path(temporary).unlink(missing_ok=True)
+            logger.warning(f"Font catalog not written to '{self._path}': {exc}")
+
+    def _fallback_order(self, fallback: Sequence[str]) -> List[FontEntry]:
+        for name in fallback:
+            if name not in self._entries:
+                logger.warning(f"Fallback font '{name}' isn't in the font folder")
+        preferred = [self._entries[name] for name in dict.fromkeys(fallback)
+                     if name in self._entries and self._entries[name].coverage is not None]
+        others = sorted((entry for entry in self._entries.values()
+                         if entry.coverage is not None and entry.name not in fallback),
+                        key=lambda entry: -len(entry.coverage))
+        return preferred + others
+
+    def get(self, name: str) -> Optional[FontEntry]:
+        return self._entries.get(name)
+
+    def get_entries(self) -> List[FontEntry]:
+        return list(self._entries.values())
+
+    def fallback_for(self, codepoint: int, style: str = "Regular") -> Optional[FontEntry]:
+        """The first fallback font covering the character, of the same style if one does."""
+        key = (codepoint, style)
+        with self._lock:
+            if key in self._fallbacks:
+                return self._fallbacks[key]
+        covering = [entry for entry in self._order if entry.covers(codepoint)]
+        found = next((entry for entry in covering if entry.style == style), covering[0] if covering else None)
+        with self._lock:
+            self._fallbacks[key] = found
+        return found
+
+    def split_runs(self, text: str, font_path: str) -> List[Tuple[str, str]]:
+        """
+        Splits the text into runs of characters drawn with the same font: the font at
+        `font_path` wherever it covers them, a fallback font otherwise. Whitespace stays
+        in the current run. Characters no font covers are left to the requested font.
+
+        Returns:
+            (run text, font path) pairs in text order, a single run if no fallback is needed.
+        """
+        primary = self._by_path.get(font_path)
+        if primary is None or primary.coverage is None:
+            return [(text, font_path)]
+        runs: List[Tuple[str, str]] = []
+        start = 0
+        current = primary
+        for index, character in enumerate(text):
+            codepoint = ord(character)
+            if current.covers(codepoint) and (current is primary or character.isspace()
+                                              or not primary.covers(codepoint)):
+                continue
+            if primary.covers(codepoint):
+                entry = primary
+            else:
+                entry = self.fallback_for(codepoint, primary.style) or primary
+            if entry is not current:
+                if index > start:
+                    runs.append((text[start:index], current.path))
+                start, current = index, entry
+        runs.append((text[start:], current.path))
+        return runs
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"fonts": len(self._entries),
+                    "indexed": sum(entry.coverage is not None for entry in self._entries.values()),
+                    "memoized_fallbacks": len(self._fallbacks)}
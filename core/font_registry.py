@@ -0,0 +1,133 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Sequence, Tuple
+
+from PIL import ImageFont
+from PIL.ImageFont import FreeTypeFont
+
+from common.logger import logger
+from core.font_catalog import FontCatalog
+from core.fonts import Fonts
+
+
+class FontRegistry:
+    def __init__(self, max_handles: int = 64, catalog_path: Optional[str] = None, fallback: Sequence[str] = ()):
+        """
+        Process-wide access to the font folder, its catalog and the loaded FreeType handles.
+
+        The folder is scanned once per ($FONT_FOLDER, $FONT_EXTENSION) configuration, or
+        again on `refresh`. Loaded fonts are memoized per (path, size) in a bounded LRU,
+        so changing the font or its size at request time is a dictionary lookup.
+
+        Args:
+            max_handles: Maximum number of FreeTypeFont objects kept alive.
+            catalog_path: The font catalog file, see FontCatalog.
+            fallback: Font names tried first for the characters a font lacks.
+        """
+        self._max_handles: int = max(1, max_handles)
+        self._catalog_path: Optional[str] = catalog_path
+        self._fallback: List[str] = list(fallback)
+        self._fonts: Optional[Fonts] = None
+        self._catalog: Optional[FontCatalog] = None
+        self._config: Optional[Tuple[str, str]] = None
+        self._handles: "OrderedDict[Tuple[str, int], FreeTypeFont]" = OrderedDict()
+        self._hits: int = 0
+        self._misses: int = 0
+        self._lock: threading.RLock = threading.RLock()
+
+    @staticmethod
+    def _current_config() -> Tuple[str, str]:
+        return os.getenv("FONT_FOLDER", "temp_font"), os.getenv("FONT_EXTENSION", 'ttf')
+
+    def get_fonts(self) -> Fonts:
+        """
+        Returns the scanned font folder, scanning it only if the configuration changed.
+
+        Raises:
+            FileNotFoundError: If the font folder doesn't exist.
+        """
+        config = self._current_config()
+        with self._lock:
+            if self._fonts is None or self._config != config:
+                return self._scan(config)
+            return self._fonts
+
+    def get_catalog(self) -> FontCatalog:
+        """
+        Returns the catalog of the scanned font folder, built with the scan.
+
+        Raises:
+            FileNotFoundError: If the font folder doesn't exist.
+        """
+        config = self._current_config()
+        with self._lock:
+            if self._catalog is None or self._config != config:
+                self._scan(config)
+            return self._catalog
+
+    def refresh(self) -> Fonts:
+        """Scans the font folder again and drops the loaded handles."""
+        with self._lock:
+            return self._scan(self._current_config())
+
+    def _scan(self, config: Tuple[str, str]) -> Fonts:
+        fonts = Fonts()
+        # the font files are only read again if they changed since the catalog was written
+        self._catalog = FontCatalog(fonts, catalog_path=self._catalog_path, fallback=self._fallback)
+        self._fonts = fonts
+        self._config = config
+        self._handles.clear()
+        return fonts
+
+    def get_font_handle(self, font_path: str, size: int) -> FreeTypeFont:
+        """
+        Returns the FreeTypeFont for the file at the given size, loading it on first use.
+
+        Raises:
+            OSError: If the font file can't be read, as `ImageFont.truetype` does.
+        """
+        key = (font_path, size)
+        with self._lock:
+            handle = self._handles.get(key)
+            if handle is not None:
+                self._handles.move_to_end(key)
+                self._hits += 1
+                return handle
+            self._misses += 1
+        handle = ImageFont.truetype(font_path, size)
+        with self._lock:
+            self._handles[key] = handle
+            self._handles.move_to_end(key)
+            while len(self._handles) > self._max_handles:
+                self._handles.popitem(last=False)
+        return handle
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self._hits,
+                    "misses": self._misses,
+                    "handles": len(self._handles),
+                    "max_handles": self._max_handles}
+
+
+_registry: Optional[FontRegistry] = None
+_registry_lock: threading.Lock = threading.Lock()
+
+
+def get_font_registry() -> FontRegistry:
+    """
+    Returns the process-wide registry, bounded by $FONT_HANDLE_CACHE_SIZE handles. The
+    catalog is written to $FONT_CATALOG (in the font folder by default) and the fonts of
+    $FONT_FALLBACK (comma separated names) are the first fallbacks.
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            max_handles: int = int(os.getenv("FONT_HANDLE_CACHE_SIZE", "64"))
+            _registry = FontRegistry(max_handles=max_handles,
+                                     catalog_path=os.getenv("FONT_CATALOG") or None,
+                                     fallback=[name.strip() for name in os.getenv("FONT_FALLBACK", "").split(",")
+                                               if name.strip()])
+            logger.info(f"Font registry created, keeping up to {max_handles} font handle(s)")
+        return _registry
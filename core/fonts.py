@@ -61,6 +61,9 @@ class Fonts:
 
         return len(self._fonts)
 
+    def get_folder(self) -> Path:
+        return self._font_path
+
     def get_fonts(self) -> List[str]:
         """Returns a list of loaded font names (stems)."""
         return list(self._fonts.keys())
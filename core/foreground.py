@@ -1,37 +1,154 @@
 from core.interfaces.foreground import ForegroundInterface
-import mediapipe as mp
+from core.segmenter_pool import SegmenterPool, get_segmenter_pool
+from core.mask_cache import MaskCache, get_mask_cache
 from common.logger import logger
-import types
-from typing import Optional, override
+from common.metrics import stage
+from typing import Callable, Optional, TypeVar, override
 import numpy as np
 import cv2
+import os
+
+T = TypeVar("T")
 
 class Foreground(ForegroundInterface):
-    def __init__(self):
-        self._mp_segmentation: types.ModuleType = mp.solutions.selfie_segmentation
+    def __init__(self,
+                 pool: Optional[SegmenterPool] = None,
+                 cache: Optional[MaskCache] = None,
+                 max_side: Optional[int] = None):
+        """
+        Args:
+            pool: Segmenters used for the inference. Defaults to the process-wide pool.
+            cache: Cache of the computed masks. Defaults to the process-wide cache.
+            max_side: If positive, images whose longest side is larger are segmented on a
+                      resized copy and the probability mask is upsampled before thresholding.
+                      None reads $SEGMENTATION_MAX_SIDE (0, the default, disables it).
+        """
+        self._pool: SegmenterPool = pool if pool is not None else get_segmenter_pool()
+        self._cache: MaskCache = cache if cache is not None else get_mask_cache()
+        self._max_side: int = max_side if max_side is not None else int(os.getenv("SEGMENTATION_MAX_SIDE", "0"))
+        self._image: Optional[np.ndarray] = None
+        self._mask: Optional[np.ndarray] = None
         self._image_foreground: Optional[np.ndarray] = None
         self._mask_3d: Optional[np.ndarray] = None
 
     @override
     def extract(self, image: np.ndarray, threshold: float=0.55) -> bool:
-        with self._mp_segmentation.SelfieSegmentation(model_selection=1) as segmenter:
-            img_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB) # rgb to mediapipe
+        cache_key: Optional[str] = None
+        foreground_mask: Optional[np.ndarray] = None
+        if self._cache.enabled:
+            cache_key = self._cache.make_key(image, threshold, self._pool.model_id, self._max_side)
+            foreground_mask = self._cache.get(cache_key)
+        if foreground_mask is None:
+            with stage("segmentation"):
+                foreground_mask = self._segment(image, threshold)
+            if foreground_mask is None:
+                return False
+            if cache_key is not None:
+                self._cache.put(cache_key, foreground_mask)
+        else:
+            logger.debug("Foreground mask taken from the cache")
+        # only the single channel mask is kept, the 3-channel views are built on demand
+        self._image = image
+        self._mask = foreground_mask
+        self._image_foreground = None
+        self._mask_3d = None
+        logger.debug("Foreground extracted {}", foreground_mask.shape)
+        return True
+
+    @property
+    def max_side(self) -> int:
+        return self._max_side
+
+    def _infer(self, image: np.ndarray, consume: Callable[[np.ndarray], T]) -> Optional[T]:
+        height, width = image.shape[:2]
+        longest_side: int = max(height, width)
+        if 0 < self._max_side < longest_side:
+            # the model works at ~256px, a smaller copy saves the conversion and the inference cost
+            scale: float = self._max_side / longest_side
+            small_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+            image = cv2.resize(image, dsize=small_size, interpolation=cv2.INTER_AREA)
+            logger.debug("Segmenting a resized copy {} of the image ({}, {})", small_size, width, height)
+        img_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB) # rgb to mediapipe
+        with self._pool.acquire() as segmenter:
             results = segmenter.process(img_rgb)
             if results.segmentation_mask is None:
                 logger.error("Failed to generate the segmentation mask")
-                return False
-            # create a binary mask where foreground pixels are 255
-            foreground_mask = (results.segmentation_mask > threshold).astype(np.uint8) * 255
-            self._mask_3d = np.repeat(foreground_mask[:, :, np.newaxis], 3, axis=2).astype(np.uint8)
+                return None
+            # the mask is a view on the graph output, so it is consumed before the segmenter goes back to the pool
+            return consume(results.segmentation_mask)
+
+    def predict(self, image: np.ndarray) -> Optional[np.ndarray]:
+        """
+        Runs the segmentation model, on a copy resized to `max_side` if the image is larger.
+
+        Returns:
+            The float32 foreground probabilities at the inference resolution, or None on error.
+        """
+        return self._infer(image, lambda probability: np.array(probability, dtype=np.float32, copy=True))
+
+    @staticmethod
+    def probability_to_mask(probability: np.ndarray, width: int, height: int, threshold: float) -> np.ndarray:
+        """Upsamples the probabilities to (width, height) if needed and thresholds them to 0/255."""
+        if probability.shape[:2] != (height, width):
+            # upsample the probabilities, not the binary mask, to keep the edges smooth
+            probability = cv2.resize(probability, dsize=(width, height), interpolation=cv2.INTER_LINEAR)
+        # create a binary mask where foreground pixels are 255
+        return (probability > threshold).astype(np.uint8) * 255
+
+    def _segment(self, image: np.ndarray, threshold: float) -> Optional[np.ndarray]:
+        height, width = image.shape[:2]
+        return self._infer(image, lambda probability: self.probability_to_mask(probability, width, height, threshold))
+
+    @override
+    def get_foreground(self) -> Optional[np.ndarray]:
+        if self._image_foreground is None and self._mask is not None:
+            self._image_foreground = cv2.copyTo(self._image, self._mask)  # Extract the foreground (people)
+        return self._image_foreground
+
+    @override
+    def get_mask(self) -> Optional[np.ndarray]:
+        return self._mask
+
+    @override
+    def get_mask3d(self) -> Optional[np.ndarray]:
+        if self._mask_3d is None and self._mask is not None:
+            self._mask_3d = cv2.merge((self._mask, self._mask, self._mask))
+        return self._mask_3d
+
 
-            self._image_foreground = np.where(self._mask_3d == 255, image, 0)  # Extract the foreground (people)
-            logger.debug(f"Foreground extracted {self._image_foreground.shape}")
+class MaskForeground(ForegroundInterface):
+    def __init__(self, mask: np.ndarray):
+        """
+        A foreground whose single channel mask (0 or 255) is already known, e.g. taken from
+        a cache by another process. `extract` only checks it matches the image.
+        """
+        self._mask: np.ndarray = mask
+        self._image: Optional[np.ndarray] = None
+        self._image_foreground: Optional[np.ndarray] = None
+        self._mask_3d: Optional[np.ndarray] = None
+
+    @override
+    def extract(self, image: np.ndarray, threshold: float = 0.55) -> bool:
+        if self._mask.shape != image.shape[:2]:
+            logger.error(f"The mask {self._mask.shape} doesn't match the image {image.shape}")
+            return False
+        self._image = image
+        self._image_foreground = None
+        self._mask_3d = None
         return True
 
     @override
     def get_foreground(self) -> Optional[np.ndarray]:
+        if self._image_foreground is None and self._image is not None:
+            self._image_foreground = cv2.copyTo(self._image, self._mask)
         return self._image_foreground
 
+    @override
+    def get_mask(self) -> Optional[np.ndarray]:
+        return self._mask if self._image is not None else None
+
     @override
     def get_mask3d(self) -> Optional[np.ndarray]:
-        return self._mask_3d
\ No newline at end of file
+        if self._mask_3d is None and self._image is not None:
+            self._mask_3d = cv2.merge((self._mask, self._mask, self._mask))
+        return self._mask_3d
@@ -0,0 +1,31 @@
+from typing_extensions import override
+from core.interfaces.image_loader import ImageLoaderInterface
+from common.logger import logger
+import numpy as np
+from typing import Optional
+
+class ImageLoaderFromArray(ImageLoaderInterface):
+    def __init__(self):
+        """Serves an already decoded BGR image (e.g. one in shared memory) without copying it."""
+        self._image: Optional[np.ndarray] = None
+        self._source: Optional[np.ndarray] = None
+
+    @override
+    def set_source(self, source: np.ndarray) -> bool:
+        if not isinstance(source, np.ndarray) or source.ndim != 3 or source.shape[2] != 3:
+            logger.error("Source must be a (height, width, 3) array")
+            return False
+        self._source = source
+        return True
+
+    @override
+    def load(self) -> bool:
+        if self._source is None:
+            logger.warning("The source array is empty")
+            return False
+        self._image = self._source
+        return True
+
+    @override
+    def get_source(self) -> np.ndarray:
+        return self._image
@@ -0,0 +1,79 @@
+from typing import override, Optional
+
+import cv2
+import numpy as np
+
+from core.asset_store import AssetNotFoundError, AssetStore, get_asset_store
+from core.interfaces.image_loader import ImageLoaderInterface
+from common.logger import logger
+
+
+class ImageLoaderFromAsset(ImageLoaderInterface):
+    def __init__(self, store: Optional[AssetStore] = None, max_side: Optional[int] = None):
+        """
+        Serves the decoded image of an asset of the store, memory-mapped read-only.
+
+        Args:
+            store: The asset store. Defaults to the process-wide store.
+            max_side: If set, larger images are served as a resized copy of at most this longest side.
+        """
+        self._store: AssetStore = store if store is not None else get_asset_store()
+        self._max_side: Optional[int] = max_side or None
+        self._asset_id: Optional[str] = None
+        self._image: Optional[np.ndarray] = None
+        self._resized: bool = False
+
+    @override
+    def set_source(self, source: str) -> bool:
+        if not isinstance(source, str) or not self._store.contains(source):
+            logger.error(f"Unknown asset {source!r}")
+            return False
+        self._asset_id = source
+        self._image = None
+        self._resized = False
+        return True
+
+    @override
+    def load(self) -> bool:
+        if self._asset_id is None:
+            logger.warning("No asset provided")
+            return False
+        if self._image is not None:
+            return True
+        try:
+            image = self._store.open_image(self._asset_id)
+        except AssetNotFoundError:
+            logger.error(f"Asset {self._asset_id} is no longer stored")
+            return False
+        height, width = image.shape[:2]
+        if self._max_side is not None and max(width, height) > self._max_side:
+            scale = self._max_side / max(width, height)
+            size = (max(1, round(width * scale)), max(1, round(height * scale)))
+            image = cv2.resize(image, dsize=size, interpolation=cv2.INTER_AREA)
+            self._resized = True
+        self._image = image
+        logger.debug("Asset {} loaded with dimensions {}", self._asset_id, image.shape)
+        return True
+
+    @property
+    def asset_id(self) -> Optional[str]:
+        return self._asset_id
+
+    @property
+    def resized(self) -> bool:
+        """Whether the served image is a resized copy rather than the stored one."""
+        return self._resized
+
+    def get_mask(self, mask_name: str) -> Optional[np.ndarray]:
+        """The stored mask `mask_name` of the asset at the size of the served image, None if not stored."""
+        if self._image is None:
+            return None
+        mask = self._store.open_mask(self._asset_id, mask_name)
+        if mask is not None and mask.shape != self._image.shape[:2]:
+            mask = cv2.resize(mask, dsize=(self._image.shape[1], self._image.shape[0]),
+                              interpolation=cv2.INTER_NEAREST)
+        return mask
+
+    @override
+    def get_source(self) -> np.ndarray:
+        return self._image
@@ -1,31 +1,154 @@
-from typing import override, Optional
+from typing import override, Optional, Tuple
+import io
+import os
+import re
 
 import cv2
+from PIL import Image, UnidentifiedImageError
 
 from core.interfaces.image_loader import ImageLoaderInterface
 from common.logger import logger
+from common.metrics import IMAGE_PIXELS, stage
 import numpy as np
 
+# decoder scale factors, JPEG decodes them directly from the DCT coefficients
+_REDUCED_FLAGS: Tuple[Tuple[int, int], ...] = ((8, cv2.IMREAD_REDUCED_COLOR_8),
+                                                (4, cv2.IMREAD_REDUCED_COLOR_4),
+                                                (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+# the formats OpenCV decodes and Pillow doesn't identify, their size is read from the header
+_RADIANCE_MAGIC: Tuple[bytes, ...] = (b"#?RADIANCE", b"#?RGBE")
+_RADIANCE_RESOLUTION = re.compile(rb"^([-+])([XY]) (\d+) ([-+])([XY]) (\d+)$")
+_PFM_HEADER = re.compile(rb"^P[Ff]\s+(\d+)\s+(\d+)\s")
+# bound of the header lines scanned, the pixels follow them
+_MAX_HEADER_BYTES: int = 64 * 1024
+
+
+class ImageTooLargeError(ValueError):
+    """The image header announces more pixels than allowed."""
+
+
 class ImageLoaderFromBuffer(ImageLoaderInterface):
-    def __init__(self):
+    def __init__(self, max_side: Optional[int] = None, max_pixels: Optional[int] = None):
+        """
+        Decodes an encoded image held in memory.
+
+        Args:
+            max_side: If set, the image is decoded so that its longest side is at most
+                      `max_side`, using the reduced-resolution modes of the decoder first.
+            max_pixels: Pixel count above which the image is rejected from its header,
+                        before decoding. None reads $MAX_IMAGE_PIXELS, 0 disables the limit.
+        """
         self._buffer: Optional[bytes] = None
         self._image: Optional[np.ndarray] = None
+        self._original_size: Optional[Tuple[int, int]] = None
+        self._max_side: Optional[int] = max_side or None
+        self._max_pixels: int = max_pixels if max_pixels is not None else int(
+            os.getenv("MAX_IMAGE_PIXELS", "50000000"))
+
+    @staticmethod
+    def probe(buffer: bytes) -> Tuple[int, int]:
+        """
+        Reads the (width, height) from the image header without decoding the pixels.
+
+        Raises:
+            ImageTooLargeError: If Pillow flags the image as a decompression bomb.
+            ValueError: If neither Pillow nor the Radiance HDR and PFM readers recognize the format.
+        """
+        try:
+            with Image.open(io.BytesIO(buffer)) as image:
+                return image.size
+        except Image.DecompressionBombError as exc:
+            raise ImageTooLargeError(str(exc)) from exc
+        except (UnidentifiedImageError, OSError) as exc:
+            size = ImageLoaderFromBuffer._probe_opencv_only(buffer)
+            if size is None:
+                raise ValueError(f"Unreadable image header: {exc}") from exc
+            return size
+
+    @staticmethod
+    def _probe_opencv_only(buffer: bytes) -> Optional[Tuple[int, int]]:
+        # the (width, height) of the Radiance HDR and PFM images, None for the other formats
+        header = buffer[:_MAX_HEADER_BYTES]
+        if header.startswith(_RADIANCE_MAGIC):
+            # the variables end with an empty line, followed by the resolution, e.g. "-Y 480 +X 640"
+            lines = header.split(b"\n")
+            for index, line in enumerate(lines[:-1]):
+                if not line.strip():
+                    match = _RADIANCE_RESOLUTION.match(lines[index + 1].strip())
+                    if match is None or match.group(2) == match.group(5):
+                        return None
+                    sizes = {match.group(2): int(match.group(3)), match.group(5): int(match.group(6))}
+                    return sizes[b"X"], sizes[b"Y"]
+            return None
+        match = _PFM_HEADER.match(header)
+        if match is not None:
+            return int(match.group(1)), int(match.group(2))
+        return None
+
+    def get_original_size(self) -> Optional[Tuple[int, int]]:
+        """The (width, height) of the encoded image, known after `load`."""
+        return self._original_size
+
+    def _check_pixels(self, width: int, height: int) -> None:
+        if self._max_pixels and width * height > self._max_pixels:
+            logger.warning(f"Image of {width}x{height} rejected, the limit is {self._max_pixels} pixels")
+            raise ImageTooLargeError(f"Image of {width}x{height} exceeds {self._max_pixels} pixels")
+
+    def _decode(self, image_np: np.ndarray, width: int, height: int) -> Optional[np.ndarray]:
+        if self._max_side is None or max(width, height) <= self._max_side:
+            return cv2.imdecode(image_np, cv2.IMREAD_COLOR)
+        # the largest reduction that keeps at least max_side pixels, the rest is resized
+        flag = cv2.IMREAD_COLOR
+        for factor, reduced_flag in _REDUCED_FLAGS:
+            if max(width, height) // factor >= self._max_side:
+                flag = reduced_flag
+                break
+        return self._fit(cv2.imdecode(image_np, flag))
+
+    def _fit(self, image: Optional[np.ndarray]) -> Optional[np.ndarray]:
+        if image is None or self._max_side is None:
+            return image
+        scale = self._max_side / max(image.shape[:2])
+        if scale < 1.0:
+            size = (max(1, round(image.shape[1] * scale)), max(1, round(image.shape[0] * scale)))
+            image = cv2.resize(image, dsize=size, interpolation=cv2.INTER_AREA)
+        return image
 
     @override
     def load(self) -> bool:
+        """
+        Raises:
+            ImageTooLargeError: If the image exceeds the pixel limit, checked from the header
+                                before decoding.
+        """
         if self._buffer is None:
             logger.warning("No buffer provided")
             return False
+        if self._image is not None:
+            # the buffer was already decoded, loading again is a no-op
+            return True
+        try:
+            width, height = self.probe(self._buffer)
+        except ImageTooLargeError:
+            raise
+        except ValueError as exc:
+            # a format without a known header could be of any size, it isn't decoded
+            logger.debug("Image format not recognized: {}", exc)
+            return False
+        self._original_size = (width, height)
+        self._check_pixels(width, height)
         try:
-            image_np = np.frombuffer(self._buffer, np.uint8)
-            self._image = cv2.imdecode(image_np, cv2.IMREAD_COLOR)
+            with stage("decode"):
+                self._image = self._decode(np.frombuffer(self._buffer, np.uint8), width, height)
             if self._image is None:
                 logger.error("Failed to decode image from buffer")
                 raise ValueError("Image decoding failed")
-            logger.debug(f"Image loaded from buffer with dimensions {self._image.shape}")
+            IMAGE_PIXELS.observe(width * height)
+            logger.debug("Image loaded from buffer with dimensions {}", self._image.shape)
             return True
         except Exception as exc:
-            logger.debug(f"Error loading image from buffer: {exc}")
+            logger.debug("Error loading image from buffer: {}", exc)
             return False
 
     @override
@@ -34,9 +157,11 @@ class ImageLoaderFromBuffer(ImageLoaderInterface):
             logger.error("Source must be bytes")
             return False
         self._buffer = source
+        self._image = None
+        self._original_size = None
         logger.debug("Buffer source set")
         return True
 
     @override
     def get_source(self) -> np.ndarray:
-        return self._image
\ No newline at end of file
+        return self._image
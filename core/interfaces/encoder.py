@@ -0,0 +1,17 @@
+from abc import ABC, abstractmethod
+from numpy import ndarray
+
+class EncoderInterface(ABC):
+    @property
+    @abstractmethod
+    def media_type(self) -> str:
+        raise NotImplementedError
+
+    @property
+    @abstractmethod
+    def extension(self) -> str:
+        raise NotImplementedError
+
+    @abstractmethod
+    def encode(self, image: ndarray) -> ndarray:
+        raise NotImplementedError
@@ -11,6 +11,10 @@ class ForegroundInterface(ABC):
     def get_foreground(self) -> Optional[ndarray]:
         raise NotImplemented
 
+    @abstractmethod
+    def get_mask(self) -> Optional[ndarray]:
+        raise NotImplemented
+
     @abstractmethod
     def get_mask3d(self) -> Optional[ndarray]:
         raise NotImplemented
\ No newline at end of file
@@ -0,0 +1,17 @@
+from abc import ABC, abstractmethod
+from numpy import ndarray
+from typing import NamedTuple, Optional
+
+class SegmentationResult(NamedTuple):
+    # float32 foreground probabilities in [0, 1], at the resolution of the model
+    segmentation_mask: Optional[ndarray]
+
+class SegmenterInterface(ABC):
+    """A segmentation model instance, used by one thread at a time (see SegmenterPool)."""
+    @abstractmethod
+    def process(self, image: ndarray) -> SegmentationResult:
+        raise NotImplementedError
+
+    @abstractmethod
+    def close(self) -> None:
+        raise NotImplementedError
@@ -0,0 +1,84 @@
+import hashlib
+import os
+import threading
+from typing import Any, Optional, Tuple
+
+import numpy as np
+
+from common.logger import logger
+from common.lru import ByteLRUCache, CacheStats
+
+
+class MaskCache:
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, packed: bool = True):
+        """
+        LRU cache of single channel foreground masks (0 or 255), bounded by the bytes it stores.
+
+        Args:
+            max_bytes: Memory budget for the stored masks. Zero disables the cache.
+            packed: Store the masks as 1 bit per pixel instead of 1 byte per pixel.
+        """
+        self._lru: ByteLRUCache = ByteLRUCache(max_bytes)
+        self._packed: bool = packed
+
+    @staticmethod
+    def make_key(image: np.ndarray, *settings: Any) -> str:
+        """
+        Builds a content address from the decoded pixels and the segmentation settings
+        (threshold, model, ...), so the same photo uploaded twice shares its mask.
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(repr((image.shape, image.dtype.str, settings)).encode())
+        digest.update(memoryview(np.ascontiguousarray(image)).cast("B"))
+        return digest.hexdigest()
+
+    @property
+    def enabled(self) -> bool:
+        return self._lru.enabled
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """Returns the cached mask as a read-only (height, width) uint8 array, or None."""
+        entry: Optional[Tuple[np.ndarray, Tuple[int, int]]] = self._lru.get(key)
+        if entry is None:
+            return None
+        data, shape = entry
+        if not self._packed:
+            return data
+        mask = np.unpackbits(data, count=shape[0] * shape[1]).reshape(shape)
+        mask *= 255
+        return mask
+
+    def put(self, key: str, mask: np.ndarray) -> None:
+        if not self.enabled:
+            return
+        if mask.ndim != 2:
+            raise ValueError(f"Only single channel masks can be cached, got shape {mask.shape}")
+        if self._packed:
+            data = np.packbits(mask > 0)
+        else:
+            data = np.array(mask, dtype=np.uint8, copy=True)
+        data.flags.writeable = False
+        if not self._lru.put(key, (data, (mask.shape[0], mask.shape[1])), data.nbytes):
+            logger.debug("Mask of {} bytes exceeds the cache budget, not cached", data.nbytes)
+
+    def clear(self) -> None:
+        self._lru.clear()
+
+    def stats(self) -> CacheStats:
+        return self._lru.stats()
+
+
+_cache: Optional[MaskCache] = None
+_cache_lock: threading.Lock = threading.Lock()
+
+
+def get_mask_cache() -> MaskCache:
+    """Returns the process-wide cache configured by $MASK_CACHE_MAX_BYTES and $MASK_CACHE_PACKED."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            max_bytes: int = int(os.getenv("MASK_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+            packed: bool = os.getenv("MASK_CACHE_PACKED", "1").lower() in ("1", "true", "yes")
+            _cache = MaskCache(max_bytes=max_bytes, packed=packed)
+            logger.info(f"Mask cache created: {max_bytes} bytes, packed={packed}")
+        return _cache
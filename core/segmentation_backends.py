@@ -0,0 +1,298 @@
+import importlib.util
+import os
+from abc import abstractmethod
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from common.logger import logger
+from core.interfaces.segmenter import SegmentationResult, SegmenterInterface
+
+# per-channel mean and standard deviation applied to the RGB pixels scaled to [0, 1]
+NORMALIZATIONS: Dict[str, Tuple[Tuple[float, float, float], Tuple[float, float, float]]] = {
+    "unit": ((0.0, 0.0, 0.0), (1.0, 1.0, 1.0)),
+    "symmetric": ((0.5, 0.5, 0.5), (0.5, 0.5, 0.5)),
+    "imagenet": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225)),
+}
+
+# model file extensions and the backend loading them when none is given
+_EXTENSIONS: Dict[str, str] = {".onnx": "onnx", ".tflite": "opencv", ".pb": "opencv"}
+# model file extensions and the OpenCV DNN framework reading them from memory
+_FRAMEWORKS: Dict[str, str] = {".onnx": "onnx", ".tflite": "tflite", ".pb": "tensorflow"}
+# mediapipe model selection -> its model file, in the mediapipe package
+_MEDIAPIPE_MODELS: Dict[int, str] = {0: "selfie_segmentation.tflite", 1: "selfie_segmentation_landscape.tflite"}
+
+# model files read ahead by preload_model, by path
+_model_bytes: Dict[str, bytes] = {}
+
+
+@dataclass(frozen=True)
+class SegmentationModel:
+    """
+    A segmentation model and how to run it. `backend` is one of the registered backends;
+    the file-based ones take a `path` and the pre/post-processing settings.
+
+    Attributes:
+        input_size: (width, height) of the model input, None to read it from the model.
+        normalization: Key of NORMALIZATIONS applied to the RGB input.
+        foreground_class: Output channel of the foreground when the model outputs several classes.
+        sigmoid: Applies a sigmoid to a single channel output, for models returning logits.
+        threads: Intra-op threads of one inference, 0 lets the runtime decide.
+    """
+    backend: str = "mediapipe"
+    path: Optional[str] = None
+    model_selection: int = 1
+    input_size: Optional[Tuple[int, int]] = None
+    normalization: str = "unit"
+    foreground_class: int = 1
+    sigmoid: bool = False
+    threads: int = 1
+
+    @property
+    def model_id(self) -> str:
+        """Identifies the model in the mask cache keys."""
+        if self.backend == "mediapipe":
+            return f"mediapipe:{self.model_selection}"
+        return (f"{self.backend}:{self.path}:{self.input_size}:{self.normalization}:{self.foreground_class}"
+                f"{':sigmoid' if self.sigmoid else ''}")
+
+    @staticmethod
+    def parse(spec: str, **settings: Any) -> "SegmentationModel":
+        """
+        Parses "mediapipe", "mediapipe:<model selection>", "<path>" or "<backend>:<path>".
+        The backend of a bare path comes from its extension: .onnx runs with onnxruntime
+        when installed, OpenCV DNN otherwise; .tflite and .pb run with OpenCV DNN.
+
+        Raises:
+            ValueError: If the spec names an unknown backend or an unsupported file.
+        """
+        spec = spec.strip() or "mediapipe"
+        backend, separator, rest = spec.partition(":")
+        if backend == "mediapipe":
+            return SegmentationModel(backend="mediapipe", model_selection=int(rest) if separator else 1, **settings)
+        if separator and backend in _BACKENDS:
+            return SegmentationModel(backend=backend, path=rest, **settings)
+        extension = Path(spec).suffix.lower()
+        backend = _EXTENSIONS.get(extension)
+        if backend is None:
+            raise ValueError(f"Unsupported segmentation model '{spec}': expected 'mediapipe' or a "
+                             f"{'/'.join(_EXTENSIONS)} file, optionally prefixed by one of {get_backends()}")
+        if backend == "onnx" and not _has_onnxruntime():
+            backend = "opencv"
+        return SegmentationModel(backend=backend, path=spec, **settings)
+
+    @staticmethod
+    def from_env() -> "SegmentationModel":
+        """
+        The model of $SEGMENTATION_MODEL, run with $SEGMENTATION_THREADS threads; file-based
+        models read $SEGMENTATION_INPUT_SIZE ("256x256"), $SEGMENTATION_NORMALIZATION,
+        $SEGMENTATION_FOREGROUND_CLASS and $SEGMENTATION_SIGMOID.
+        """
+        return SegmentationModel.parse(os.getenv("SEGMENTATION_MODEL", "mediapipe"),
+                                       input_size=parse_input_size(os.getenv("SEGMENTATION_INPUT_SIZE", "")),
+                                       normalization=os.getenv("SEGMENTATION_NORMALIZATION", "unit"),
+                                       foreground_class=int(os.getenv("SEGMENTATION_FOREGROUND_CLASS", "1")),
+                                       sigmoid=os.getenv("SEGMENTATION_SIGMOID", "0").lower() in ("1", "true", "yes"),
+                                       threads=int(os.getenv("SEGMENTATION_THREADS", "1")))
+
+
+def parse_input_size(size: str) -> Optional[Tuple[int, int]]:
+    """Parses "<width>x<height>" or "<side>" as (width, height), None if empty."""
+    if not size.strip():
+        return None
+    width, _, height = size.lower().partition("x")
+    return int(width), int(height or width)
+
+
+def _has_onnxruntime() -> bool:
+    try:
+        import onnxruntime  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def model_files(model: SegmentationModel) -> List[str]:
+    """The files the segmenters of the model read: the model file, or the .tflite of the mediapipe selection."""
+    if model.backend != "mediapipe":
+        return [model.path] if model.path else []
+    spec = importlib.util.find_spec("mediapipe")
+    name = _MEDIAPIPE_MODELS.get(model.model_selection)
+    if spec is None or spec.origin is None or name is None:
+        return []
+    return [str(Path(spec.origin).parent / "modules" / "selfie_segmentation" / name)]
+
+
+def preload_model(model: SegmentationModel) -> int:
+    """
+    Reads the model files once, before the server forks its workers. The file-based
+    backends build their segmenters from these bytes, shared copy-on-write by the
+    workers. mediapipe only loads its .tflite by path from its graph, the read just
+    leaves it in the page cache for the workers.
+
+    Returns:
+        The bytes read.
+    """
+    size = 0
+    for path in model_files(model):
+        try:
+            data = Path(path).read_bytes()
+        except OSError as exc:
+            logger.warning(f"Segmentation model file '{path}' not preloaded: {exc}")
+            continue
+        if model.backend != "mediapipe":
+            _model_bytes[path] = data
+        size += len(data)
+    return size
+
+
+def create_selfie_segmenter(model_selection: int) -> Any:
+    # imported here so that only the first checkout pays for loading mediapipe
+    import mediapipe as mp
+    return mp.solutions.selfie_segmentation.SelfieSegmentation(model_selection=model_selection)
+
+
+class _FileSegmenter(SegmenterInterface):
+    def __init__(self, model: SegmentationModel):
+        """Pre and post-processing shared by the backends running a model file."""
+        if model.normalization not in NORMALIZATIONS:
+            raise ValueError(f"Unknown normalization '{model.normalization}', expected one of {list(NORMALIZATIONS)}")
+        if not model.path or (model.path not in _model_bytes and not Path(model.path).is_file()):
+            raise ValueError(f"Segmentation model file '{model.path}' not found")
+        self._model: SegmentationModel = model
+        mean, std = NORMALIZATIONS[model.normalization]
+        # (x / 255 - mean) / std folded into one multiply-add
+        self._scale: np.ndarray = np.array([1.0 / (255.0 * value) for value in std], dtype=np.float32)
+        self._offset: np.ndarray = np.array([-m / s for m, s in zip(mean, std)], dtype=np.float32)
+        self._input_size: Tuple[int, int] = model.input_size or (256, 256)
+        self._channels_last: bool = False
+        self._quantized_input: Optional[np.dtype] = None
+
+    def _preprocess(self, image: np.ndarray) -> np.ndarray:
+        resized = cv2.resize(image, dsize=self._input_size, interpolation=cv2.INTER_AREA)
+        if self._quantized_input == np.int8:
+            # int8 inputs are the pixels shifted by -128 (zero point -128, scale 1/255):
+            # flipping the high bit maps 0..255 to -128..127 without wrapping
+            blob = (resized ^ np.uint8(0x80)).view(np.int8)
+        elif self._quantized_input is not None:
+            # fully quantized models take the raw pixels
+            blob = resized.astype(self._quantized_input, copy=False)
+        else:
+            blob = resized.astype(np.float32) * self._scale + self._offset
+        if not self._channels_last:
+            blob = blob.transpose(2, 0, 1)
+        return np.ascontiguousarray(blob[np.newaxis])
+
+    def _postprocess(self, output: np.ndarray) -> np.ndarray:
+        output = np.asarray(output, dtype=np.float32)
+        while output.ndim > 3 and output.shape[0] == 1:
+            output = output[0]
+        if output.ndim == 3:
+            # (classes, height, width), or (height, width, classes) for channels-last models
+            if self._channels_last:
+                output = output.transpose(2, 0, 1)
+            if output.shape[0] == 1:
+                output = output[0]
+            else:
+                exp = np.exp(output - output.max(axis=0, keepdims=True))
+                return exp[self._model.foreground_class] / exp.sum(axis=0)
+        if output.ndim != 2:
+            raise ValueError(f"Unexpected segmentation output of shape {output.shape}")
+        if self._model.sigmoid:
+            output = 1.0 / (1.0 + np.exp(-output))
+        return output
+
+    def process(self, image: np.ndarray) -> SegmentationResult:
+        return SegmentationResult(segmentation_mask=self._postprocess(self._infer(self._preprocess(image))))
+
+    @abstractmethod
+    def _infer(self, blob: np.ndarray) -> np.ndarray:
+        """Runs the model on the preprocessed blob, returns its raw output."""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class OnnxSegmenter(_FileSegmenter):
+    def __init__(self, model: SegmentationModel):
+        """
+        Runs an ONNX model with onnxruntime on the CPU. int8 models quantized with
+        onnxruntime (QDQ or QOperator) run as they are; a uint8/int8 input is fed raw pixels.
+        """
+        super().__init__(model)
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = model.threads
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self._session = ort.InferenceSession(_model_bytes.get(model.path, model.path), sess_options=options,
+                                             providers=["CPUExecutionProvider"])
+        model_input = self._session.get_inputs()[0]
+        self._input_name: str = model_input.name
+        shape = model_input.shape
+        if len(shape) == 4:
+            self._channels_last = shape[-1] == 3
+            height, width = (shape[1], shape[2]) if self._channels_last else (shape[2], shape[3])
+            if model.input_size is None and isinstance(height, int) and isinstance(width, int):
+                self._input_size = (width, height)
+        if model_input.type in ("tensor(uint8)", "tensor(int8)"):
+            self._quantized_input = np.dtype(np.uint8 if model_input.type == "tensor(uint8)" else np.int8)
+
+    def _infer(self, blob: np.ndarray) -> np.ndarray:
+        return self._session.run(None, {self._input_name: blob})[0]
+
+
+class OpenCVSegmenter(_FileSegmenter):
+    def __init__(self, model: SegmentationModel):
+        """
+        Runs an ONNX, TFLite or TensorFlow model with OpenCV DNN on the CPU, int8 ONNX
+        models included. OpenCV has a single thread pool: `threads` applies to the whole process.
+        """
+        super().__init__(model)
+        # the default backend and target: OpenCV's own layers on the CPU
+        data = _model_bytes.get(model.path)
+        framework = _FRAMEWORKS.get(Path(model.path).suffix.lower())
+        if data is not None and framework is not None:
+            self._net = cv2.dnn.readNet(framework, np.frombuffer(data, dtype=np.uint8))
+        else:
+            self._net = cv2.dnn.readNet(model.path)
+        if model.threads > 0:
+            cv2.setNumThreads(model.threads)
+
+    def _infer(self, blob: np.ndarray) -> np.ndarray:
+        self._net.setInput(blob)
+        return self._net.forward()
+
+
+# backend name -> builder of the segmenters of a model
+_BACKENDS: Dict[str, Callable[[SegmentationModel], SegmenterInterface]] = {
+    "mediapipe": lambda model: create_selfie_segmenter(model.model_selection),
+    "onnx": OnnxSegmenter,
+    "opencv": OpenCVSegmenter,
+}
+
+
+def register_backend(name: str, builder: Callable[[SegmentationModel], SegmenterInterface]) -> None:
+    """Makes `name:<path>` usable in $SEGMENTATION_MODEL, `builder` creating one segmenter."""
+    _BACKENDS[name] = builder
+
+
+def get_backends() -> List[str]:
+    return list(_BACKENDS)
+
+
+def create_segmenter(model: SegmentationModel) -> SegmenterInterface:
+    """
+    Raises:
+        ValueError: If the backend is unknown or the model can't be loaded.
+    """
+    builder = _BACKENDS.get(model.backend)
+    if builder is None:
+        raise ValueError(f"Unknown segmentation backend '{model.backend}', expected one of {get_backends()}")
+    segmenter = builder(model)
+    logger.debug("Segmenter created: {}", model.model_id)
+    return segmenter
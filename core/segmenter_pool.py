@@ -0,0 +1,198 @@
+import atexit
+import os
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional
+
+from common.logger import logger
+from core.segmentation_backends import SegmentationModel, create_selfie_segmenter, create_segmenter
+
+# put in the idle queue on close, it wakes the threads waiting for a segmenter and is put back for the next ones
+_CLOSED = object()
+
+
+class SegmenterPool:
+    def __init__(self,
+                 size: int = 2,
+                 model_selection: int = 1,
+                 factory: Optional[Callable[[int], Any]] = None,
+                 model_id: Optional[str] = None):
+        """
+        Keeps up to `size` warm SelfieSegmentation graphs alive for the whole process.
+
+        A mediapipe graph is not re-entrant, so every segmenter is checked out by a single
+        thread at a time and returned to the pool afterward. Segmenters are created lazily
+        on checkout until the pool is full; `warm` can be used to create them upfront.
+
+        Args:
+            size: Maximum number of segmenters alive at the same time.
+            model_selection: The mediapipe model (0 = general, 1 = landscape).
+            factory: Callable building a segmenter from the model selection. Defaults to mediapipe.
+            model_id: Identifies the model of the factory in the mask cache keys.
+        """
+        if size < 1:
+            raise ValueError(f"The pool size must be at least 1, got {size}")
+        self._size: int = size
+        self._model_selection: int = model_selection
+        self._factory: Callable[[int], Any] = factory or create_selfie_segmenter
+        self._model_id: str = model_id or f"mediapipe:{model_selection}"
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._created: int = 0
+        self._lock: threading.Lock = threading.Lock()
+        self._closed: bool = False
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def model_selection(self) -> int:
+        return self._model_selection
+
+    @property
+    def model_id(self) -> str:
+        return self._model_id
+
+    @property
+    def created(self) -> int:
+        return self._created
+
+    @property
+    def idle(self) -> int:
+        # a closed pool only holds the _CLOSED marker
+        return 0 if self._closed else self._idle.qsize()
+
+    def warm(self) -> int:
+        """Creates the missing segmenters so the first requests don't pay the graph setup."""
+        warmed: int = 0
+        while True:
+            with self._lock:
+                if self._closed or self._created >= self._size:
+                    break
+                self._created += 1
+            self._idle.put(self._create())
+            warmed += 1
+        logger.info(f"Segmenter pool warmed: {self._created}/{self._size} segmenter(s) alive")
+        return warmed
+
+    @contextmanager
+    def acquire(self, timeout: Optional[float] = None) -> Iterator[Any]:
+        """
+        Checks out a segmenter for the duration of the `with` block.
+
+        Raises:
+            RuntimeError: If the pool has been closed.
+            TimeoutError: If no segmenter became available within `timeout` seconds.
+        """
+        segmenter = self._checkout(timeout)
+        try:
+            yield segmenter
+        finally:
+            self._checkin(segmenter)
+
+    def close(self) -> None:
+        """
+        Closes the idle segmenters; the checked-out ones are closed when returned. The
+        threads waiting for a segmenter get a RuntimeError.
+        """
+        with self._lock:
+            self._closed = True
+        closed: int = 0
+        while True:
+            try:
+                segmenter = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if segmenter is not _CLOSED:
+                self._close_segmenter(segmenter)
+                closed += 1
+        self._idle.put(_CLOSED)
+        logger.info(f"Segmenter pool closed ({closed} idle segmenter(s) released)")
+
+    def _create(self) -> Any:
+        try:
+            segmenter = self._factory(self._model_selection)
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+        logger.debug("Segmenter created ({}/{})", self._created, self._size)
+        return segmenter
+
+    def _checkout(self, timeout: Optional[float]) -> Any:
+        if self._closed:
+            raise RuntimeError("The segmenter pool is closed")
+        try:
+            return self._checked(self._idle.get_nowait())
+        except queue.Empty:
+            pass
+        with self._lock:
+            can_create: bool = self._created < self._size
+            if can_create:
+                self._created += 1
+        if can_create:
+            return self._create()
+        try:
+            segmenter = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No segmenter available after {timeout} seconds") from None
+        return self._checked(segmenter)
+
+    def _checked(self, segmenter: Any) -> Any:
+        if segmenter is _CLOSED:
+            self._idle.put(_CLOSED)
+            raise RuntimeError("The segmenter pool is closed")
+        return segmenter
+
+    def _checkin(self, segmenter: Any) -> None:
+        with self._lock:
+            closed: bool = self._closed
+        if closed:
+            self._close_segmenter(segmenter)
+        else:
+            self._idle.put(segmenter)
+
+    def _close_segmenter(self, segmenter: Any) -> None:
+        try:
+            segmenter.close()
+        except Exception as exc:
+            logger.warning(f"Error closing a segmenter: {exc}")
+        with self._lock:
+            self._created -= 1
+
+
+_pool: Optional[SegmenterPool] = None
+_pool_lock: threading.Lock = threading.Lock()
+
+
+def get_segmenter_pool() -> SegmenterPool:
+    """
+    Returns the process-wide pool of the $SEGMENTATION_MODEL segmenters (see
+    SegmentationModel.from_env), sized by $SEGMENTATION_POOL_SIZE on first use.
+
+    Raises:
+        ValueError: If $SEGMENTATION_MODEL isn't a supported model.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            size: int = int(os.getenv("SEGMENTATION_POOL_SIZE", "2"))
+            model = SegmentationModel.from_env()
+            _pool = SegmenterPool(size=size,
+                                  model_selection=model.model_selection,
+                                  factory=lambda _: create_segmenter(model),
+                                  model_id=model.model_id)
+            logger.info(f"Segmenter pool created with size {size}, model {model.model_id}")
+        return _pool
+
+
+def shutdown_segmenter_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+atexit.register(shutdown_segmenter_pool)
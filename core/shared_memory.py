@@ -0,0 +1,198 @@
+import atexit
+import os
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from common.logger import logger
+
+
+@dataclass(frozen=True)
+class SharedArray:
+    """Describes an array stored in a shared memory segment; this is all a worker receives."""
+    name: str
+    shape: Tuple[int, ...]
+    dtype: str
+
+    @property
+    def nbytes(self) -> int:
+        return int(np.prod(self.shape, dtype=np.int64)) * np.dtype(self.dtype).itemsize
+
+    def view(self, buffer: memoryview) -> np.ndarray:
+        return np.ndarray(self.shape, dtype=np.dtype(self.dtype), buffer=buffer)
+
+
+@contextmanager
+def attach(descriptors: Sequence[SharedArray]) -> Iterator[List[np.ndarray]]:
+    """
+    Maps the segments of the descriptors in this process and yields an array on each.
+    The segments stay owned by the process that created them: they are closed here,
+    never unlinked, so a worker dying in the middle doesn't leak them.
+    """
+    segments = [shared_memory.SharedMemory(name=descriptor.name) for descriptor in descriptors]
+    try:
+        yield [descriptor.view(segment.buf) for descriptor, segment in zip(descriptors, segments)]
+    finally:
+        for segment in segments:
+            try:
+                segment.close()
+            except BufferError:
+                # an array on it is still referenced (e.g. by a traceback), it is closed when collected
+                logger.debug("Shared memory segment {} still in use, closed later", segment.name)
+
+
+class SharedLease:
+    def __init__(self, pool: "SharedMemoryPool", segment: shared_memory.SharedMemory, descriptor: SharedArray):
+        """A segment of the pool lent for one array; `release` gives it back."""
+        self._pool: SharedMemoryPool = pool
+        self._segment: Optional[shared_memory.SharedMemory] = segment
+        self.descriptor: SharedArray = descriptor
+        self.array: Optional[np.ndarray] = descriptor.view(segment.buf)
+
+    def release(self) -> None:
+        if self._segment is None:
+            return
+        segment, self._segment = self._segment, None
+        self.array = None
+        self._pool._give_back(segment)
+
+    def __enter__(self) -> "SharedLease":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.release()
+
+
+class SharedMemoryPool:
+    def __init__(self, max_idle_bytes: int = 256 * 1024 * 1024, min_segment_bytes: int = 1024 * 1024):
+        """
+        Shared memory segments reused between requests, so the frames handed to the worker
+        processes aren't pickled and the segments aren't created and mapped every time.
+        Segments are sized by powers of two to be reusable by images of close sizes; the
+        pages beyond the array are never touched and cost nothing.
+
+        The creating process owns the segments: they are unlinked when released beyond the
+        idle budget or when the pool is closed, and the resource tracker of multiprocessing
+        unlinks whatever is left if this process dies.
+
+        Args:
+            max_idle_bytes: Capacity of the idle segments kept for reuse. Zero keeps none.
+            min_segment_bytes: Smallest segment created.
+        """
+        self._max_idle_bytes: int = max_idle_bytes
+        self._min_segment_bytes: int = min_segment_bytes
+        self._idle: Dict[int, List[shared_memory.SharedMemory]] = defaultdict(list)
+        self._idle_bytes: int = 0
+        self._leased: int = 0
+        self._created: int = 0
+        self._reused: int = 0
+        self._closed: bool = False
+        self._lock: threading.Lock = threading.Lock()
+
+    def _capacity(self, nbytes: int) -> int:
+        return max(self._min_segment_bytes, 1 << (max(nbytes, 1) - 1).bit_length())
+
+    def lease(self, shape: Tuple[int, ...], dtype: np.dtype = np.uint8) -> SharedLease:
+        """Lends a segment holding an array of `shape` and `dtype`, uninitialized."""
+        shape = tuple(int(side) for side in shape)
+        dtype_str: str = np.dtype(dtype).str
+        capacity = self._capacity(int(np.prod(shape, dtype=np.int64)) * np.dtype(dtype).itemsize)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("The shared memory pool is closed")
+            segment: Optional[shared_memory.SharedMemory] = None
+            if self._idle[capacity]:
+                segment = self._idle[capacity].pop()
+                self._idle_bytes -= capacity
+                self._reused += 1
+            self._leased += 1
+        if segment is None:
+            try:
+                segment = shared_memory.SharedMemory(create=True, size=capacity)
+            except Exception:
+                with self._lock:
+                    self._leased -= 1
+                raise
+            with self._lock:
+                self._created += 1
+            logger.debug("Shared memory segment {} created, {} bytes", segment.name, capacity)
+        return SharedLease(self, segment, SharedArray(name=segment.name, shape=shape, dtype=dtype_str))
+
+    def _give_back(self, segment: shared_memory.SharedMemory) -> None:
+        with self._lock:
+            self._leased -= 1
+            keep = not self._closed and self._idle_bytes + segment.size <= self._max_idle_bytes
+            if keep:
+                self._idle[segment.size].append(segment)
+                self._idle_bytes += segment.size
+        if not keep:
+            self._unlink(segment)
+
+    @staticmethod
+    def _unlink(segment: shared_memory.SharedMemory) -> None:
+        try:
+            segment.close()
+        except BufferError:
+            pass
+        try:
+            segment.unlink()
+        except FileNotFoundError:
+            pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"leased": self._leased,
+                    "idle": sum(len(segments) for segments in self._idle.values()),
+                    "idle_bytes": self._idle_bytes,
+                    "max_idle_bytes": self._max_idle_bytes,
+                    "created": self._created,
+                    "reused": self._reused}
+
+    def close(self) -> None:
+        """Unlinks the idle segments; the leased ones are unlinked when released."""
+        with self._lock:
+            self._closed = True
+            segments = [segment for idle in self._idle.values() for segment in idle]
+            self._idle.clear()
+            self._idle_bytes = 0
+        for segment in segments:
+            self._unlink(segment)
+
+
+_pool: Optional[SharedMemoryPool] = None
+_pool_lock: threading.Lock = threading.Lock()
+
+
+def get_shared_memory_pool() -> SharedMemoryPool:
+    """Returns the process-wide pool, keeping up to $SHARED_MEMORY_IDLE_BYTES of idle segments."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            max_idle_bytes: int = int(os.getenv("SHARED_MEMORY_IDLE_BYTES", str(256 * 1024 * 1024)))
+            _pool = SharedMemoryPool(max_idle_bytes=max_idle_bytes)
+            try:
+                available = os.statvfs("/dev/shm")
+                if available.f_frsize * available.f_blocks < max_idle_bytes:
+                    # a write beyond the size of /dev/shm kills the process with SIGBUS
+                    logger.warning(f"/dev/shm is smaller than SHARED_MEMORY_IDLE_BYTES ({max_idle_bytes} bytes), "
+                                   f"large images may not fit")
+            except OSError:
+                pass
+            logger.info(f"Shared memory pool created, keeping up to {max_idle_bytes} idle bytes")
+        return _pool
+
+
+def shutdown_shared_memory_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+atexit.register(shutdown_shared_memory_pool)
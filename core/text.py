@@ -1,14 +1,21 @@
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
 import numpy as np
 import cv2
 import os
 from PIL.ImageFont import FreeTypeFont
 
 from common.logger import logger
+from common.metrics import timed
 from common.utils import RGBAColor, Position, Size, tuple_to_size, HorizontalAlignment, VerticalAlignment
 from core.fonts import Fonts
+from core.font_catalog import FontCatalog
+from core.font_registry import FontRegistry, get_font_registry
+from core.text_surface_cache import TextSurfaceCache, get_text_surface_cache
 from typing import Optional, List
 
+# transparent margin around the rasterized text, so ascenders/descenders are never clipped
+TEXT_PADDING = 20
+
 class TextFT:
     def __init__(self, text: str = "Sample",
                  font_size: int = None,
@@ -16,14 +23,16 @@ class TextFT:
                  font_color: RGBAColor = RGBAColor(128, 128, 128),
                  h_align: HorizontalAlignment = HorizontalAlignment.CENTER,
                  v_align: VerticalAlignment = VerticalAlignment.CENTER):
+        self._font_registry: FontRegistry = get_font_registry()
         try:
-            self._font_engine = Fonts()
+            self._font_engine: Fonts = self._font_registry.get_fonts()
+            self._catalog: FontCatalog = self._font_registry.get_catalog()
         except Exception as exc:
             logger.error(f"The fonts raised exception in class TextFT: {exc}")
             raise ValueError("Not possible to create the object font engine") from exc
         self._text: str = text
         self._font_size: int = font_size if font_size else int(os.environ.get("DEFAULT_FONT_SIZE", "100"))
-        logger.debug(f"Initializing TextFT with font size: {self._font_size}")
+        logger.debug("Initializing TextFT with font size: {}", self._font_size)
         self._current_font: Optional[FreeTypeFont] = self._load_font(None)
         if self._current_font is None:
             logger.error("Not possible to load a font")
@@ -32,6 +41,7 @@ class TextFT:
         self._font_color: RGBAColor = font_color
         self._h_align: HorizontalAlignment = h_align
         self._v_align: VerticalAlignment = v_align
+        self._surface_cache: TextSurfaceCache = get_text_surface_cache()
 
     def _load_font(self, font_name: Optional[str]) -> Optional[FreeTypeFont]:
         """
@@ -76,8 +86,8 @@ class TextFT:
     def _load_true_font(self, font_name: str, font_path: str) -> Optional[FreeTypeFont]:
         font_loaded: Optional[FreeTypeFont]
         try:
-            font_loaded = ImageFont.truetype(font_path, self._font_size)
-            logger.debug(f"Font {font_loaded.getname()} loaded correctly")
+            font_loaded = self._font_registry.get_font_handle(font_path, self._font_size)
+            logger.debug("Font {} loaded correctly", font_loaded.getname())
         except IOError as io_exc:
             logger.error(f"IOError loading font file '{font_path}': {io_exc}. The font couldn't be changed.")
             raise RuntimeError(f"Not possible to load the font {font_name}") from io_exc
@@ -96,7 +106,7 @@ class TextFT:
         return self._position
 
     def is_position_zero(self) -> bool:
-        logger.debug(f"Checking if position is zero: ({self._position.x}, {self._position.y})")
+        logger.debug("Checking if position is zero: ({}, {})", self._position.x, self._position.y)
         return self._position.x == 0 and self._position.y == 0
 
     @property
@@ -137,7 +147,7 @@ class TextFT:
 
     @h_align.setter
     def h_align(self, value: HorizontalAlignment):
-        logger.debug(f"Setting h_align to {value.value}")
+        logger.debug("Setting h_align to {}", value.value)
         self._h_align = value
 
     @property
@@ -149,7 +159,7 @@ class TextFT:
         self._v_align = value
 
     def set_position(self, position: Position):
-        logger.debug(f"Setting text position to ({position.x}, {position.y})")
+        logger.debug("Setting text position to ({}, {})", position.x, position.y)
         self._position = position
 
     def get_text_size(self) -> Size:
@@ -157,8 +167,59 @@ class TextFT:
         if not self._current_font:
             logger.error("There are not font loaded, not possible to calculate size")
             return Size()
+        return self._measure(self._current_font)
+
+    def _runs(self, font: FreeTypeFont) -> List[tuple[str, FreeTypeFont]]:
+        """
+        The text split in runs of the same font at the size of `font`: `font` itself where
+        it has the glyphs, a fallback font of the catalog where it doesn't.
+        """
+        runs: List[tuple[str, FreeTypeFont]] = []
+        for run, font_path in self._catalog.split_runs(self._text, font.path):
+            run_font = font
+            if font_path != font.path:
+                try:
+                    run_font = self._font_registry.get_font_handle(font_path, font.size)
+                except OSError as exc:
+                    # e.g. a bitmap-only font without a strike of that size
+                    logger.warning(f"Fallback font '{font_path}' can't be loaded at size {font.size}: {exc}")
+            if runs and runs[-1][1] is run_font:
+                runs[-1] = (runs[-1][0] + run, run_font)
+            else:
+                runs.append((run, run_font))
+        return runs
+
+    @staticmethod
+    def _layout(runs: List[tuple[str, FreeTypeFont]]) -> tuple[tuple[int, int, int, int], List[int]]:
+        """
+        Places the runs one after the other on a common baseline.
+
+        Returns:
+            The bounding box of the whole text relative to the origin of the first run on
+            the baseline, and the x offset of every run.
+        """
+        left, top, right, bottom = 0, 0, 0, 0
+        offsets: List[int] = []
+        x = 0.0
+        for index, (run, font) in enumerate(runs):
+            bbox = font.getbbox(run, anchor='ls')
+            offset = round(x)
+            if index == 0:
+                left, top, right, bottom = offset + bbox[0], bbox[1], offset + bbox[2], bbox[3]
+            else:
+                left, top = min(left, offset + bbox[0]), min(top, bbox[1])
+                right, bottom = max(right, offset + bbox[2]), max(bottom, bbox[3])
+            offsets.append(offset)
+            x += font.getlength(run)
+        return (left, top, right, bottom), offsets
+
+    def _measure(self, font: FreeTypeFont) -> Size:
         try:
-            bbox = self._current_font.getbbox(self._text)
+            runs = self._runs(font)
+            if len(runs) > 1 or runs[0][1] is not font:
+                bbox, _ = self._layout(runs)
+            else:
+                bbox = font.getbbox(self._text)
             text_width = int(bbox[2] - bbox[0])
             text_height = int(bbox[3] - bbox[1])
             return Size(text_width, text_height)
@@ -166,66 +227,7 @@ class TextFT:
             logger.error(f"Error computing the text size: {exc}")
             return Size()
 
-    def compute_auto_position(self, background_image: np.ndarray, mask_3d: Optional[np.ndarray] = None):
-        if not isinstance(background_image, np.ndarray):
-            logger.warning("Not possible to compute auto position due to the background image")
-            return
-
-        # shape[:2] gives (height, width), so swap to (width, height)
-        dim_image: Size = tuple_to_size((background_image.shape[1], background_image.shape[0]))
-        logger.debug(f"Image dimensions: ({dim_image.x}, {dim_image.y})")
-
-        dim_text = self.get_text_size()
-        logger.debug(f"Initial text size: ({dim_text.x}, {dim_text.y}), font size: {self._font_size}, alignment: {self._h_align.value}-{self._v_align.value}")
-
-        # Reduce font size until text fits within bounds after positioning
-        min_font_size = 20
-        max_attempts = 10
-        attempt = 0
-
-        while attempt < max_attempts and self._font_size > min_font_size:
-            dim_text = self.get_text_size()
-            if dim_text.x <= 0 or dim_text.y <= 0:
-                logger.error("Text size is invalid")
-                self._position = Position(0, 0)
-                return
-
-            # Calculate tentative position based on alignment
-            if self._h_align == HorizontalAlignment.LEFT:
-                pos_x = 0
-            elif self._h_align == HorizontalAlignment.RIGHT:
-                pos_x = dim_image.x - dim_text.x
-            else:  # CENTER
-                pos_x = (dim_image.x - dim_text.x) // 2
-
-            if self._v_align == VerticalAlignment.UP:
-                pos_y = 0
-            elif self._v_align == VerticalAlignment.BOTTOM:
-                pos_y = dim_image.y - dim_text.y
-            else:  # CENTER
-                pos_y = (dim_image.y - dim_text.y) // 2
-
-            # Check if text fits within image bounds
-            fits_bounds = (pos_x >= 0 and pos_y >= 0 and
-                           pos_x + dim_text.x <= dim_image.x and
-                           pos_y + dim_text.y <= dim_image.y)
-            logger.debug(f"Attempt {attempt}: Position ({pos_x}, {pos_y}), Text size ({dim_text.x}, {dim_text.y}), Fits bounds: {fits_bounds}")
-
-            if fits_bounds:
-                break
-
-            # Reduce font size if text doesn't fit
-            self._font_size = max(min_font_size, self._font_size // 2)
-            self._current_font = self._load_font(self._current_font.getname()[0])
-            attempt += 1
-            logger.debug(f"Font size adjustment attempt {attempt}: size={self._font_size}, text size ({dim_text.x}, {dim_text.y})")
-
-        if dim_text.x <= 0 or dim_text.y <= 0:
-            logger.error("Text size is invalid after adjustment")
-            self._position = Position(0, 0)
-            return
-
-        # Recalculate position with final text size
+    def _aligned_position(self, dim_image: Size, dim_text: Size) -> Position:
         if self._h_align == HorizontalAlignment.LEFT:
             pos_x = 0
         elif self._h_align == HorizontalAlignment.RIGHT:
@@ -239,71 +241,224 @@ class TextFT:
             pos_y = dim_image.y - dim_text.y
         else:  # CENTER
             pos_y = (dim_image.y - dim_text.y) // 2
+        return Position(pos_x, pos_y)
+
+    def _fit_font_size(self, dim_image: Size, dim_text: Size, min_font_size: int) -> tuple[int, Size]:
+        """
+        Finds the largest font size, not above the current one, whose text fits in the image.
+
+        The text extents grow about linearly with the font size, so the first guess scales the
+        current size by the overflow ratio; a bisection over the cached font handles corrects
+        the hinting/rounding error around it. Falls back to `min_font_size` if nothing fits.
+
+        Returns:
+            The font size and the text size measured with it.
+        """
+        def fits(size: Size) -> bool:
+            return 0 < size.x <= dim_image.x and 0 < size.y <= dim_image.y
+
+        def measure(font_size: int) -> Size:
+            return self._measure(self._font_registry.get_font_handle(self._current_font.path, font_size))
+
+        if fits(dim_text) or self._font_size <= min_font_size:
+            return self._font_size, dim_text
 
+        # sizes in [low, high] are still undecided, `best` is the largest one known to fit
+        low, high = min_font_size, self._font_size - 1
+        best: Optional[tuple[int, Size]] = None
+        scale = min(dim_image.x / dim_text.x, dim_image.y / dim_text.y)
+        probe = max(low, min(high, int(self._font_size * scale)))
+        attempt = 0
+        while low <= high:
+            attempt += 1
+            probe_size = measure(probe)
+            fitted = fits(probe_size)
+            logger.debug("Auto-fit attempt {}: font size {}, text size ({}, {}), fits: {}",
+                         attempt, probe, probe_size.x, probe_size.y, fitted)
+            if fitted:
+                best = probe, probe_size
+                low = probe + 1
+            else:
+                high = probe - 1
+            if attempt == 1:
+                # the estimate is usually right, so its neighbour settles the search
+                probe = probe + 1 if fitted else probe - 1
+            else:
+                probe = (low + high) // 2
+            probe = max(low, min(high, probe))
+
+        if best is None:
+            # not even the minimum size fits, keep it and let the position be clamped
+            return min_font_size, measure(min_font_size)
+        return best
+
+    @timed("autofit")
+    def compute_auto_position(self, background_image: np.ndarray, mask_3d: Optional[np.ndarray] = None) -> Optional[tuple[Size, Position]]:
+        """
+        Shrinks the font to the largest size that fits the image and aligns the text.
+
+        Returns:
+            The final text size and position, or None if they couldn't be computed.
+        """
+        if not isinstance(background_image, np.ndarray):
+            logger.warning("Not possible to compute auto position due to the background image")
+            return None
+
+        # shape[:2] gives (height, width), so swap to (width, height)
+        dim_image: Size = tuple_to_size((background_image.shape[1], background_image.shape[0]))
+        logger.debug("Image dimensions: ({}, {})", dim_image.x, dim_image.y)
+
+        dim_text = self.get_text_size()
+        logger.debug("Initial text size: ({}, {}), font size: {}, alignment: {}-{}",
+                     dim_text.x, dim_text.y, self._font_size, self._h_align.value, self._v_align.value)
+        if dim_text.x <= 0 or dim_text.y <= 0:
+            logger.error("Text size is invalid")
+            self._position = Position(0, 0)
+            return None
+
+        min_font_size = 20
+        font_size, dim_text = self._fit_font_size(dim_image, dim_text, min_font_size)
+        if font_size != self._font_size:
+            self._font_size = font_size
+            self._current_font = self._font_registry.get_font_handle(self._current_font.path, font_size)
+
+        if dim_text.x <= 0 or dim_text.y <= 0:
+            logger.error("Text size is invalid after adjustment")
+            self._position = Position(0, 0)
+            return None
+
+        position = self._aligned_position(dim_image, dim_text)
         # Clamp position to ensure text stays within bounds
-        pos_x = max(0, min(pos_x, dim_image.x - dim_text.x))
-        pos_y = max(0, min(pos_y, dim_image.y - dim_text.y))
+        pos_x = max(0, min(position.x, dim_image.x - dim_text.x))
+        pos_y = max(0, min(position.y, dim_image.y - dim_text.y))
 
         self._position = Position(pos_x, pos_y)
-        logger.debug(f"Auto-positioned text at ({pos_x}, {pos_y}) with alignment {self._h_align.value}-{self._v_align.value}, text size ({dim_text.x}, {dim_text.y})")
+        logger.debug("Auto-positioned text at ({}, {}) with alignment {}-{}, text size ({}, {}), font size {}",
+                     pos_x, pos_y, self._h_align.value, self._v_align.value, dim_text.x, dim_text.y, self._font_size)
+        return dim_text, self._position
 
-    def render(self, background_image: np.ndarray) -> Optional[np.ndarray]:
-        try:
-            # Ensure input is valid BGR numpy array
-            if not isinstance(background_image, np.ndarray) or background_image.ndim != 3:
-                logger.error("Render: Invalid background image input.")
-                return None
+    def _rasterize(self) -> Optional[tuple[np.ndarray, int, int]]:
+        """
+        Draws the text on a transparent, padded surface. Surfaces are shared through the
+        process-wide cache, keyed by text, font file, size, color and anchor.
 
-            # Convert to RGBA for text rendering
-            image_pil = Image.fromarray(cv2.cvtColor(background_image, cv2.COLOR_BGR2RGBA))
-            if image_pil.mode != 'RGBA':
-                image_pil = image_pil.convert('RGBA')
+        Returns:
+            The RGBA surface as a numpy array plus the text width and height, or None on error.
+        """
+        # Ensure font is loaded
+        if not self._current_font:
+            logger.error("Render: Font not loaded.")
+            return None
 
-            # Ensure font is loaded
-            if not self._current_font:
-                logger.error("Render: Font not loaded.")
-                return None
+        cache_key = (self._text, self._current_font.path, self._current_font.size,
+                     self._font_color.to_tuple(), 'lt')
+        cached = self._surface_cache.get(cache_key)
+        if cached is not None:
+            return cached
 
-            try:
+        try:
+            # the characters the font lacks are drawn with fallback fonts, on the same baseline
+            runs = self._runs(self._current_font)
+            fallback = len(runs) > 1 or runs[0][1] is not self._current_font
+            if fallback:
+                bbox, offsets = self._layout(runs)
+            else:
                 # Get text bounding box with anchor='lt' for top-left positioning
                 bbox = self._current_font.getbbox(self._text, anchor='lt')
-                logger.debug(f"Font getbbox: {bbox}")
-                text_width = bbox[2] - bbox[0]
-                text_height = bbox[3] - bbox[1]
-                if text_width <= 0 or text_height <= 0:
-                    logger.error(f"Invalid text dimensions: width={text_width}, height={text_height}")
-                    return None
-            except Exception as e:
-                logger.error(f"Render: Error calculating text size: {e}")
+            logger.debug("Font getbbox: {}", bbox)
+            text_width = bbox[2] - bbox[0]
+            text_height = bbox[3] - bbox[1]
+            if text_width <= 0 or text_height <= 0:
+                logger.error(f"Invalid text dimensions: width={text_width}, height={text_height}")
                 return None
+        except Exception as e:
+            logger.error(f"Render: Error calculating text size: {e}")
+            return None
 
-            # Add padding to prevent clipping of ascenders/descenders
-            padding = 20
-            surface_width = text_width + 2 * padding
-            surface_height = text_height + 2 * padding
-            text_surface = Image.new(mode='RGBA', size=(surface_width, surface_height), color=(0, 0, 0, 0))
-            text_draw = ImageDraw.Draw(text_surface)
-
-            # Draw text at (padding, padding) to center it in the padded surface
-            text_draw.text((padding, padding), self._text, font=self._current_font, fill=self._font_color.to_tuple(), anchor='lt')
-            logger.debug(f"Text drawn on surface with color: {self._font_color.to_tuple()}")
+        # Add padding to prevent clipping of ascenders/descenders
+        padding = TEXT_PADDING
+        surface_width = text_width + 2 * padding
+        surface_height = text_height + 2 * padding
+        text_surface = Image.new(mode='RGBA', size=(surface_width, surface_height), color=(0, 0, 0, 0))
+        text_draw = ImageDraw.Draw(text_surface)
+
+        # Draw text so its bounding box starts at (padding, padding) in the padded surface
+        if fallback:
+            for (run, font), offset in zip(runs, offsets):
+                # color fonts (emoji) keep their own colors
+                text_draw.text((padding - bbox[0] + offset, padding - bbox[1]), run, font=font,
+                               fill=self._font_color.to_tuple(), anchor='ls', embedded_color=True)
+        else:
+            text_draw.text((padding - bbox[0], padding - bbox[1]), self._text, font=self._current_font, fill=self._font_color.to_tuple(), anchor='lt')
+        logger.debug("Text drawn on surface with color: {}", self._font_color.to_tuple())
+        surface = np.asarray(text_surface)
+        self._surface_cache.put(cache_key, surface, text_width, text_height)
+        return surface, text_width, text_height
+
+    @timed("render")
+    def render_into(self, image: np.ndarray) -> Optional[tuple[int, int, int, int]]:
+        """
+        Alpha-blends the text into a BGR image in place. Only the region covered by the
+        padded text surface is read and written, so the cost follows the text area.
 
-            # Paste text surface onto main image, adjusting for bbox offset
-            paste_x = self._position.x
-            paste_y = self._position.y
-            # Clamp to ensure text stays within image
-            paste_x = max(0, min(paste_x, image_pil.width - text_width))
-            paste_y = max(0, min(paste_y, image_pil.height - text_height))
-            logger.debug(f"Pasting text at ({paste_x}, {paste_y}), text size ({text_width}, {text_height}), surface size ({surface_width}, {surface_height}), image size ({image_pil.width}, {image_pil.height})")
+        Args:
+            image: A writable (height, width, 3) uint8 BGR array.
 
-            image_pil.paste(text_surface, (paste_x, paste_y), text_surface)
+        Returns:
+            The updated region as (x, y, width, height), or None if the text couldn't be drawn.
+        """
+        try:
+            if not isinstance(image, np.ndarray) or image.ndim != 3 or image.shape[2] != 3:
+                logger.error("Render: Invalid background image input.")
+                return None
 
-            # Convert back to OpenCV BGR
-            image_cv = cv2.cvtColor(np.array(image_pil), cv2.COLOR_RGBA2BGR)
-            logger.debug(f"Rendered image shape: {image_cv.shape}")
+            rasterized = self._rasterize()
+            if rasterized is None:
+                return None
+            surface, text_width, text_height = rasterized
+            image_height, image_width = image.shape[:2]
+            surface_height, surface_width = surface.shape[:2]
 
-            return image_cv
+            # Clamp to ensure text stays within image
+            paste_x = max(0, min(self._position.x, image_width - text_width))
+            paste_y = max(0, min(self._position.y, image_height - text_height))
+            logger.debug("Pasting text at ({}, {}), text size ({}, {}), surface size ({}, {}), image size ({}, {})",
+                         paste_x, paste_y, text_width, text_height, surface_width, surface_height, image_width, image_height)
+
+            # the text starts `TEXT_PADDING` pixels inside the surface, which may overflow the image
+            surface_x = paste_x - TEXT_PADDING
+            surface_y = paste_y - TEXT_PADDING
+            roi_x, roi_y = max(0, surface_x), max(0, surface_y)
+            roi_width = min(image_width, surface_x + surface_width) - roi_x
+            roi_height = min(image_height, surface_y + surface_height) - roi_y
+            if roi_width <= 0 or roi_height <= 0:
+                logger.error("Render: Text surface is outside the image.")
+                return None
+            roi = image[roi_y:roi_y + roi_height, roi_x:roi_x + roi_width]
+            surface = surface[roi_y - surface_y:roi_y - surface_y + roi_height,
+                              roi_x - surface_x:roi_x - surface_x + roi_width]
+
+            # same rounding as PIL's paste with an alpha mask: (v + 128 + ((v + 128) >> 8)) >> 8
+            alpha = surface[:, :, 3:4].astype(np.uint16)
+            blended = surface[:, :, 2::-1].astype(np.uint16) * alpha
+            blended += roi.astype(np.uint16) * (255 - alpha)
+            blended += 128
+            blended += blended >> 8
+            blended >>= 8
+            roi[...] = blended
+            return roi_x, roi_y, roi_width, roi_height
 
         except Exception as exc:
             logger.error(f"Error rendering text: {exc}", exc_info=True)
-            return None
\ No newline at end of file
+            return None
+
+    def render(self, background_image: np.ndarray) -> Optional[np.ndarray]:
+        """Returns a copy of the BGR image with the text drawn on it."""
+        if not isinstance(background_image, np.ndarray) or background_image.ndim != 3:
+            logger.error("Render: Invalid background image input.")
+            return None
+        image_cv = background_image.copy()
+        if self.render_into(image_cv) is None:
+            return None
+        logger.debug("Rendered image shape: {}", image_cv.shape)
+        return image_cv
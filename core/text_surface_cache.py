@@ -0,0 +1,61 @@
+import os
+import threading
+from typing import Optional, Tuple
+
+import numpy as np
+
+from common.logger import logger
+from common.lru import ByteLRUCache, CacheStats
+
+# (text, font path, font size, RGBA color, anchor)
+TextSurfaceKey = Tuple[str, str, int, Tuple[int, int, int, int], str]
+# (RGBA surface, text width, text height)
+TextSurface = Tuple[np.ndarray, int, int]
+
+
+class TextSurfaceCache:
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        """
+        LRU cache of rasterized RGBA text surfaces, so moving or re-compositing a caption
+        doesn't go through FreeType again.
+
+        Args:
+            max_bytes: Memory budget for the stored surfaces. Zero disables the cache.
+        """
+        self._lru: ByteLRUCache = ByteLRUCache(max_bytes)
+
+    @property
+    def enabled(self) -> bool:
+        return self._lru.enabled
+
+    def get(self, key: TextSurfaceKey) -> Optional[TextSurface]:
+        """Returns the cached (read-only surface, text width, text height), or None."""
+        return self._lru.get(key)
+
+    def put(self, key: TextSurfaceKey, surface: np.ndarray, text_width: int, text_height: int) -> None:
+        if not self.enabled:
+            return
+        surface.flags.writeable = False
+        if not self._lru.put(key, (surface, text_width, text_height), surface.nbytes):
+            logger.debug("Text surface of {} bytes exceeds the cache budget, not cached", surface.nbytes)
+
+    def clear(self) -> None:
+        self._lru.clear()
+
+    def stats(self) -> CacheStats:
+        return self._lru.stats()
+
+
+_cache: Optional[TextSurfaceCache] = None
+_cache_lock: threading.Lock = threading.Lock()
+
+
+def get_text_surface_cache() -> TextSurfaceCache:
+    """Returns the process-wide cache configured by $TEXT_CACHE_MAX_BYTES."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            max_bytes: int = int(os.getenv("TEXT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+            _cache = TextSurfaceCache(max_bytes=max_bytes)
+            logger.info(f"Text surface cache created: {max_bytes} bytes")
+        return _cache
@@ -0,0 +1,209 @@
+import os
+import queue
+import threading
+from dataclasses import dataclass
+from typing import Any, Optional
+
+import cv2
+import numpy as np
+
+from common.logger import logger
+from core.foreground import Foreground
+from core.text import TextFT
+
+# marks the end of the frames in the pipeline queues
+_END = None
+
+
+class VideoTooLongError(ValueError):
+    """The video has more frames than allowed."""
+
+
+@dataclass
+class VideoStats:
+    frames: int = 0
+    segmented_frames: int = 0
+    width: int = 0
+    height: int = 0
+    fps: float = 0.0
+
+
+class VideoComposer:
+    def __init__(self,
+                 text: TextFT,
+                 foreground: Optional[Foreground] = None,
+                 threshold: float = 0.95,
+                 mask_every: int = 1,
+                 smoothing: float = 0.0,
+                 queue_size: int = 8,
+                 max_frames: int = 0):
+        """
+        Puts the text behind the subject of every frame of a video.
+
+        The frames flow through a reader thread, the compositing thread and a writer thread
+        connected by bounded queues, so the memory stays constant for any clip length. The
+        text position and size are computed on the first frame and its surface is rasterized
+        once; the segmentation runs at reduced resolution and can be skipped on some frames.
+        The audio track is not copied.
+
+        Args:
+            text: The text to draw.
+            foreground: The segmenter. Defaults to one limited to $VIDEO_SEGMENTATION_MAX_SIDE (256).
+            threshold: Probability above which a pixel belongs to the subject.
+            mask_every: Segment one frame out of `mask_every`, the others reuse the last mask.
+            smoothing: Weight of the previous probabilities in the temporal average (0 disables it).
+            queue_size: Frames buffered between the pipeline stages.
+            max_frames: Frames composed at most, 0 disables the limit. The frame count of
+                        the header is checked first, the frames read are counted as well
+                        since the header can be wrong.
+        """
+        if mask_every < 1:
+            raise ValueError(f"mask_every must be at least 1, got {mask_every}")
+        if not 0.0 <= smoothing < 1.0:
+            raise ValueError(f"smoothing must be in [0, 1), got {smoothing}")
+        self._text: TextFT = text
+        self._foreground: Foreground = foreground if foreground is not None else Foreground(
+            max_side=int(os.getenv("VIDEO_SEGMENTATION_MAX_SIDE", "256")))
+        self._threshold: float = threshold
+        self._mask_every: int = mask_every
+        self._smoothing: float = smoothing
+        self._queue_size: int = queue_size
+        self._max_frames: int = max_frames
+
+    def process(self, input_path: str, output_path: str, fourcc: str = "mp4v") -> VideoStats:
+        """
+        Composes the video at `input_path` into `output_path`.
+
+        Raises:
+            VideoTooLongError: If the video has more than `max_frames` frames.
+            ValueError: If the input can't be read or the output can't be written.
+            RuntimeError: If a frame can't be composed.
+        """
+        capture = cv2.VideoCapture(input_path)
+        if not capture.isOpened():
+            raise ValueError(f"Cannot open the video '{input_path}'")
+        announced = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        if self._max_frames and announced > self._max_frames:
+            capture.release()
+            raise VideoTooLongError(f"Video of {announced} frames exceeds {self._max_frames} frames")
+        stats = VideoStats(width=int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                           height=int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                           fps=capture.get(cv2.CAP_PROP_FPS) or 25.0)
+        writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*fourcc), stats.fps,
+                                 (stats.width, stats.height))
+        if not writer.isOpened():
+            capture.release()
+            raise ValueError(f"Cannot write the video '{output_path}' with codec '{fourcc}'")
+        logger.info(f"Composing video {input_path} ({stats.width}x{stats.height} at {stats.fps:.2f} fps)")
+
+        frames_in: queue.Queue = queue.Queue(maxsize=self._queue_size)
+        frames_out: queue.Queue = queue.Queue(maxsize=self._queue_size)
+        stop = threading.Event()
+        errors: list[BaseException] = []
+
+        reader = threading.Thread(target=self._read, args=(capture, frames_in, stop, errors), name="video-reader")
+        writer_thread = threading.Thread(target=self._write, args=(writer, frames_out, stop, errors), name="video-writer")
+        reader.start()
+        writer_thread.start()
+        try:
+            self._compose_frames(frames_in, frames_out, stop, stats)
+        except BaseException as exc:
+            errors.append(exc)
+            stop.set()
+        finally:
+            self._put(frames_out, _END, stop, force=True)
+            reader.join()
+            writer_thread.join()
+            capture.release()
+            writer.release()
+        if errors:
+            if isinstance(errors[0], VideoTooLongError):
+                raise errors[0]
+            raise RuntimeError(f"Video composition failed: {errors[0]}") from errors[0]
+        logger.info(f"Video composed: {stats.frames} frame(s), {stats.segmented_frames} segmented")
+        return stats
+
+    @staticmethod
+    def _put(target: queue.Queue, item: Any, stop: threading.Event, force: bool = False) -> None:
+        # a blocking put would never return if the other side stopped after an error
+        while True:
+            try:
+                target.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                if stop.is_set():
+                    if not force:
+                        return
+                    try:
+                        target.get_nowait()
+                    except queue.Empty:
+                        pass
+
+    def _read(self, capture: cv2.VideoCapture, frames_in: queue.Queue, stop: threading.Event,
+              errors: list) -> None:
+        try:
+            while not stop.is_set():
+                success, frame = capture.read()
+                if not success:
+                    break
+                self._put(frames_in, frame, stop)
+        except BaseException as exc:
+            errors.append(exc)
+            stop.set()
+        finally:
+            self._put(frames_in, _END, stop, force=True)
+
+    def _write(self, writer: cv2.VideoWriter, frames_out: queue.Queue, stop: threading.Event,
+               errors: list) -> None:
+        try:
+            while True:
+                frame = frames_out.get()
+                if frame is _END:
+                    break
+                if not stop.is_set():
+                    writer.write(frame)
+        except BaseException as exc:
+            errors.append(exc)
+            stop.set()
+
+    def _compose_frames(self, frames_in: queue.Queue, frames_out: queue.Queue, stop: threading.Event,
+                        stats: VideoStats) -> None:
+        probability: Optional[np.ndarray] = None
+        mask: Optional[np.ndarray] = None
+        region: Optional[tuple[int, int, int, int]] = None
+        while not stop.is_set():
+            frame = frames_in.get()
+            if frame is _END:
+                break
+            if self._max_frames and stats.frames >= self._max_frames:
+                raise VideoTooLongError(f"Video exceeds {self._max_frames} frames")
+            if stats.frames == 0 and self._text.is_position_zero():
+                self._text.compute_auto_position(frame)
+
+            if mask is None or stats.frames % self._mask_every == 0:
+                current = self._foreground.predict(frame)
+                if current is None:
+                    raise RuntimeError(f"Segmentation failed on frame {stats.frames}")
+                if probability is not None and self._smoothing > 0.0 and probability.shape == current.shape:
+                    # exponential moving average, damps the flickering of the edges between frames
+                    cv2.addWeighted(probability, self._smoothing, current, 1.0 - self._smoothing, 0.0, dst=current)
+                probability = current
+                mask = Foreground.probability_to_mask(probability, stats.width, stats.height, self._threshold)
+                stats.segmented_frames += 1
+
+            # the text is drawn in place, so only the pixels of its region are saved beforehand
+            # to copy the subject back on top of it; the text region is the same on every frame
+            if region is None:
+                original = frame.copy()
+                region = self._text.render_into(frame)
+                if region is None:
+                    raise RuntimeError(f"Text rendering failed on frame {stats.frames}")
+                cv2.copyTo(original, mask, frame)
+            else:
+                x, y, width, height = region
+                original = frame[y:y + height, x:x + width].copy()
+                if self._text.render_into(frame) is None:
+                    raise RuntimeError(f"Text rendering failed on frame {stats.frames}")
+                np.copyto(frame[y:y + height, x:x + width], original, where=mask[y:y + height, x:x + width, np.newaxis] > 0)
+            stats.frames += 1
+            self._put(frames_out, frame, stop)
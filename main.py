@@ -5,12 +5,13 @@ from core.foreground import Foreground, ForegroundInterface
 from core.background import Background, BackgroundInterface
 from core.text import TextFT
 from common.utils import Position, RGBAColor, HorizontalAlignment, VerticalAlignment
-from common.logger import logger
+from common.logger import configure_logging, logger
 from dotenv import load_dotenv
 from pathlib import Path
 
 if __name__ == "__main__":
     load_dotenv()
+    configure_logging()
     image_loader: ImageLoaderInterface = ImageLoaderFromFile()
     foreground: ForegroundInterface = Foreground()
     background: BackgroundInterface = Background()
@@ -0,0 +1,45 @@
+import argparse
+
+from dotenv import load_dotenv
+
+from common.logger import configure_logging, logger
+from common.utils import RGBAColor, HorizontalAlignment, VerticalAlignment
+from core.foreground import Foreground
+from core.text import TextFT
+from core.video import VideoComposer
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Puts a text behind the subject of a video")
+    parser.add_argument("input", help="input video file")
+    parser.add_argument("output", help="output video file (MP4, no audio)")
+    parser.add_argument("--text", default="example")
+    parser.add_argument("--font-size", type=int, default=None)
+    parser.add_argument("--font", default=None, help="font name, the first available one by default")
+    parser.add_argument("--color", default="128,128,128,255", help="R,G,B[,A]")
+    parser.add_argument("--h-align", choices=[item.value for item in HorizontalAlignment], default="center")
+    parser.add_argument("--v-align", choices=[item.value for item in VerticalAlignment], default="center")
+    parser.add_argument("--mask-every", type=int, default=1, help="segment one frame out of N")
+    parser.add_argument("--smoothing", type=float, default=0.0, help="temporal smoothing of the mask, in [0, 1)")
+    parser.add_argument("--max-side", type=int, default=None, help="segmentation resolution")
+    parser.add_argument("--fourcc", default="mp4v")
+    args = parser.parse_args()
+
+    load_dotenv()
+    configure_logging()
+    try:
+        text_ft: TextFT = TextFT(
+            args.text,
+            font_size=args.font_size,
+            h_align=HorizontalAlignment(args.h_align),
+            v_align=VerticalAlignment(args.v_align),
+            font_color=RGBAColor(*[int(value) for value in args.color.split(",")])
+        )
+        if args.font:
+            text_ft.font_type = args.font
+        foreground = Foreground(max_side=args.max_side) if args.max_side is not None else None
+        composer = VideoComposer(text_ft, foreground=foreground, mask_every=args.mask_every, smoothing=args.smoothing)
+        stats = composer.process(args.input, args.output, fourcc=args.fourcc)
+        logger.info(f"Done: {stats}")
+    except Exception as exc:
+        logger.exception(f"{exc}")
+        exit(1)
@@ -0,0 +1,13 @@
+import io
+import zipfile
+
+from app.services.archive import stream_zip
+
+def test_stream_zip():
+    entries = [("a.png", b"first"), ("b.png", b"second" * 100)]
+    chunks = list(stream_zip(iter(entries)))
+    # one chunk per entry plus the central directory
+    assert len(chunks) == 3
+    archive = zipfile.ZipFile(io.BytesIO(b"".join(chunks)))
+    assert archive.namelist() == ["a.png", "b.png"]
+    assert archive.read("b.png") == b"second" * 100
@@ -0,0 +1,151 @@
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+from app.schemas.text import TextParameters
+from app.services import composition
+from app.services.composition import AssetRef, CompositionError, compose_image, open_image
+from core import asset_store
+from core.asset_store import AssetNotFoundError, AssetStore
+from core.image_loader_from_asset import ImageLoaderFromAsset
+from tests.conftest import setup_real
+
+def _image(height: int = 120, width: int = 160, value: int = 90) -> np.ndarray:
+    return np.full((height, width, 3), value, dtype=np.uint8)
+
+def _mask(height: int = 120, width: int = 160) -> np.ndarray:
+    mask = np.zeros((height, width), dtype=np.uint8)
+    cv2.circle(mask, (width // 2, height // 2), min(width, height) // 4, 255, -1)
+    return mask
+
+def test_put_and_open(tmp_path):
+    store = AssetStore(str(tmp_path))
+    asset_id = store.make_id(b"encoded")
+    assert asset_id == store.make_id(b"encoded") != store.make_id(b"other")
+    assert not store.contains(asset_id)
+    info = store.put(asset_id, _image(), "mask.npy", _mask())
+    assert (info.width, info.height) == (160, 120)
+    assert store.contains(asset_id)
+
+    image = store.open_image(asset_id)
+    assert isinstance(image, np.memmap)
+    assert np.array_equal(image, _image())
+    with pytest.raises(ValueError):
+        image[0, 0] = 0
+    assert np.array_equal(store.open_mask(asset_id, "mask.npy"), _mask())
+    assert store.open_mask(asset_id, "other.npy") is None
+    # staging folders never show up as assets
+    assert store.stats()["assets"] == 1
+
+def test_unknown_assets(tmp_path):
+    store = AssetStore(str(tmp_path))
+    for asset_id in ("0" * 32, "../../etc", ""):
+        assert not store.contains(asset_id)
+        with pytest.raises(AssetNotFoundError):
+            store.open_image(asset_id)
+    loader = ImageLoaderFromAsset(store=store)
+    assert not loader.set_source("0" * 32)
+    assert not loader.load()
+
+def test_lru_eviction(tmp_path):
+    image, mask = _image(), _mask()
+    store = AssetStore(str(tmp_path), max_bytes=int(2.5 * (image.nbytes + mask.nbytes)))
+    ids = [store.make_id(bytes([index])) for index in range(3)]
+    store.put(ids[0], image, "mask.npy", mask)
+    store.put(ids[1], image, "mask.npy", mask)
+    mapped = store.open_image(ids[0])
+    # reading ids[0] makes ids[1] the least recently used
+    past = time.time() - 60
+    os.utime(tmp_path / ids[1], (past, past))
+    store.put(ids[2], image, "mask.npy", mask)
+    assert store.contains(ids[0]) and store.contains(ids[2])
+    assert not store.contains(ids[1])
+    # a mapped asset stays readable after its eviction
+    store.put(ids[1], image, "mask.npy", mask)
+    assert not store.contains(ids[0])
+    assert np.array_equal(mapped, image)
+
+def test_concurrent_put(tmp_path):
+    store = AssetStore(str(tmp_path))
+    asset_id = store.make_id(b"same upload")
+    errors = []
+
+    def put():
+        try:
+            store.put(asset_id, _image(), "mask.npy", _mask())
+        except Exception as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=put) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert store.stats()["assets"] == 1
+    assert sorted(path.name for path in tmp_path.iterdir()) == [asset_id]
+
+def test_loader_resizes_image_and_mask(tmp_path):
+    store = AssetStore(str(tmp_path))
+    asset_id = store.make_id(b"large")
+    store.put(asset_id, _image(400, 800), "mask.npy", _mask(400, 800))
+    loader = ImageLoaderFromAsset(store=store, max_side=200)
+    assert loader.set_source(asset_id) and loader.load()
+    assert loader.resized
+    assert loader.get_source().shape == (100, 200, 3)
+    mask = loader.get_mask("mask.npy")
+    assert mask.shape == (100, 200)
+    assert set(np.unique(mask)) <= {0, 255}
+
+    full = ImageLoaderFromAsset(store=store)
+    assert full.set_source(asset_id) and full.load()
+    assert not full.resized
+    assert full.get_source().shape == (400, 800, 3)
+
+def test_compose_stored_asset(setup_real, tmp_path, monkeypatch):
+    store = AssetStore(str(tmp_path))
+    monkeypatch.setattr(asset_store, "_store", store)
+    source = _image(300, 400)
+    asset_id = store.make_id(b"photo")
+    mask_name = composition._asset_mask_name(composition.Foreground(max_side=0))
+    # the subject in a corner, the text is centered
+    mask = np.zeros((300, 400), dtype=np.uint8)
+    mask[200:, 300:] = 255
+    store.put(asset_id, source, mask_name, mask)
+
+    # the stored mask is used, nothing is segmented
+    image_loader, foreground = open_image(AssetRef(asset_id), segmentation_max_side=0)
+    assert foreground.extract(image_loader.get_source())
+    assert np.array_equal(foreground.get_mask(), mask)
+
+    encoded = compose_image(AssetRef(asset_id), TextParameters(text="hello", font_size=60,
+                                                                segmentation_max_side=0))
+    output = cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+    assert output.shape == source.shape
+    # the foreground stays on top, the text changed the background somewhere
+    assert np.array_equal(output[250:, 350:], source[250:, 350:])
+    assert np.any(output != source)
+
+    with pytest.raises(CompositionError) as error:
+        compose_image(AssetRef("f" * 32), TextParameters(text="hello"))
+    assert error.value.status_code == 404
+
+def test_stale_folders_removed(tmp_path):
+    store = AssetStore(str(tmp_path), max_bytes=0)
+    stale_staging, stale_trash, live_staging = (tmp_path / ".staging-old", tmp_path / ".trash-old",
+                                                tmp_path / ".staging-live")
+    for folder in (stale_staging, stale_trash, live_staging):
+        folder.mkdir()
+        (folder / "image.npy").write_bytes(b"partial")
+    old = time.time() - 2 * asset_store._STALE_SECONDS
+    for folder in (stale_staging, stale_trash):
+        os.utime(folder, (old, old))
+    # left by processes killed mid-write, removed by the next write
+    store.put(store.make_id(b"photo"), _image(), "mask.npy", _mask())
+    assert not stale_staging.exists() and not stale_trash.exists()
+    # a recent one may be in use by a live process
+    assert live_staging.exists()
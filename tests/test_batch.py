@@ -0,0 +1,127 @@
+import io
+import json
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import endpoints
+from app.services.executor import BoundedExecutor, ExecutorSaturatedError
+from core import asset_store
+from core import foreground as foreground_module
+from core.asset_store import AssetStore
+from core.batch import BatchComposer, BatchResult
+from core.interfaces.segmenter import SegmentationResult
+from core.mask_cache import MaskCache
+from core.segmenter_pool import SegmenterPool
+from tests.conftest import setup_real
+
+class HalfSegmenter:
+    def process(self, image: np.ndarray) -> SegmentationResult:
+        probability = np.zeros(image.shape[:2], dtype=np.float32)
+        probability[:, :image.shape[1] // 2] = 1.0
+        return SegmentationResult(segmentation_mask=probability)
+
+    def close(self):
+        pass
+
+def _sleepy(index: int, image_data: bytes) -> BatchResult:
+    time.sleep(image_data[0] / 100)
+    return BatchResult(index=index, output=image_data)
+
+def test_completion_order():
+    pool = ThreadPoolExecutor(max_workers=3)
+    batch = BatchComposer(submit=lambda index, data: pool.submit(_sleepy, index, data), max_pending=3)
+    # the first image is the slowest one, it comes out last
+    results = list(batch.compose([bytes([30]), bytes([1]), bytes([10])]))
+    assert [result.index for result in results] == [1, 2, 0]
+    pool.shutdown()
+
+def test_window_and_saturation():
+    executor = BoundedExecutor(workers=1, queue_size=0)
+    pulled = []
+
+    def sources():
+        for index in range(4):
+            pulled.append(index)
+            yield bytes([2])
+
+    batch = BatchComposer(submit=lambda index, data: executor.submit(_sleepy, index, data), max_pending=4,
+                          busy=(ExecutorSaturatedError,), max_wait=5)
+    results = batch.compose(sources())
+    # the first image is admitted upfront, the next ones only once the executor has room
+    assert pulled == [0]
+    assert sorted(result.index for result in results) == [0, 1, 2, 3]
+    assert all(result.error is None for result in results)
+
+    release = threading.Event()
+    blocker = executor.submit(release.wait)
+    with pytest.raises(ExecutorSaturatedError):
+        batch.compose([bytes([1])])
+    release.set()
+    blocker.result(timeout=5)
+    executor.shutdown()
+
+@pytest.fixture
+def client(setup_real, monkeypatch):
+    pool = SegmenterPool(size=1, factory=lambda _: HalfSegmenter(), model_id="half")
+    monkeypatch.setattr(foreground_module, "get_segmenter_pool", lambda: pool)
+    monkeypatch.setattr(foreground_module, "get_mask_cache", lambda: MaskCache(max_bytes=0))
+    executor = BoundedExecutor(workers=2, queue_size=0)
+    monkeypatch.setattr(endpoints, "get_executor", lambda: executor)
+    app = FastAPI()
+    app.include_router(endpoints.router)
+    yield TestClient(app), executor
+    executor.shutdown()
+
+def _png(value: int) -> bytes:
+    return cv2.imencode(".png", np.full((120, 160, 3), value, dtype=np.uint8))[1].tobytes()
+
+def test_batch_endpoint_manifest(client):
+    test_client, _ = client
+    files = [("images", ("a.png", _png(50), "image/png")),
+             ("images", ("broken.png", b"not an image", "image/png")),
+             ("images", ("c.png", _png(200), "image/png"))]
+    response = test_client.post("/text-foreground/batch", files=files, params={"text": "hi", "font_size": 30})
+    assert response.status_code == 200
+    archive = zipfile.ZipFile(io.BytesIO(response.content))
+    manifest = json.loads(archive.read("manifest.json"))
+    assert [item["index"] for item in manifest] == [0, 1, 2]
+    assert [item["status"] for item in manifest] == ["ok", "error", "ok"]
+    # the broken image fails alone
+    assert manifest[1]["file"] is None and manifest[1]["error"]
+    assert sorted(archive.namelist()) == ["0000_a.png", "0002_c.png", "manifest.json"]
+    assert cv2.imdecode(np.frombuffer(archive.read("0000_a.png"), np.uint8), cv2.IMREAD_COLOR).shape == (120, 160, 3)
+
+def test_batch_endpoint_saturated(client):
+    test_client, executor = client
+    release = threading.Event()
+    blockers = [executor.submit(release.wait) for _ in range(2)]
+    response = test_client.post("/text-foreground/batch", files=[("images", ("a.png", _png(50), "image/png"))],
+                                params={"text": "hi"})
+    release.set()
+    for blocker in blockers:
+        blocker.result(timeout=5)
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+def test_batch_endpoint_assets(client, tmp_path, monkeypatch):
+    test_client, _ = client
+    store = AssetStore(str(tmp_path / "assets"))
+    monkeypatch.setattr(asset_store, "_store", store)
+    asset_id = test_client.post("/assets", files={"image": ("b.png", _png(120), "image/png")}).json()["asset_id"]
+    response = test_client.post("/text-foreground/batch", params={"text": "hi", "font_size": 30},
+                                files=[("images", ("a.png", _png(50), "image/png"))],
+                                data={"asset_ids": [asset_id, "f" * 32]})
+    assert response.status_code == 200
+    archive = zipfile.ZipFile(io.BytesIO(response.content))
+    manifest = json.loads(archive.read("manifest.json"))
+    assert [item["status"] for item in manifest] == ["ok", "ok", "error"]
+    assert f"0001_{asset_id}.png" in archive.namelist()
+    assert test_client.post("/text-foreground/batch", params={"text": "hi"}).status_code == 400
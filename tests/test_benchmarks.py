@@ -0,0 +1,37 @@
+import cv2
+import pytest
+import numpy as np
+
+from benchmarks.compare import compare
+from benchmarks.load import build_mix, percentile
+from benchmarks.synthetic import make_encoded, make_image
+
+def results(**medians) -> dict:
+    return {"cases": [{"case": "hd-short", "stages": {stage: {"median_ms": value} for stage, value in medians.items()}}]}
+
+def test_synthetic_image_is_deterministic():
+    assert np.array_equal(make_image(64, 48, seed=3), make_image(64, 48, seed=3))
+    image = make_encoded("vga")
+    assert cv2.imdecode(np.frombuffer(image.encoded, np.uint8), cv2.IMREAD_COLOR).shape == (480, 640, 3)
+
+def test_compare_threshold():
+    baseline = results(decode=10.0, encode=100.0, autofit=0.1)
+    current = results(decode=11.0, encode=130.0, autofit=0.3)
+    regressions = compare(current, baseline, threshold=0.15)
+    # decode is within the threshold and autofit under the noise floor
+    assert [(regression.metric, round(regression.ratio, 2)) for regression in regressions] == [("encode", 1.3)]
+    assert compare(current, {"cases": []}) == []
+
+def test_percentile():
+    values = [float(value) for value in range(1, 101)]
+    assert (percentile(values, 50), percentile(values, 95), percentile(values, 99)) == (50.0, 95.0, 99.0)
+    assert percentile([], 50) is None
+
+def test_build_mix():
+    payloads = build_mix("vga:short,vga:long", "jpeg")
+    assert [payload.name for payload in payloads] == ["vga:short", "vga:long"]
+    # the image of a resolution is encoded once and shared
+    assert payloads[0].image is payloads[1].image
+    assert payloads[1].params["output_format"] == "jpeg"
+    with pytest.raises(ValueError):
+        build_mix("tiny:short", None)
@@ -0,0 +1,93 @@
+from typing import Optional
+
+import cv2
+import numpy as np
+import pytest
+
+from common.utils import Position, RGBAColor
+from core.background import Background
+from core.composer import Composer
+from core.image_loader_from_file import ImageLoaderFromFile
+from core.interfaces.foreground import ForegroundInterface
+from core.text import TextFT
+from tests.conftest import setup_real
+
+class MaskForeground(ForegroundInterface):
+    """Foreground with a fixed mask: a disc in the middle of the image."""
+    def __init__(self):
+        self._mask: Optional[np.ndarray] = None
+
+    def extract(self, image: np.ndarray, threshold: float = 0.5) -> bool:
+        self._mask = np.zeros(image.shape[:2], dtype=np.uint8)
+        cv2.circle(self._mask, (image.shape[1] // 2, image.shape[0] // 2), image.shape[0] // 3, 255, -1)
+        return True
+
+    def get_foreground(self) -> Optional[np.ndarray]:
+        return None
+
+    def get_mask(self) -> Optional[np.ndarray]:
+        return self._mask
+
+    def get_mask3d(self) -> Optional[np.ndarray]:
+        return None
+
+@pytest.fixture
+def image_loader(tmp_path):
+    rng = np.random.default_rng(0)
+    path = str(tmp_path / "image.png")
+    cv2.imwrite(path, rng.integers(0, 255, (240, 400, 3), dtype=np.uint8))
+    loader = ImageLoaderFromFile()
+    loader.set_source(path)
+    return loader
+
+def compose(image_loader, text: TextFT) -> np.ndarray:
+    output, _ = Composer(image_loader, MaskForeground(), Background(), text).get_output()
+    return output
+
+def test_foreground_over_text(setup_real, image_loader):
+    text = TextFT("Behind", font_size=80, font_color=RGBAColor(255, 0, 0, 255))
+    output = compose(image_loader, text)
+    source = image_loader.get_source()
+    mask = MaskForeground()
+    mask.extract(source)
+    inside = mask.get_mask() > 0
+    assert np.array_equal(output[inside], source[inside])
+    assert not np.array_equal(output[~inside], source[~inside])
+
+def test_update_text_matches_full_composition(setup_real, image_loader):
+    composer = Composer(image_loader, MaskForeground(), Background(),
+                        TextFT("First", font_size=60, position=Position(10, 10)))
+    moved = TextFT("Second", font_size=50, position=Position(150, 120), font_color=RGBAColor(0, 0, 255, 200))
+    region = composer.update_text(moved)
+    assert region is not None
+    x, y, width, height = region
+    assert x <= 10 and y <= 10
+    assert x + width >= 150 and y + height >= 120
+    output, parameters = composer.get_output()
+    assert parameters["position"] == (150, 120)
+    expected = compose(image_loader, TextFT("Second", font_size=50, position=Position(150, 120),
+                                            font_color=RGBAColor(0, 0, 255, 200)))
+    assert np.array_equal(output, expected)
+
+def test_matches_three_channel_blend(setup_real, image_loader):
+    assert image_loader.load()
+    source = image_loader.get_source()
+    source_before = source.copy()
+    background = Background()
+    text = TextFT("Blend", font_size=70, position=Position(20, 30), font_color=RGBAColor(0, 255, 0, 180))
+    output, _ = Composer(image_loader, MaskForeground(), background, text).get_output()
+
+    # the blend before the single channel mask: np.where over the 3-channel mask and foreground
+    mask = MaskForeground()
+    mask.extract(source_before)
+    mask_3d = cv2.merge((mask.get_mask(),) * 3)
+    foreground = cv2.bitwise_and(source_before, mask_3d)
+    with_text = TextFT("Blend", font_size=70, position=Position(20, 30),
+                       font_color=RGBAColor(0, 255, 0, 180)).render(source_before.copy())
+    expected = np.where((mask_3d > 128).astype(np.uint8) * 255 == 255, foreground, with_text)
+    assert np.array_equal(output, expected)
+
+    # compositing in place never writes into the source or the background
+    assert np.array_equal(image_loader.get_source(), source_before)
+    assert np.array_equal(background.get_background(), source_before)
+    assert not np.shares_memory(output, source)
@@ -0,0 +1,49 @@
+import cv2
+import numpy as np
+import pytest
+
+from core.encoders import JPEGEncoder, PNGEncoder, WebPEncoder, get_encoder, negotiate_format
+
+@pytest.fixture
+def image() -> np.ndarray:
+    gradient = np.linspace(0, 255, 64, dtype=np.uint8)
+    return np.dstack([np.tile(gradient, (48, 1))] * 3)
+
+@pytest.mark.parametrize("encoder, media_type", [
+    (PNGEncoder(compression=0), "image/png"),
+    (PNGEncoder(compression=9), "image/png"),
+    (JPEGEncoder(quality=50), "image/jpeg"),
+    (WebPEncoder(quality=101), "image/webp"),
+])
+def test_encode_roundtrip(image, encoder, media_type):
+    buffer = encoder.encode(image)
+    assert encoder.media_type == media_type
+    assert buffer.ndim == 1 and buffer.dtype == np.uint8
+    decoded = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+    assert decoded.shape == image.shape
+    if isinstance(encoder, (PNGEncoder, WebPEncoder)):
+        # PNG and WebP above quality 100 are lossless
+        assert np.array_equal(decoded, image)
+
+def test_png_compression_level(image):
+    noisy = np.random.default_rng(0).integers(0, 8, image.shape, dtype=np.uint8) + image // 2
+    assert PNGEncoder(compression=9).encode(noisy).size < PNGEncoder(compression=0).encode(noisy).size
+
+def test_get_encoder():
+    assert get_encoder("jpg").extension == "jpg"
+    assert get_encoder("WEBP", 80).media_type == "image/webp"
+    with pytest.raises(ValueError):
+        get_encoder("gif")
+    with pytest.raises(ValueError):
+        get_encoder("png", 10)
+
+@pytest.mark.parametrize("accept, expected", [
+    (None, "png"),
+    ("*/*", "png"),
+    ("image/webp,image/*;q=0.8", "webp"),
+    ("image/png;q=0.5, image/jpeg", "jpeg"),
+    ("text/html, image/avif, image/*;q=0.1", "png"),
+    ("image/webp;q=0, image/gif", None),
+])
+def test_negotiate_format(accept, expected):
+    assert negotiate_format(accept, default="png") == expected
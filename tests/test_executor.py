@@ -0,0 +1,53 @@
+import asyncio
+import os
+import threading
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from app.services.executor import BoundedExecutor, ExecutorSaturatedError
+from common.logger import request_id_var
+
+def test_run():
+    executor = BoundedExecutor(workers=2, queue_size=0)
+    assert asyncio.run(executor.run(sum, [1, 2, 3])) == 6
+    executor.shutdown()
+
+def test_saturation_and_stats():
+    executor = BoundedExecutor(workers=1, queue_size=1, retry_after=7)
+    release = threading.Event()
+    running = executor.submit(release.wait)
+    waiting = executor.submit(release.wait)
+    assert executor.stats()["in_flight"] == 1
+    assert executor.stats()["queue_depth"] == 1
+    with pytest.raises(ExecutorSaturatedError) as exc_info:
+        executor.submit(release.wait)
+    assert exc_info.value.retry_after == 7
+    release.set()
+    running.result(timeout=5)
+    waiting.result(timeout=5)
+    executor.shutdown()
+    assert executor.stats()["in_flight"] == 0
+    assert executor.stats()["queue_depth"] == 0
+
+def test_invalid_kind():
+    with pytest.raises(ValueError):
+        BoundedExecutor(kind="fiber")
+
+def test_request_id_propagation():
+    executor = BoundedExecutor(workers=1, queue_size=0)
+    token = request_id_var.set("abc123")
+    try:
+        assert executor.submit(request_id_var.get).result(timeout=5) == "abc123"
+    finally:
+        request_id_var.reset(token)
+    assert executor.submit(request_id_var.get).result(timeout=5) == "-"
+    executor.shutdown()
+
+def test_process_pool_restarts_after_a_crash():
+    executor = BoundedExecutor(kind="process", workers=1, queue_size=1)
+    with pytest.raises(BrokenProcessPool):
+        executor.submit(os._exit, 1).result(timeout=30)
+    assert executor.submit(sum, [1, 2]).result(timeout=30) == 3
+    executor.shutdown()
+    assert executor.stats()["in_flight"] == 0
@@ -0,0 +1,98 @@
+import os
+from pathlib import Path
+from typing import Iterable
+
+import numpy as np
+import pytest
+from fontTools.fontBuilder import FontBuilder
+from fontTools.pens.ttGlyphPen import TTGlyphPen
+
+from core import font_catalog
+from core.font_catalog import Coverage, FontCatalog
+from core.fonts import Fonts
+from core.text import TextFT
+from tests.conftest import setup_real
+
+def _build_font(path: Path, family: str, style: str, characters: Iterable[str]) -> None:
+    """A font drawing every character as a filled box, 900 units wide on a 1000 units em."""
+    names = {ord(character): f"uni{ord(character):04X}" for character in characters}
+    glyph_order = [".notdef"] + list(names.values())
+    builder = FontBuilder(1000, isTTF=True)
+    builder.setupGlyphOrder(glyph_order)
+    builder.setupCharacterMap(names)
+    glyphs = {}
+    for name in glyph_order:
+        pen = TTGlyphPen(None)
+        pen.moveTo((100, 0))
+        pen.lineTo((100, 700))
+        pen.lineTo((800, 700))
+        pen.lineTo((800, 0))
+        pen.closePath()
+        glyphs[name] = pen.glyph()
+    builder.setupGlyf(glyphs)
+    builder.setupHorizontalMetrics({name: (900, 100) for name in glyph_order})
+    builder.setupHorizontalHeader(ascent=800, descent=-200)
+    builder.setupNameTable({"familyName": family, "styleName": style})
+    builder.setupOS2(sTypoAscender=800, sTypoDescender=-200, usWinAscent=800, usWinDescent=200)
+    builder.setupPost()
+    builder.save(str(path))
+
+@pytest.fixture
+def cjk_folder(setup_real) -> Path:
+    folder = Path(os.environ["FONT_FOLDER"])
+    os.environ["FONT_EXTENSION"] = "otf,ttf"
+    _build_font(folder / "Boxes.ttf", "Boxes", "Regular", "日本")
+    return folder
+
+def test_coverage():
+    coverage = Coverage.from_codepoints([0x41, 0x42, 0xE9, 0x65E5, 0x1F600])
+    assert 0x41 in coverage and 0x65E5 in coverage and 0x1F600 in coverage
+    assert 0x43 not in coverage and 0x65E6 not in coverage and 0x10FFFF not in coverage
+    assert len(coverage) == 5
+    restored = Coverage.from_dict(coverage.to_dict())
+    assert len(restored) == 5 and 0x1F600 in restored and 0x1F601 not in restored
+
+def test_catalog_entries(cjk_folder):
+    catalog = FontCatalog(Fonts())
+    qalogre, boxes = catalog.get("Qalogre"), catalog.get("Boxes")
+    assert (qalogre.family, qalogre.style) == ("Qalogre", "Regular")
+    assert (boxes.family, boxes.style) == ("Boxes", "Regular")
+    assert qalogre.covers(ord("é")) and not qalogre.covers(ord("日"))
+    assert boxes.covers(ord("日")) and not boxes.covers(ord("a"))
+    assert catalog.fallback_for(ord("日")) is boxes
+    assert catalog.fallback_for(ord("😀")) is None
+    assert (cjk_folder / ".font_catalog.json").is_file()
+
+def test_catalog_rebuilt_on_change(cjk_folder, monkeypatch):
+    FontCatalog(Fonts())
+    read = []
+    original = font_catalog.read_font
+    monkeypatch.setattr(font_catalog, "read_font", lambda name, path: read.append(name) or original(name, path))
+    # nothing changed, no font file is read
+    FontCatalog(Fonts())
+    assert read == []
+    stat = os.stat(cjk_folder / "Boxes.ttf")
+    os.utime(cjk_folder / "Boxes.ttf", ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    FontCatalog(Fonts())
+    assert read == ["Boxes"]
+
+def test_split_runs(cjk_folder):
+    fonts = Fonts()
+    catalog = FontCatalog(fonts)
+    qalogre, boxes = fonts.get_font("Qalogre"), fonts.get_font("Boxes")
+    assert catalog.split_runs("Hello", qalogre) == [("Hello", qalogre)]
+    assert catalog.split_runs("Hi 日本 ok", qalogre) == [("Hi ", qalogre), ("日本", boxes), (" ok", qalogre)]
+    # nobody covers it, the requested font draws it
+    assert catalog.split_runs("a😀", qalogre) == [("a😀", qalogre)]
+
+def test_text_falls_back(cjk_folder):
+    text_ft = TextFT("日本", font_size=100)
+    text_ft.font_type = "Qalogre"
+    assert text_ft.font_type.getname()[0] == "Qalogre"
+    # two boxes with an advance of 90 pixels
+    size = text_ft.get_text_size()
+    assert 150 <= size.x <= 180 and 60 <= size.y <= 80
+    image = np.zeros((200, 300, 3), dtype=np.uint8)
+    assert text_ft.render_into(image) is not None
+    # the boxes are filled, not outlined like missing glyphs
+    assert np.count_nonzero(image[:, :, 0]) > 0.8 * 2 * 70 * 70
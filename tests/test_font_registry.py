@@ -0,0 +1,44 @@
+import os
+import shutil
+from pathlib import Path
+
+from core.font_registry import FontRegistry
+from tests.conftest import setup_real, REAL_FONT_PATH
+
+def test_scan_once(setup_real):
+    registry = FontRegistry()
+    fonts = registry.get_fonts()
+    assert registry.get_fonts() is fonts
+    assert fonts.get_fonts() == ["Qalogre"]
+
+def test_refresh(setup_real):
+    registry = FontRegistry()
+    fonts = registry.get_fonts()
+    shutil.copy(REAL_FONT_PATH, Path(os.environ["FONT_FOLDER"]) / "Copy.otf")
+    # a new file is only seen after an explicit refresh
+    assert registry.get_fonts() is fonts
+    refreshed = registry.refresh()
+    assert refreshed is not fonts
+    assert sorted(refreshed.get_fonts()) == ["Copy", "Qalogre"]
+
+def test_rescan_on_config_change(setup_real, tmp_path):
+    registry = FontRegistry()
+    fonts = registry.get_fonts()
+    other_folder = tmp_path / "other"
+    other_folder.mkdir()
+    os.environ["FONT_FOLDER"] = str(other_folder)
+    assert registry.get_fonts() is not fonts
+    assert registry.get_fonts().get_fonts() == []
+
+def test_font_handles(setup_real):
+    registry = FontRegistry(max_handles=2)
+    path = registry.get_fonts().get_font("Qalogre")
+    handle = registry.get_font_handle(path, 50)
+    assert registry.get_font_handle(path, 50) is handle
+    assert registry.get_font_handle(path, 60) is not handle
+    registry.get_font_handle(path, 70)
+    # the size 50 handle was the least recently used one
+    assert registry.get_font_handle(path, 50) is not handle
+    stats = registry.stats()
+    assert stats["hits"] == 1
+    assert stats["handles"] == 2
@@ -0,0 +1,68 @@
+import cv2
+import numpy as np
+import pytest
+
+from app.schemas.text import TextParameters
+from app.services.composition import compose_image
+from core import foreground as foreground_module
+from core.foreground import Foreground
+from core.interfaces.segmenter import SegmentationResult
+from core.mask_cache import MaskCache
+from core.segmenter_pool import SegmenterPool
+from tests.conftest import setup_real
+
+class RecordingSegmenter:
+    """Marks the left half of the image as foreground and records the input shapes."""
+    def __init__(self, shapes: list):
+        self.shapes = shapes
+
+    def process(self, image: np.ndarray) -> SegmentationResult:
+        self.shapes.append(image.shape)
+        probability = np.zeros(image.shape[:2], dtype=np.float32)
+        probability[:, :image.shape[1] // 2] = 1.0
+        return SegmentationResult(segmentation_mask=probability)
+
+    def close(self):
+        pass
+
+@pytest.fixture
+def shapes(monkeypatch) -> list:
+    recorded = []
+    pool = SegmenterPool(size=1, factory=lambda _: RecordingSegmenter(recorded), model_id="recording")
+    monkeypatch.setattr(foreground_module, "get_segmenter_pool", lambda: pool)
+    monkeypatch.setattr(foreground_module, "get_mask_cache", lambda: MaskCache(max_bytes=0))
+    return recorded
+
+def test_downscaled_inference(shapes):
+    image = np.full((600, 800, 3), 100, dtype=np.uint8)
+    foreground = Foreground(max_side=200)
+    assert foreground.extract(image, 0.5)
+    assert shapes == [(150, 200, 3)]
+    mask = foreground.get_mask()
+    # the mask comes back at full resolution, binary
+    assert mask.shape == (600, 800)
+    assert set(np.unique(mask)) == {0, 255}
+    assert mask[300, 100] == 255 and mask[300, 700] == 0
+
+def test_max_side_zero_keeps_resolution(shapes):
+    image = np.full((600, 800, 3), 100, dtype=np.uint8)
+    assert Foreground(max_side=0).extract(image, 0.5)
+    # a smaller image than max_side isn't resized either
+    assert Foreground(max_side=1000).extract(image, 0.5)
+    assert shapes == [(600, 800, 3), (600, 800, 3)]
+
+def test_probability_to_mask():
+    probability = np.array([[0.2, 0.9], [0.6, 0.4]], dtype=np.float32)
+    mask = Foreground.probability_to_mask(probability, 4, 4, 0.5)
+    assert mask.shape == (4, 4) and mask.dtype == np.uint8
+    assert set(np.unique(mask)) <= {0, 255}
+    assert mask[0, 3] == 255 and mask[0, 0] == 0
+
+def test_request_overrides_environment(setup_real, shapes, monkeypatch):
+    monkeypatch.setenv("SEGMENTATION_MAX_SIDE", "100")
+    assert Foreground().max_side == 100
+    image = cv2.imencode(".png", np.full((300, 400, 3), 100, dtype=np.uint8))[1].tobytes()
+    compose_image(image, TextParameters(text="hi", font_size=40))
+    compose_image(image, TextParameters(text="hi", font_size=40, segmentation_max_side=40))
+    compose_image(image, TextParameters(text="hi", font_size=40, segmentation_max_side=0))
+    assert shapes == [(75, 100, 3), (30, 40, 3), (300, 400, 3)]
@@ -0,0 +1,101 @@
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+from pydantic import ValidationError
+
+from app.schemas.output import OutputParameters
+from app.services.composition import CompositionError, load_image
+from core.image_loader_from_buffer import ImageLoaderFromBuffer, ImageTooLargeError
+
+def encode(width: int, height: int, extension: str = ".jpg") -> bytes:
+    image = np.zeros((height, width, 3), dtype=np.uint8)
+    cv2.rectangle(image, (width // 4, height // 4), (width // 2, height // 2), (0, 200, 255), -1)
+    return cv2.imencode(extension, image)[1].tobytes()
+
+def load(buffer: bytes, **kwargs) -> ImageLoaderFromBuffer:
+    loader = ImageLoaderFromBuffer(**kwargs)
+    assert loader.set_source(buffer)
+    assert loader.load()
+    return loader
+
+def test_full_resolution():
+    loader = load(encode(640, 480), max_pixels=0)
+    assert loader.get_source().shape == (480, 640, 3)
+    assert loader.get_original_size() == (640, 480)
+
+@pytest.mark.parametrize("extension", [".jpg", ".png"])
+@pytest.mark.parametrize("max_side, expected", [(1000, (480, 640)), (320, (240, 320)), (200, (150, 200)), (50, (38, 50))])
+def test_reduced_decode(extension, max_side, expected):
+    loader = load(encode(640, 480, extension), max_side=max_side, max_pixels=0)
+    assert loader.get_source().shape[:2] == expected
+    assert loader.get_original_size() == (640, 480)
+
+def test_pixel_limit():
+    loader = ImageLoaderFromBuffer(max_pixels=640 * 480 - 1)
+    loader.set_source(encode(640, 480, ".png"))
+    with pytest.raises(ImageTooLargeError):
+        loader.load()
+    assert loader.get_source() is None
+
+def test_invalid_buffer():
+    loader = ImageLoaderFromBuffer()
+    loader.set_source(b"not an image")
+    assert not loader.load()
+
+def test_decompression_bomb(monkeypatch):
+    # Pillow's own limit, hit even with ours disabled
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 1000)
+    with pytest.raises(ImageTooLargeError):
+        ImageLoaderFromBuffer.probe(encode(640, 480, ".png"))
+    loader = ImageLoaderFromBuffer(max_pixels=0)
+    loader.set_source(encode(640, 480, ".png"))
+    with pytest.raises(ImageTooLargeError):
+        loader.load()
+
+def _encode_hdr(width: int, height: int) -> bytes:
+    # a format OpenCV decodes but Pillow doesn't identify
+    return cv2.imencode(".hdr", np.full((height, width, 3), 0.5, dtype=np.float32))[1].tobytes()
+
+def test_unprobed_format():
+    # the size is read from the header OpenCV writes, Pillow doesn't identify the format
+    assert ImageLoaderFromBuffer.probe(_encode_hdr(64, 48)) == (64, 48)
+    pfm = cv2.imencode(".pfm", np.full((48, 64, 3), 0.5, dtype=np.float32))[1].tobytes()
+    assert ImageLoaderFromBuffer.probe(pfm) == (64, 48)
+    loader = load(_encode_hdr(64, 48), max_pixels=0)
+    assert loader.get_source().shape == (48, 64, 3)
+    assert loader.get_original_size() == (64, 48)
+    assert load(_encode_hdr(64, 48), max_side=32, max_pixels=0).get_source().shape == (24, 32, 3)
+
+@pytest.mark.parametrize("buffer", [
+    _encode_hdr(64, 48),
+    # a crafted header, the pixels would never be decoded anyway
+    b"#?RADIANCE\nFORMAT=32-bit_rle_rgbe\n\n-Y 100000 +X 100000\n",
+    b"PF\n100000 100000\n-1\n",
+])
+def test_unprobed_format_pixel_limit(buffer, monkeypatch):
+    # the limit applies before decoding
+    monkeypatch.setattr(cv2, "imdecode", lambda *args: pytest.fail("decoded an image over the limit"))
+    loader = ImageLoaderFromBuffer(max_pixels=64 * 48 - 1)
+    loader.set_source(buffer)
+    with pytest.raises(ImageTooLargeError):
+        loader.load()
+    assert loader.get_source() is None
+
+def test_unknown_format_not_decoded(monkeypatch):
+    monkeypatch.setattr(cv2, "imdecode", lambda *args: pytest.fail("decoded an unknown format"))
+    loader = ImageLoaderFromBuffer()
+    loader.set_source(b"#?RADIANCE\nFORMAT=32-bit_rle_rgbe\n")
+    assert not loader.load()
+
+def test_output_max_side():
+    with pytest.raises(ValidationError):
+        OutputParameters(max_side=0)
+    assert OutputParameters(max_side=1).max_side == 1
+
+def test_load_image_oversized_hdr(monkeypatch):
+    monkeypatch.setenv("MAX_IMAGE_PIXELS", str(64 * 48 - 1))
+    monkeypatch.setattr(cv2, "imdecode", lambda *args: pytest.fail("decoded an image over the limit"))
+    with pytest.raises(CompositionError) as error:
+        load_image(_encode_hdr(64, 48))
+    assert error.value.status_code == 413
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from core.mask_cache import MaskCache
+
+def make_mask(height: int = 40, width: int = 30, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return (rng.random((height, width)) > 0.5).astype(np.uint8) * 255
+
+@pytest.mark.parametrize("packed", [True, False])
+def test_roundtrip(packed):
+    cache = MaskCache(max_bytes=1024 * 1024, packed=packed)
+    mask = make_mask()
+    cache.put("key", mask)
+    cached = cache.get("key")
+    assert cached is not None
+    assert cached.dtype == np.uint8
+    assert np.array_equal(cached, mask)
+
+def test_key_depends_on_settings():
+    image = np.zeros((10, 10, 3), dtype=np.uint8)
+    assert MaskCache.make_key(image, 0.5, 1) == MaskCache.make_key(image.copy(), 0.5, 1)
+    assert MaskCache.make_key(image, 0.5, 1) != MaskCache.make_key(image, 0.9, 1)
+    other = image.copy()
+    other[0, 0, 0] = 1
+    assert MaskCache.make_key(image, 0.5, 1) != MaskCache.make_key(other, 0.5, 1)
+
+def test_counters_and_eviction():
+    mask = make_mask(40, 40)
+    # each packed mask takes 200 bytes, so only two fit
+    cache = MaskCache(max_bytes=450, packed=True)
+    assert cache.get("a") is None
+    cache.put("a", mask)
+    cache.put("b", mask)
+    assert cache.get("a") is not None  # "b" becomes the least recently used
+    cache.put("c", mask)
+    assert cache.get("b") is None
+    stats = cache.stats()
+    assert stats.hits == 1
+    assert stats.misses == 2
+    assert stats.evictions == 1
+    assert stats.entries == 2
+    assert stats.size_bytes == 400
+
+def test_disabled():
+    cache = MaskCache(max_bytes=0)
+    assert not cache.enabled
+    cache.put("a", make_mask())
+    assert cache.get("a") is None
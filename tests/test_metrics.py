@@ -0,0 +1,71 @@
+import pytest
+
+from app.services import metrics as app_metrics
+from app.services.executor import BoundedExecutor
+from common.metrics import Counter, Gauge, Histogram, MetricsRegistry, _Metric
+
+def test_histogram_render():
+    histogram = Histogram("test_seconds", "Test durations", ["stage"], buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        histogram.observe(value, "decode")
+    lines = histogram.render()
+    assert lines[:2] == ["# HELP test_seconds Test durations", "# TYPE test_seconds histogram"]
+    assert 'test_seconds_bucket{stage="decode",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{stage="decode",le="1"} 3' in lines
+    assert 'test_seconds_bucket{stage="decode",le="+Inf"} 4' in lines
+    assert 'test_seconds_sum{stage="decode"} 6.05' in lines
+    assert 'test_seconds_count{stage="decode"} 4' in lines
+
+def test_histogram_time_records_failures():
+    histogram = Histogram("test_time_seconds", "Timed block")
+    with pytest.raises(RuntimeError):
+        with histogram.time():
+            raise RuntimeError("stage failed")
+    assert "test_time_seconds_count 1" in histogram.render()
+
+def test_registry_and_labels():
+    registry = MetricsRegistry()
+    counter = registry.register(Counter("test_total", "Counted", ["route"]))
+    gauge = registry.register(Gauge("test_in_flight", "Gauged"))
+    counter.inc('/a"b')
+    counter.inc('/a"b', amount=2)
+    gauge.inc()
+    gauge.dec()
+    text = registry.render()
+    assert 'test_total{route="/a\\"b"} 3' in text
+    assert "test_in_flight 0" in text
+    with pytest.raises(ValueError):
+        registry.register(Gauge("test_in_flight", "Duplicate"))
+    with pytest.raises(ValueError):
+        counter.inc()
+
+def test_metric_is_abstract():
+    with pytest.raises(TypeError):
+        _Metric("test_untyped", "No samples")
+
+def test_cache_counters(monkeypatch):
+    monkeypatch.setattr(app_metrics, "get_executor", lambda: BoundedExecutor(workers=1, queue_size=0))
+    text = app_metrics.render_metrics()
+    assert "# TYPE fore_text_cache_hits_total counter" in text
+    assert "# TYPE fore_text_cache_misses_total counter" in text
+    assert 'fore_text_cache_hits_total{cache="mask"}' in text
+    assert "fore_text_cache_hits{" not in text
+
+def test_metrics_disabled(monkeypatch):
+    counter = Counter("test_disabled_total", "Counted")
+    gauge = Gauge("test_disabled_in_flight", "Gauged")
+    histogram = Histogram("test_disabled_seconds", "Timed")
+    # the flag is read when recording, not when the module is imported
+    monkeypatch.setenv("METRICS_ENABLED", "0")
+    counter.inc()
+    counter.set_total(5)
+    gauge.set(3)
+    histogram.observe(0.5)
+    with histogram.time():
+        pass
+    assert counter.samples() == gauge.samples() == histogram.samples() == []
+    monkeypatch.setenv("METRICS_ENABLED", "1")
+    counter.inc()
+    histogram.observe(0.5)
+    assert counter.samples() == ["test_disabled_total 1"]
+    assert "test_disabled_seconds_count 1" in histogram.samples()
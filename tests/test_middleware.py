@@ -0,0 +1,29 @@
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from app.middleware import RequestIdMiddleware
+from common.logger import request_id_var
+
+def echo(request):
+    return PlainTextResponse(request_id_var.get())
+
+def make_client() -> TestClient:
+    app = Starlette(routes=[Route("/", echo)])
+    app.add_middleware(RequestIdMiddleware)
+    return TestClient(app)
+
+def test_request_id_forwarded():
+    response = make_client().get("/", headers={"X-Request-ID": "client-42"})
+    assert response.text == "client-42"
+    assert response.headers["X-Request-ID"] == "client-42"
+
+def test_request_id_generated():
+    client = make_client()
+    first = client.get("/", headers={"X-Request-ID": "bad id\n"})
+    second = client.get("/")
+    assert first.text == first.headers["X-Request-ID"] != "bad id\n"
+    assert len(first.text) == 16
+    assert first.text != second.text
+    assert request_id_var.get() == "-"
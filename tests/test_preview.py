@@ -0,0 +1,115 @@
+import threading
+
+import cv2
+import numpy as np
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import endpoints
+from app.services.executor import BoundedExecutor
+from app.services.sessions import SessionStore
+from core import asset_store
+from core import foreground as foreground_module
+from core.asset_store import AssetStore
+from core.interfaces.segmenter import SegmentationResult
+from core.mask_cache import MaskCache
+from core.segmenter_pool import SegmenterPool
+from tests.conftest import setup_real
+
+class HalfSegmenter:
+    def process(self, image: np.ndarray) -> SegmentationResult:
+        probability = np.zeros(image.shape[:2], dtype=np.float32)
+        probability[:, :image.shape[1] // 2] = 1.0
+        return SegmentationResult(segmentation_mask=probability)
+
+    def close(self):
+        pass
+
+@pytest.fixture
+def client(setup_real, monkeypatch):
+    pool = SegmenterPool(size=1, factory=lambda _: HalfSegmenter(), model_id="half")
+    monkeypatch.setattr(foreground_module, "get_segmenter_pool", lambda: pool)
+    monkeypatch.setattr(foreground_module, "get_mask_cache", lambda: MaskCache(max_bytes=0))
+    # a process executor: the session jobs must still run in this process
+    executor = BoundedExecutor(kind="process", workers=1, queue_size=0)
+    monkeypatch.setattr(endpoints, "get_executor", lambda: executor)
+    store = SessionStore()
+    monkeypatch.setattr(endpoints, "get_session_store", lambda: store)
+    app = FastAPI()
+    app.include_router(endpoints.router)
+    yield TestClient(app), executor
+    executor.shutdown()
+
+def _image() -> bytes:
+    return cv2.imencode(".png", np.full((120, 160, 3), 200, dtype=np.uint8))[1].tobytes()
+
+def test_session(client):
+    test_client, _ = client
+    with test_client.websocket_connect("/ws/preview") as websocket:
+        websocket.send_bytes(_image())
+        ready = websocket.receive_json()
+        assert (ready["type"], ready["width"], ready["height"]) == ("ready", 160, 120)
+        websocket.send_json({"type": "update", "params": {"text": "Hi", "font_size": 30}, "quality": "90"})
+        patch = websocket.receive_json()
+        assert patch["type"] == "patch" and patch["width"] > 0
+        assert len(websocket.receive_bytes()) > 0
+        websocket.send_json({"type": "preview", "max_side": 80})
+        preview = websocket.receive_json()
+        assert (preview["width"], preview["height"]) == (80, 60)
+        assert websocket.receive_bytes()[:2] == b"\xff\xd8"
+
+@pytest.mark.parametrize("message", [
+    '{"type": "update", "params": {"text": "Hi"}, "quality": "high"}',
+    '{"type": "preview", "max_side": "big"}',
+    '{"type": "preview", "max_side": 0}',
+    '{"type": "update", "params": ["text", "Hi"]}',
+    '{"type": "rotate"}',
+    '["update"]',
+    '"update"',
+    'not json',
+])
+def test_malformed_messages(client, message):
+    test_client, _ = client
+    with test_client.websocket_connect("/ws/preview") as websocket:
+        websocket.send_bytes(_image())
+        assert websocket.receive_json()["type"] == "ready"
+        websocket.send_text(message)
+        error = websocket.receive_json()
+        assert (error["type"], error["status"]) == ("error", 400)
+        # the session survives the bad message
+        websocket.send_json({"type": "preview"})
+        assert websocket.receive_json()["type"] == "preview"
+        websocket.receive_bytes()
+
+def test_saturated_executor(client):
+    test_client, executor = client
+    release = threading.Event()
+    blocker = executor.submit(release.wait, local=True)
+    try:
+        with test_client.websocket_connect("/ws/preview") as websocket:
+            websocket.send_bytes(_image())
+            error = websocket.receive_json()
+            assert (error["type"], error["status"], error["retry_after"]) == ("error", 503, 1)
+    finally:
+        release.set()
+        blocker.result(timeout=5)
+
+def test_session_on_asset(client, tmp_path, monkeypatch):
+    test_client, _ = client
+    store = AssetStore(str(tmp_path / "assets"))
+    monkeypatch.setattr(asset_store, "_store", store)
+    asset_id = store.make_id(b"photo")
+    # stored without the mask of these settings, the session segments it
+    store.put(asset_id, np.full((120, 160, 3), 200, dtype=np.uint8), "other.npy", np.zeros((120, 160), np.uint8))
+    with test_client.websocket_connect("/ws/preview") as websocket:
+        websocket.send_json({"type": "open", "asset_id": "f" * 32})
+        assert websocket.receive_json()["status"] == 404
+        websocket.send_json({"type": "open"})
+        assert websocket.receive_json()["status"] == 400
+        websocket.send_json({"type": "open", "asset_id": asset_id})
+        ready = websocket.receive_json()
+        assert (ready["type"], ready["width"], ready["height"]) == ("ready", 160, 120)
+        websocket.send_json({"type": "update", "params": {"text": "Hi", "font_size": 30}})
+        assert websocket.receive_json()["type"] == "patch"
+        assert len(websocket.receive_bytes()) > 0
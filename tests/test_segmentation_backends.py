@@ -0,0 +1,167 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+import core.segmentation_backends as backends
+from core.foreground import Foreground
+from core.interfaces.segmenter import SegmentationResult, SegmenterInterface
+from core.mask_cache import MaskCache
+from core.segmentation_backends import (SegmentationModel, create_segmenter, model_files, parse_input_size,
+                                       preload_model, register_backend)
+from core.segmenter_pool import SegmenterPool
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte, value = value & 0x7F, value >> 7
+        out.append(byte | 0x80 if value else byte)
+        if not value:
+            return bytes(out)
+
+def _field(number: int, payload) -> bytes:
+    if isinstance(payload, int):
+        return _varint(number << 3) + _varint(payload)
+    payload = payload.encode() if isinstance(payload, str) else payload
+    return _varint(number << 3 | 2) + _varint(len(payload)) + payload
+
+def _value_info(name: str, shape, element_type: int = 1) -> bytes:
+    dims = b"".join(_field(1, _field(1, side)) for side in shape)
+    return _field(1, name) + _field(2, _field(1, _field(1, element_type) + _field(2, dims)))
+
+def _mean_model(path: Path, size: int) -> str:
+    """An ONNX model (written by hand, the onnx package isn't needed) averaging the RGB channels."""
+    axes = _field(1, "axes") + _field(20, 7) + _field(8, 1)
+    keepdims = _field(1, "keepdims") + _field(20, 2) + _field(3, 1)
+    node = _field(1, "x") + _field(2, "y") + _field(4, "ReduceMean") + _field(5, axes) + _field(5, keepdims)
+    graph = (_field(1, node) + _field(2, "mean") + _field(11, _value_info("x", [1, 3, size, size]))
+             + _field(12, _value_info("y", [1, 1, size, size])))
+    path.write_bytes(_field(1, 7) + _field(7, graph) + _field(8, _field(1, "") + _field(2, 13)))
+    return str(path)
+
+def _int8_mean_model(path: Path, size: int) -> str:
+    """Like _mean_model with an int8 input, cast to float before the average."""
+    to_float = _field(1, "to") + _field(20, 2) + _field(3, 1)
+    cast = _field(1, "x") + _field(2, "xf") + _field(4, "Cast") + _field(5, to_float)
+    axes = _field(1, "axes") + _field(20, 7) + _field(8, 1)
+    keepdims = _field(1, "keepdims") + _field(20, 2) + _field(3, 1)
+    node = _field(1, "xf") + _field(2, "y") + _field(4, "ReduceMean") + _field(5, axes) + _field(5, keepdims)
+    graph = (_field(1, cast) + _field(1, node) + _field(2, "mean")
+             + _field(11, _value_info("x", [1, 3, size, size], element_type=3))
+             + _field(12, _value_info("y", [1, 1, size, size])))
+    path.write_bytes(_field(1, 7) + _field(7, graph) + _field(8, _field(1, "") + _field(2, 13)))
+    return str(path)
+
+def test_parse():
+    assert SegmentationModel.parse("mediapipe").model_id == "mediapipe:1"
+    assert SegmentationModel.parse("mediapipe:0").model_selection == 0
+    assert SegmentationModel.parse("opencv:model.onnx").backend == "opencv"
+    assert SegmentationModel.parse("model.tflite").backend == "opencv"
+    with pytest.raises(ValueError):
+        SegmentationModel.parse("unet_model.h5")
+    assert parse_input_size("320x240") == (320, 240)
+    assert parse_input_size("256") == (256, 256)
+    assert parse_input_size("") is None
+
+def test_parse_onnx_without_onnxruntime(monkeypatch):
+    monkeypatch.setattr(backends, "_has_onnxruntime", lambda: False)
+    assert SegmentationModel.parse("model.onnx").backend == "opencv"
+
+def test_from_env(monkeypatch):
+    monkeypatch.setenv("SEGMENTATION_MODEL", "opencv:model.onnx")
+    monkeypatch.setenv("SEGMENTATION_INPUT_SIZE", "128x96")
+    monkeypatch.setenv("SEGMENTATION_THREADS", "2")
+    model = SegmentationModel.from_env()
+    assert (model.backend, model.path, model.input_size, model.threads) == ("opencv", "model.onnx", (128, 96), 2)
+
+def test_opencv_segmenter(tmp_path):
+    model = SegmentationModel(backend="opencv", path=_mean_model(tmp_path / "mean.onnx", 16), input_size=(16, 16))
+    segmenter = create_segmenter(model)
+    image = np.zeros((64, 32, 3), dtype=np.uint8)
+    image[:, 16:] = 255
+    probability = segmenter.process(image).segmentation_mask
+    assert probability.shape == (16, 16)
+    assert probability[:, :7].max() == 0.0
+    assert probability[:, 9:].min() == pytest.approx(1.0)
+
+def test_missing_model_file(tmp_path):
+    with pytest.raises(ValueError):
+        create_segmenter(SegmentationModel(backend="opencv", path=str(tmp_path / "missing.onnx")))
+
+def test_multi_class_output(tmp_path):
+    model = SegmentationModel(backend="opencv", path=_mean_model(tmp_path / "mean.onnx", 4), foreground_class=1)
+    segmenter = create_segmenter(model)
+    logits = np.zeros((1, 2, 4, 4), dtype=np.float32)
+    logits[0, 1, :2] = 10.0
+    probability = segmenter._postprocess(logits)
+    assert probability[:2].min() > 0.99
+    assert probability[2:].max() == pytest.approx(0.5)
+
+def test_registered_backend_in_foreground(monkeypatch):
+    monkeypatch.setattr(backends, "_BACKENDS", dict(backends._BACKENDS))
+    class HalfSegmenter(SegmenterInterface):
+        def process(self, image: np.ndarray) -> SegmentationResult:
+            probability = np.zeros((8, 8), dtype=np.float32)
+            probability[:, 4:] = 1.0
+            return SegmentationResult(segmentation_mask=probability)
+
+        def close(self) -> None:
+            pass
+
+    register_backend("half", lambda model: HalfSegmenter())
+    model = SegmentationModel.parse("half:anything")
+    pool = SegmenterPool(size=1, factory=lambda _: create_segmenter(model), model_id=model.model_id)
+    foreground = Foreground(pool=pool, cache=MaskCache(max_bytes=0))
+    assert foreground.extract(np.zeros((40, 80, 3), dtype=np.uint8), 0.5)
+    mask = foreground.get_mask()
+    assert mask.shape == (40, 80)
+    assert mask[:, :30].max() == 0 and mask[:, 50:].min() == 255
+    assert pool.model_id == "half:anything:None:unit:1"
+    pool.close()
+
+def test_preloaded_model(tmp_path, monkeypatch):
+    monkeypatch.setattr(backends, "_model_bytes", {})
+    path = tmp_path / "mean.onnx"
+    model = SegmentationModel(backend="opencv", path=_mean_model(path, 16), input_size=(16, 16))
+    assert preload_model(model) == path.stat().st_size
+    # the segmenter is built from the bytes read ahead, not from the file
+    path.unlink()
+    image = np.full((16, 16, 3), 255, dtype=np.uint8)
+    assert create_segmenter(model).process(image).segmentation_mask.min() == pytest.approx(1.0)
+    mediapipe_files = model_files(SegmentationModel.parse("mediapipe:0"))
+    assert all(file.endswith("selfie_segmentation.tflite") for file in mediapipe_files)
+
+def _gray(value: int) -> np.ndarray:
+    return np.full((8, 8, 3), value, dtype=np.uint8)
+
+def test_int8_input(tmp_path):
+    model = SegmentationModel(backend="opencv", path=_int8_mean_model(tmp_path / "int8.onnx", 8), input_size=(8, 8))
+    segmenter = create_segmenter(model)
+    # what OnnxSegmenter detects from a tensor(int8) input
+    segmenter._quantized_input = np.dtype(np.int8)
+    # the pixels are shifted by -128, 255 doesn't wrap around to -1
+    for value, expected in ((0, -128.0), (128, 0.0), (200, 72.0), (255, 127.0)):
+        assert segmenter._infer(segmenter._preprocess(_gray(value))).max() == expected
+
+def test_int8_input_onnxruntime(tmp_path):
+    pytest.importorskip("onnxruntime")
+    model = SegmentationModel(backend="onnx", path=_int8_mean_model(tmp_path / "int8.onnx", 8), input_size=(8, 8))
+    segmenter = create_segmenter(model)
+    assert segmenter._quantized_input == np.int8
+    assert segmenter._infer(segmenter._preprocess(_gray(255))).max() == 127.0
+
+def test_file_segmenter_is_abstract(tmp_path):
+    model = SegmentationModel(backend="opencv", path=_mean_model(tmp_path / "mean.onnx", 4))
+    with pytest.raises(TypeError):
+        backends._FileSegmenter(model)
+
+def test_explicit_sigmoid(tmp_path):
+    path = _mean_model(tmp_path / "mean.onnx", 4)
+    logits = np.array([[[[-4.0, 0.0], [0.25, 0.75]]]], dtype=np.float32)
+    # without the setting the output is taken as probabilities, whatever its range
+    plain = create_segmenter(SegmentationModel(backend="opencv", path=path))._postprocess(logits)
+    assert plain.tolist() == [[-4.0, 0.0], [0.25, 0.75]]
+    squashed = create_segmenter(SegmentationModel(backend="opencv", path=path, sigmoid=True))._postprocess(logits)
+    assert squashed[0, 1] == pytest.approx(0.5)
+    assert squashed[1, 1] == pytest.approx(1.0 / (1.0 + np.exp(-0.75)))
+    assert SegmentationModel(backend="opencv", path=path, sigmoid=True).model_id.endswith(":sigmoid")
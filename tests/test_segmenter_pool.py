@@ -0,0 +1,94 @@
+import threading
+import pytest
+
+from core.segmenter_pool import SegmenterPool
+
+class FakeSegmenter:
+    def __init__(self, model_selection: int):
+        self.model_selection = model_selection
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+def test_reuse_segmenter():
+    pool = SegmenterPool(size=2, factory=FakeSegmenter)
+    with pool.acquire() as first:
+        pass
+    with pool.acquire() as second:
+        assert second is first
+    assert pool.created == 1
+    assert pool.idle == 1
+
+def test_size_bound():
+    pool = SegmenterPool(size=1, factory=FakeSegmenter)
+    with pool.acquire():
+        with pytest.raises(TimeoutError):
+            with pool.acquire(timeout=0.01):
+                pass
+    assert pool.created == 1
+
+def test_concurrent_checkout():
+    pool = SegmenterPool(size=3, factory=FakeSegmenter)
+    in_use = set()
+    lock = threading.Lock()
+    errors = []
+
+    def work():
+        for _ in range(50):
+            with pool.acquire(timeout=5) as segmenter:
+                with lock:
+                    if id(segmenter) in in_use:
+                        errors.append("segmenter shared between threads")
+                    in_use.add(id(segmenter))
+                with lock:
+                    in_use.discard(id(segmenter))
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert pool.created <= 3
+
+def test_warm_and_close():
+    pool = SegmenterPool(size=2, factory=FakeSegmenter)
+    assert pool.warm() == 2
+    assert pool.idle == 2
+    with pool.acquire() as segmenter:
+        pool.close()
+        assert pool.idle == 0
+    assert segmenter.closed
+    assert pool.created == 0
+    with pytest.raises(RuntimeError):
+        with pool.acquire():
+            pass
+
+def test_close_wakes_waiters():
+    pool = SegmenterPool(size=1, factory=FakeSegmenter)
+    errors = []
+
+    def wait():
+        try:
+            with pool.acquire(timeout=None):
+                pass
+        except RuntimeError as exc:
+            errors.append(exc)
+
+    with pool.acquire():
+        waiters = [threading.Thread(target=wait) for _ in range(3)]
+        for waiter in waiters:
+            waiter.start()
+        # let the waiters block on the empty pool
+        threading.Event().wait(0.05)
+        pool.close()
+        for waiter in waiters:
+            waiter.join(timeout=2)
+            assert not waiter.is_alive()
+    assert len(errors) == 3
+    assert pool.created == 0
+
+def test_invalid_size():
+    with pytest.raises(ValueError):
+        SegmenterPool(size=0)
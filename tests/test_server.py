@@ -0,0 +1,100 @@
+import json
+import os
+import queue
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from pathlib import Path
+
+import pytest
+
+from app.server import PreforkServer, read_memory
+from tests.conftest import setup_real
+
+def test_read_memory():
+    usage = read_memory(os.getpid())
+    assert usage is not None
+    assert usage.rss_mib > 0
+    assert usage.pss_mib <= usage.rss_mib
+    assert abs(usage.shared_mib + usage.private_mib - usage.rss_mib) < 1.0
+
+def test_read_memory_missing_process():
+    assert read_memory(2 ** 22 + 1) is None
+
+def test_prefork_server_needs_workers():
+    with pytest.raises(ValueError):
+        PreforkServer("127.0.0.1", 8000, 0)
+
+def test_startup_crashes_back_off(monkeypatch):
+    server = PreforkServer("127.0.0.1", 8000, 1, min_uptime=10.0, max_crashes=3)
+    now = time.monotonic()
+    server._started[0] = now
+    server._schedule_restart(0)
+    first = server._restarts[0] - now
+    server._schedule_restart(0)
+    assert server._restarts[0] - now > first >= 0.5
+    server._schedule_restart(0)
+    # the third crash in a row stops the server
+    assert server._failed and server._stopping
+    # a worker that lived long enough is restarted right away and its crashes forgotten
+    server = PreforkServer("127.0.0.1", 8000, 1, min_uptime=10.0, max_crashes=3)
+    server._crashes[0] = 2
+    server._started[0] = now - 60
+    server._schedule_restart(0)
+    assert server._crashes[0] == 0 and server._restarts[0] <= time.monotonic()
+
+def _get_root(port: int) -> dict:
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=10) as response:
+        return json.loads(response.read())
+
+def _wait_for(lines: "queue.Queue[str]", pattern: str, timeout: float = 60.0) -> re.Match:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            line = lines.get(timeout=max(0.0, deadline - time.monotonic()))
+        except queue.Empty:
+            break
+        match = re.search(pattern, line)
+        if match:
+            return match
+    pytest.fail(f"'{pattern}' not logged within {timeout} s")
+
+def test_prefork_workers(setup_real, tmp_path):
+    env = {**os.environ, "WARMUP": "0", "LOG_DIR": str(tmp_path / "logs"), "PYTHONUNBUFFERED": "1",
+           "SEGMENTATION_MODEL": "mediapipe"}
+    script = "import sys; from app.server import PreforkServer; " \
+             "sys.exit(PreforkServer('127.0.0.1', 0, 2, report_interval=0).serve())"
+    process = subprocess.Popen([sys.executable, "-c", script], cwd=Path(__file__).parent.parent, env=env,
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    lines: "queue.Queue[str]" = queue.Queue()
+    threading.Thread(target=lambda: [lines.put(line) for line in process.stdout], daemon=True).start()
+    try:
+        workers = {int(match.group(1)): int(match.group(2)) for match in
+                   (_wait_for(lines, r"Worker (\d) started with pid (\d+)") for _ in range(2))}
+        port = int(_wait_for(lines, r"Serving on http://127\.0\.0\.1:(\d+)").group(1))
+        _wait_for(lines, "Application startup complete")
+        _wait_for(lines, "Application startup complete")
+        # a stopped worker doesn't accept: each answer comes from the other one
+        for stopped in workers.values():
+            os.kill(stopped, signal.SIGSTOP)
+            try:
+                assert _get_root(port) == {"Test": "esmitt"}
+            finally:
+                os.kill(stopped, signal.SIGCONT)
+
+        os.kill(workers[0], signal.SIGKILL)
+        replacement = int(_wait_for(lines, r"Worker 0 started with pid (\d+)").group(1))
+        assert replacement not in workers.values()
+        _wait_for(lines, "Application startup complete")
+        os.kill(workers[1], signal.SIGSTOP)
+        try:
+            assert _get_root(port) == {"Test": "esmitt"}
+        finally:
+            os.kill(workers[1], signal.SIGCONT)
+    finally:
+        process.send_signal(signal.SIGTERM)
+        assert process.wait(timeout=30) == 0
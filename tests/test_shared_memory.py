@@ -0,0 +1,135 @@
+import asyncio
+import os
+import threading
+
+import cv2
+import numpy as np
+import pytest
+
+from app.schemas.text import TextParameters
+from app.services import shared_composition
+from app.services.executor import BoundedExecutor, ExecutorSaturatedError
+from app.services.shared_composition import SharedCompositionJob, compose_image_shared, compose_shared
+from core.foreground import MaskForeground
+from core.image_loader_from_array import ImageLoaderFromArray
+from core.mask_cache import MaskCache
+from core.shared_memory import SharedMemoryPool, attach
+from tests.conftest import setup_real
+
+def _exists(name: str) -> bool:
+    return os.path.exists(f"/dev/shm/{name.lstrip('/')}")
+
+def test_lease_reuse_and_close():
+    pool = SharedMemoryPool(max_idle_bytes=8 * 1024 * 1024)
+    with pool.lease((480, 640, 3)) as lease:
+        name = lease.descriptor.name
+        lease.array[:] = 7
+    with pool.lease((470, 630, 3)) as lease:
+        # a close size reuses the same power of two segment
+        assert lease.descriptor.name == name
+        assert lease.descriptor.shape == (470, 630, 3)
+    assert pool.stats()["reused"] == 1
+    assert pool.stats()["idle"] == 1
+    pool.close()
+    assert not _exists(name)
+    with pytest.raises(RuntimeError):
+        pool.lease((4, 4))
+
+def test_idle_budget():
+    pool = SharedMemoryPool(max_idle_bytes=0)
+    with pool.lease((16, 16)) as lease:
+        name = lease.descriptor.name
+    assert pool.stats()["idle"] == 0
+    assert not _exists(name)
+
+def test_attach_sees_the_lease():
+    pool = SharedMemoryPool()
+    with pool.lease((8, 8), np.float32) as lease:
+        lease.array[:] = 1.5
+        with attach((lease.descriptor,)) as (array,):
+            assert array.dtype == np.float32
+            assert float(array.sum()) == 96.0
+            array[0, 0] = 0.0
+            del array
+        assert lease.array[0, 0] == 0.0
+    pool.close()
+
+def test_mask_foreground():
+    image = np.zeros((20, 30, 3), dtype=np.uint8)
+    mask = np.zeros((20, 30), dtype=np.uint8)
+    mask[5:10, 5:10] = 255
+    foreground = MaskForeground(mask)
+    assert foreground.get_mask() is None
+    assert foreground.extract(image)
+    assert foreground.get_mask() is mask
+    assert foreground.get_mask3d().shape == (20, 30, 3)
+    assert not MaskForeground(mask).extract(np.zeros((10, 10, 3), dtype=np.uint8))
+
+def test_compose_shared_with_known_mask(setup_real):
+    pool = SharedMemoryPool()
+    source = np.full((300, 400, 3), 90, dtype=np.uint8)
+    with pool.lease(source.shape) as image, pool.lease(source.shape[:2]) as mask, \
+            pool.lease(source.shape) as output:
+        np.copyto(image.array, source)
+        mask.array[:] = 0
+        cv2.circle(mask.array, (200, 150), 60, 255, -1)
+        job = SharedCompositionJob(image=image.descriptor, mask=mask.descriptor, output=output.descriptor,
+                                   text_parameter=TextParameters(text="hello", font_size=60),
+                                   segmentation_max_side=0, mask_ready=True)
+        parameters = compose_shared(job)
+        assert parameters["text"] == "hello"
+        # the foreground stays on top, the text changed the background somewhere
+        assert np.array_equal(output.array[150, 200], source[150, 200])
+        assert np.any(output.array != source)
+    pool.close()
+
+@pytest.fixture
+def shared(monkeypatch):
+    pool = SharedMemoryPool()
+    monkeypatch.setattr(shared_composition, "get_shared_memory_pool", lambda: pool)
+    monkeypatch.setattr(shared_composition, "get_mask_cache", lambda: MaskCache(max_bytes=0))
+    executor = BoundedExecutor(kind="shared", workers=1, queue_size=0)
+    yield executor, pool
+    executor.shutdown()
+    pool.close()
+
+def test_saturated_before_decoding(shared, monkeypatch):
+    executor, pool = shared
+    monkeypatch.setattr(shared_composition, "load_image", lambda *args: pytest.fail("decoded a rejected request"))
+    release = threading.Event()
+    blocker = executor.submit(release.wait, local=True)
+    try:
+        with pytest.raises(ExecutorSaturatedError):
+            asyncio.run(compose_image_shared(executor, b"image", TextParameters(text="hi"), encoder=None))
+    finally:
+        release.set()
+        blocker.result(timeout=5)
+    assert pool.stats()["leased"] == 0
+
+def test_cancelled_while_preparing(shared, monkeypatch):
+    executor, pool = shared
+    decoding, release = threading.Event(), threading.Event()
+
+    def load_image(*args):
+        decoding.set()
+        release.wait(timeout=5)
+        loader = ImageLoaderFromArray()
+        loader.set_source(np.zeros((30, 40, 3), dtype=np.uint8))
+        loader.load()
+        return loader
+
+    monkeypatch.setattr(shared_composition, "load_image", load_image)
+
+    async def cancel():
+        task = asyncio.create_task(compose_image_shared(executor, b"image", TextParameters(text="hi"), encoder=None))
+        await asyncio.to_thread(decoding.wait, 5)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel())
+    # the segments leased after the cancellation go back to the pool
+    release.set()
+    executor.shutdown()
+    assert pool.stats()["leased"] == 0
+    assert pool.stats()["idle"] == 3
@@ -1,7 +1,9 @@
 import pytest
+import numpy as np
 
-from common.utils import RGBAColor, Position
+from common.utils import RGBAColor, Position, HorizontalAlignment, VerticalAlignment
 from core.text import TextFT
+from core.text_surface_cache import get_text_surface_cache
 from PIL.ImageFont import FreeTypeFont
 from tests.conftest import setup_real, setup_fake
 
@@ -39,3 +41,68 @@ def test_set_position(setup_real):
     assert tft_obj._position == Position(40, 50)
     tft_obj._position = Position(20, 25)
     assert tft_obj._position == Position(20, 25)
+
+def test_render_into(setup_real):
+    tft_obj = TextFT("Hello", font_size=50, position=Position(30, 40), font_color=RGBAColor(255, 0, 0, 255))
+    image = np.zeros((200, 300, 3), dtype=np.uint8)
+    region = tft_obj.render_into(image)
+    assert region is not None
+    x, y, width, height = region
+    # only the padded text region is written, in BGR order
+    assert image[y:y + height, x:x + width, 2].max() == 255
+    assert image[y:y + height, x:x + width, :2].max() == 0
+    outside = image.copy()
+    outside[y:y + height, x:x + width] = 0
+    assert outside.max() == 0
+    # the text itself is drawn at its position
+    text_size = tft_obj.get_text_size()
+    ys, xs = np.nonzero(image[:, :, 2])
+    assert xs.min() >= 30 and xs.max() < 30 + text_size.x
+    assert ys.min() >= 40 and ys.max() < 40 + text_size.y
+
+def test_render_keeps_input(setup_real):
+    tft_obj = TextFT("Hello", font_size=50, position=Position(10, 10))
+    image = np.zeros((200, 300, 3), dtype=np.uint8)
+    rendered = tft_obj.render(image)
+    assert rendered is not None
+    assert rendered.max() > 0
+    assert image.max() == 0
+
+def test_render_uses_surface_cache(setup_real):
+    cache = get_text_surface_cache()
+    cache.clear()
+    image = np.zeros((200, 300, 3), dtype=np.uint8)
+    TextFT("Cached", font_size=40, position=Position(5, 5)).render(image)
+    hits = cache.stats().hits
+    # same caption moved elsewhere by another instance: no new rasterization
+    moved = TextFT("Cached", font_size=40, position=Position(50, 60)).render(image)
+    assert moved is not None
+    assert cache.stats().hits == hits + 1
+    TextFT("Cached", font_size=40, font_color=RGBAColor(1, 2, 3)).render(image)
+    assert cache.stats().hits == hits + 1
+
+@pytest.mark.parametrize("h_align", list(HorizontalAlignment))
+@pytest.mark.parametrize("v_align", list(VerticalAlignment))
+def test_compute_auto_position_fits(setup_real, h_align, v_align):
+    tft_obj = TextFT("A long caption to fit", font_size=300, h_align=h_align, v_align=v_align)
+    image = np.zeros((300, 500, 3), dtype=np.uint8)
+    text_size, position = tft_obj.compute_auto_position(image)
+    assert tft_obj.font_size < 300
+    assert text_size == tft_obj.get_text_size()
+    assert 0 <= position.x and position.x + text_size.x <= 500
+    assert 0 <= position.y and position.y + text_size.y <= 300
+    # the size found is the largest one that fits
+    bigger = TextFT("A long caption to fit", font_size=tft_obj.font_size + 1).get_text_size()
+    assert bigger.x > 500 or bigger.y > 300
+
+def test_compute_auto_position_min_size(setup_real):
+    tft_obj = TextFT("Too long for a tiny image", font_size=100)
+    text_size, position = tft_obj.compute_auto_position(np.zeros((10, 20, 3), dtype=np.uint8))
+    assert tft_obj.font_size == 20
+    assert position == Position(0, 0)
+
+def test_compute_auto_position_keeps_size(setup_real):
+    tft_obj = TextFT("Hi", font_size=30, h_align=HorizontalAlignment.RIGHT, v_align=VerticalAlignment.BOTTOM)
+    text_size, position = tft_obj.compute_auto_position(np.zeros((300, 500, 3), dtype=np.uint8))
+    assert tft_obj.font_size == 30
+    assert position == Position(500 - text_size.x, 300 - text_size.y)
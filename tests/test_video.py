@@ -0,0 +1,191 @@
+import io
+import tempfile
+import threading
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import endpoints
+from app.services.composition import CompositionError, copy_video_upload
+from app.services.executor import BoundedExecutor
+from core import foreground as foreground_module
+from core import video as video_module
+from core.foreground import Foreground
+from core.interfaces.segmenter import SegmentationResult
+from core.mask_cache import MaskCache
+from core.segmenter_pool import SegmenterPool
+from core.text import TextFT
+from core.video import VideoComposer, VideoTooLongError
+from tests.conftest import setup_real
+
+WIDTH, HEIGHT, FRAMES = 64, 48, 10
+
+class CountingSegmenter:
+    """Marks the left half of the frame as foreground, fails from the `fail_at`-th call."""
+    def __init__(self, fail_at: int = 0):
+        self.calls = 0
+        self.fail_at = fail_at
+
+    def process(self, image: np.ndarray) -> SegmentationResult:
+        self.calls += 1
+        if self.fail_at and self.calls >= self.fail_at:
+            raise RuntimeError("segmenter failure")
+        probability = np.zeros(image.shape[:2], dtype=np.float32)
+        probability[:, :image.shape[1] // 2] = 1.0
+        return SegmentationResult(segmentation_mask=probability)
+
+    def close(self):
+        pass
+
+@pytest.fixture
+def segmenter(monkeypatch) -> CountingSegmenter:
+    fake = CountingSegmenter()
+    pool = SegmenterPool(size=1, factory=lambda _: fake, model_id="counting")
+    monkeypatch.setattr(foreground_module, "get_segmenter_pool", lambda: pool)
+    monkeypatch.setattr(foreground_module, "get_mask_cache", lambda: MaskCache(max_bytes=0))
+    return fake
+
+@pytest.fixture
+def clip(tmp_path: Path) -> Path:
+    path = tmp_path / "clip.avi"
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"MJPG"), 10, (WIDTH, HEIGHT))
+    assert writer.isOpened()
+    for index in range(FRAMES):
+        writer.write(np.full((HEIGHT, WIDTH, 3), 20 * index, dtype=np.uint8))
+    writer.release()
+    return path
+
+def _count_frames(path: Path) -> int:
+    capture = cv2.VideoCapture(str(path))
+    count = 0
+    while capture.read()[0]:
+        count += 1
+    capture.release()
+    return count
+
+def _pipeline_threads() -> list:
+    return [thread for thread in threading.enumerate() if thread.name in ("video-reader", "video-writer")]
+
+def _composer(**kwargs) -> VideoComposer:
+    return VideoComposer(TextFT("Hi", font_size=20), foreground=Foreground(max_side=0), **kwargs)
+
+def test_frames_and_mask_reuse(setup_real, segmenter, clip, tmp_path):
+    output = tmp_path / "out.avi"
+    stats = _composer(mask_every=3).process(str(clip), str(output), fourcc="MJPG")
+    # frames 0, 3, 6 and 9 are segmented, the others reuse the last mask
+    assert (stats.frames, stats.segmented_frames) == (FRAMES, 4)
+    assert segmenter.calls == 4
+    assert (stats.width, stats.height) == (WIDTH, HEIGHT)
+    assert _count_frames(output) == FRAMES
+
+def test_writer_failure_stops_workers(setup_real, segmenter, clip, tmp_path, monkeypatch):
+    video_writer = cv2.VideoWriter
+
+    class FailingWriter:
+        def __init__(self, *args):
+            self._writer = video_writer(*args)
+
+        def isOpened(self):
+            return self._writer.isOpened()
+
+        def write(self, frame):
+            raise OSError("disk full")
+
+        def release(self):
+            self._writer.release()
+
+    monkeypatch.setattr(video_module.cv2, "VideoWriter", FailingWriter)
+    # queues smaller than the clip: the reader and the compositor must not stay blocked on them
+    with pytest.raises(RuntimeError, match="disk full"):
+        _composer(queue_size=1).process(str(clip), str(tmp_path / "out.avi"), fourcc="MJPG")
+    assert _pipeline_threads() == []
+    assert segmenter.calls < FRAMES
+
+def test_compositor_failure_stops_workers(setup_real, segmenter, clip, tmp_path):
+    segmenter.fail_at = 3
+    with pytest.raises(RuntimeError, match="segmenter failure"):
+        _composer(queue_size=1).process(str(clip), str(tmp_path / "out.avi"), fourcc="MJPG")
+    assert _pipeline_threads() == []
+
+def test_invalid_arguments(setup_real, segmenter, tmp_path):
+    with pytest.raises(ValueError):
+        _composer(mask_every=0)
+    with pytest.raises(ValueError):
+        _composer(smoothing=1.0)
+    with pytest.raises(ValueError, match="Cannot open"):
+        _composer().process(str(tmp_path / "missing.avi"), str(tmp_path / "out.avi"))
+
+@pytest.fixture
+def client(setup_real, segmenter, tmp_path, monkeypatch):
+    executor = BoundedExecutor(workers=1, queue_size=0)
+    monkeypatch.setattr(endpoints, "get_executor", lambda: executor)
+    temporary = tmp_path / "tmp"
+    temporary.mkdir()
+    monkeypatch.setattr(tempfile, "tempdir", str(temporary))
+    app = FastAPI()
+    app.include_router(endpoints.router)
+    yield TestClient(app), temporary
+    executor.shutdown()
+
+def test_video_endpoint(client, segmenter, clip):
+    test_client, temporary = client
+    with open(clip, "rb") as clip_file:
+        response = test_client.post("/text-foreground/video", params={"text": "Hi", "font_size": 20, "mask_every": 2},
+                                    files={"video": ("clip.avi", clip_file, "video/x-msvideo")})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "video/mp4"
+    assert len(response.content) > 0
+    assert segmenter.calls == FRAMES // 2
+    # the uploaded and the composed files are removed once the response is sent
+    assert list(temporary.iterdir()) == []
+
+def test_video_endpoint_invalid_clip(client, segmenter):
+    test_client, temporary = client
+    response = test_client.post("/text-foreground/video", params={"text": "Hi"},
+                                files={"video": ("clip.mp4", b"not a video", "video/mp4")})
+    assert response.status_code == 400
+    assert segmenter.calls == 0
+    assert list(temporary.iterdir()) == []
+
+def test_max_frames(setup_real, segmenter, clip, tmp_path, monkeypatch):
+    with pytest.raises(VideoTooLongError):
+        _composer(max_frames=FRAMES - 1).process(str(clip), str(tmp_path / "out.avi"), fourcc="MJPG")
+    assert segmenter.calls == 0
+    # a header announcing fewer frames than the clip has doesn't get past the limit
+    monkeypatch.setattr(video_module.cv2, "CAP_PROP_FRAME_COUNT", cv2.CAP_PROP_POS_FRAMES)
+    with pytest.raises(VideoTooLongError):
+        _composer(max_frames=FRAMES - 1, queue_size=1).process(str(clip), str(tmp_path / "out.avi"), fourcc="MJPG")
+    assert segmenter.calls == FRAMES - 1
+    assert _pipeline_threads() == []
+
+def test_video_endpoint_too_large(client, segmenter, clip, monkeypatch):
+    test_client, temporary = client
+    monkeypatch.setenv("MAX_VIDEO_BYTES", "1024")
+    with open(clip, "rb") as clip_file:
+        response = test_client.post("/text-foreground/video", params={"text": "Hi"},
+                                    files={"video": ("clip.avi", clip_file, "video/x-msvideo")})
+    assert response.status_code == 413
+    assert segmenter.calls == 0
+    assert list(temporary.iterdir()) == []
+
+def test_video_endpoint_too_long(client, segmenter, clip, monkeypatch):
+    test_client, temporary = client
+    monkeypatch.setenv("MAX_VIDEO_FRAMES", str(FRAMES - 1))
+    with open(clip, "rb") as clip_file:
+        response = test_client.post("/text-foreground/video", params={"text": "Hi"},
+                                    files={"video": ("clip.avi", clip_file, "video/x-msvideo")})
+    assert response.status_code == 413
+    assert list(temporary.iterdir()) == []
+
+def test_copy_video_upload_counts_bytes(monkeypatch):
+    monkeypatch.setenv("MAX_VIDEO_BYTES", "10")
+    destination = io.BytesIO()
+    assert copy_video_upload(io.BytesIO(b"x" * 10), destination, chunk_size=4) == 10
+    # the size isn't announced: the copy stops once the limit is crossed
+    with pytest.raises(CompositionError) as error:
+        copy_video_upload(io.BytesIO(b"x" * 11), io.BytesIO(), chunk_size=4)
+    assert error.value.status_code == 413
@@ -0,0 +1,35 @@
+import os
+
+from app.services.executor import BoundedExecutor
+from app.services.warmup import WarmupState, warm_workers
+
+def test_warmup_state():
+    state = WarmupState()
+    assert not state.ready
+    assert state.to_dict()["status"] == "booted"
+    state.finish(1.5)
+    assert state.ready
+    assert state.to_dict()["warmup_s"] == 1.5
+
+def test_warmup_failure():
+    state = WarmupState()
+    state.finish(0.2, error="no fonts")
+    assert not state.ready
+    assert state.to_dict()["status"] == "failed"
+    assert state.to_dict()["error"] == "no fonts"
+
+def _noop() -> None:
+    pass
+
+def test_warm_workers():
+    executor = BoundedExecutor(kind="process", workers=2, queue_size=0)
+    try:
+        pids = warm_workers(executor, job=_noop, timeout=60)
+        # one job per worker process, none of them took two
+        assert len(set(pids)) == 2
+        assert os.getpid() not in pids
+    finally:
+        executor.shutdown()
+    thread_executor = BoundedExecutor(kind="thread", workers=2, queue_size=0)
+    assert warm_workers(thread_executor, job=_noop) == []
+    thread_executor.shutdown()